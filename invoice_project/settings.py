@@ -113,6 +113,27 @@ else:
         }
 
 
+# Cache shared by every web worker and the scheduler, so invalidations such
+# as invoices.pagination_utils.bump_list_version reach all of them. Redis
+# when REDIS_URL is set, otherwise a table in the database (created by
+# `manage.py createcachetable`, run from build.sh).
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'django_cache',
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -158,6 +179,29 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# With a bucket configured (see README), uploads and finished render jobs go
+# to S3-compatible storage, which the web and worker services share. The
+# access keys are read from AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY.
+if os.environ.get('AWS_STORAGE_BUCKET_NAME'):
+    STORAGES = {
+        'default': {'BACKEND': 'storages.backends.s3.S3Storage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    }
+    AWS_STORAGE_BUCKET_NAME = os.environ['AWS_STORAGE_BUCKET_NAME']
+    AWS_S3_REGION_NAME = os.environ.get('AWS_S3_REGION_NAME')
+    AWS_S3_ENDPOINT_URL = os.environ.get('AWS_S3_ENDPOINT_URL')
+    AWS_S3_CUSTOM_DOMAIN = os.environ.get('AWS_S3_CUSTOM_DOMAIN')
+
+# Cache of rendered PDF/DOCX exports (see invoices.artifact_cache)
+ARTIFACT_CACHE_DIR = BASE_DIR / 'artifact_cache'
+ARTIFACT_CACHE_MAX_BYTES = int(os.environ.get('ARTIFACT_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+# PDF engine for invoice/quotation exports: xhtml2pdf, weasyprint or reportlab (see invoices.pdf_engines)
+PDF_ENGINE = os.environ.get('PDF_ENGINE', 'xhtml2pdf')
+
+# Render processes used by bulk ZIP exports (see invoices.bulk_export)
+BULK_EXPORT_WORKERS = int(os.environ.get('BULK_EXPORT_WORKERS', min(4, os.cpu_count() or 1)))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -181,6 +225,16 @@ CRISPY_TEMPLATE_PACK = 'bootstrap5'
 
 # Custom settings
 VAT_PERCENTAGE = 7.5  # Default VAT percentage
+LIST_PAGE_SIZE = 25  # Default rows per page on invoice/quotation lists
+
+# Prefixes of automatically assigned numbers, e.g. INV-2026-0001 (see invoices.numbering_utils)
+DOCUMENT_NUMBER_PREFIXES = {
+    'invoice': 'INV-',
+    'quotation': 'QTN-',
+}
+
+# Each item row posts ~6 fields; Django's default of 1000 caps documents at ~160 lines
+DATA_UPLOAD_MAX_NUMBER_FIELDS = 10000
 
 # Email settings
 DEFAULT_FROM_EMAIL = 'no-reply@example.com'
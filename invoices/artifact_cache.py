@@ -0,0 +1,205 @@
+"""On-disk cache for rendered document exports (PDF, DOCX).
+
+Artifacts are stored under settings.ARTIFACT_CACHE_DIR as
+<model>-<pk>-<fingerprint>.<ext>. The fingerprint hashes everything that
+ends up in the document, so any change to the document, its items, an
+item image or the template produces a new key. Storing a new artifact
+removes the older ones for the same document and format. The directory is
+kept under settings.ARTIFACT_CACHE_MAX_BYTES by evicting least recently
+used files.
+"""
+from django.conf import settings
+from django.template.loader import get_template
+from functools import lru_cache
+import hashlib
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# Bump to invalidate every cached artifact, e.g. after changing a generator
+ARTIFACT_CACHE_VERSION = 2
+
+
+def _cache_dir():
+    return str(getattr(settings, 'ARTIFACT_CACHE_DIR', os.path.join(settings.BASE_DIR, 'artifact_cache')))
+
+
+def _max_bytes():
+    return getattr(settings, 'ARTIFACT_CACHE_MAX_BYTES', 256 * 1024 * 1024)
+
+
+@lru_cache(maxsize=4096)
+def _checksum_file(path, mtime_ns, size):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_checksum(path):
+    """SHA-256 of a file, memoised per (path, mtime, size)"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return 'missing'
+    return _checksum_file(path, stat.st_mtime_ns, stat.st_size)
+
+
+def _image_checksum(field_file):
+    if not field_file:
+        return ''
+    try:
+        return file_checksum(field_file.path)
+    except (NotImplementedError, ValueError):
+        # Remote storages have no local path; the stored name is unique
+        return field_file.name
+
+
+def template_version(template_name):
+    """Checksum of a template's source file"""
+    try:
+        origin = get_template(template_name).origin.name
+    except Exception:
+        return template_name
+    return file_checksum(origin)
+
+
+def document_fingerprint(document, items, version='', exclude=()):
+    """Hash of a document's fields, its item rows and their image contents.
+
+    `version` identifies the generator, e.g. a template checksum; fields
+    named in `exclude` are left out, for those the generator does not show.
+    """
+    digest = hashlib.sha256()
+    digest.update(f'{ARTIFACT_CACHE_VERSION}|{version}|{document._meta.label_lower}'.encode('utf-8'))
+    for field in document._meta.concrete_fields:
+        if field.name in exclude:
+            continue
+        digest.update(f'|{field.attname}={getattr(document, field.attname)!r}'.encode('utf-8'))
+    for item in items:
+        digest.update(
+            f'|item:{item.pk}:{item.name!r}:{item.price}:{item.quantity}:{item.unit!r}:'
+            f'{item.lead_time!r}:{item.image.name if item.image else ""}:{_image_checksum(item.image)}'
+            .encode('utf-8')
+        )
+    return digest.hexdigest()
+
+
+def _prefix(document):
+    return f'{document._meta.model_name}-{document.pk}-'
+
+
+def artifact_path(document, fingerprint, extension):
+    return os.path.join(_cache_dir(), f'{_prefix(document)}{fingerprint}.{extension}')
+
+
+def open_artifact(document, fingerprint, extension):
+    """Cached artifact for a document fingerprint as an open binary file, or None"""
+    path = artifact_path(document, fingerprint, extension)
+    try:
+        fh = open(path, 'rb')
+    except OSError:
+        return None
+    try:
+        # Mark as recently used for LRU eviction
+        os.utime(path, None)
+    except OSError:
+        pass
+    return fh
+
+
+def get_artifact(document, fingerprint, extension):
+    """Cached bytes for a document fingerprint, or None"""
+    fh = open_artifact(document, fingerprint, extension)
+    if fh is None:
+        return None
+    with fh:
+        return fh.read()
+
+
+def put_artifact(document, fingerprint, extension, data):
+    """Store bytes for a document fingerprint, replacing older versions"""
+    directory = _cache_dir()
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(data)
+        path = artifact_path(document, fingerprint, extension)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not cache artifact for {document._meta.label} {document.pk}: {e}")
+        return
+    delete_artifacts(document, extension=extension, keep=os.path.basename(path))
+    prune_artifacts()
+
+
+def delete_artifacts(document, extension=None, keep=None):
+    """Remove cached artifacts of a document (optionally one format only)"""
+    directory = _cache_dir()
+    prefix = _prefix(document)
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        if not name.startswith(prefix) or name == keep:
+            continue
+        if extension and not name.endswith(f'.{extension}'):
+            continue
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+
+
+def delete_model_artifacts(model, pks, extension=None):
+    """delete_artifacts() for many documents of one model, listing the cache once"""
+    prefix = f'{model._meta.model_name}-'
+    pks = {str(pk) for pk in pks}
+    directory = _cache_dir()
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        if not name.startswith(prefix) or name[len(prefix):].split('-', 1)[0] not in pks:
+            continue
+        if extension and not name.endswith(f'.{extension}'):
+            continue
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+
+
+def prune_artifacts(max_bytes=None):
+    """Evict least recently used artifacts until the cache fits in max_bytes"""
+    max_bytes = _max_bytes() if max_bytes is None else max_bytes
+    directory = _cache_dir()
+    entries = []
+    total = 0
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+    except OSError:
+        return
+    if total <= max_bytes:
+        return
+    for _, size, path in sorted(entries):
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        if total <= max_bytes:
+            break
+
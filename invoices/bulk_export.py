@@ -0,0 +1,172 @@
+"""Bulk export of invoices as a ZIP archive, streamed as it is built.
+
+Documents are rendered in a process pool (through the artifact cache, so
+already rendered invoices are only read back) and each one is written to
+the archive and handed to the caller as soon as it is ready. Only a small
+window of rendered documents is held in memory at any time, however many
+invoices are exported.
+
+The pool is started once per web process and shared by its requests; an
+export asking for another number of workers gets a pool of its own,
+shut down when it finishes. Pool workers are spawned rather than forked,
+so they open their own database connections instead of inheriting the
+web process's.
+"""
+from django.conf import settings
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque
+from itertools import islice
+import logging
+import multiprocessing
+import os
+import threading
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def bulk_export_workers():
+    """Number of render processes, from settings.BULK_EXPORT_WORKERS"""
+    default = min(4, os.cpu_count() or 1)
+    return max(1, int(getattr(settings, 'BULK_EXPORT_WORKERS', default)))
+
+
+def _init_worker():
+    # Spawned workers start from scratch (DJANGO_SETTINGS_MODULE is inherited)
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+def _new_pool(workers):
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+    )
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = _new_pool(bulk_export_workers())
+        return _pool
+
+
+def _discard_pool(pool):
+    """Drop a pool whose worker died; the next export starts a new one"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _render_invoice(pk, fmt):
+    """Render one invoice; returns (pk, filename, date_time, bytes or None)"""
+    from .export_utils import export_filename, get_document_export
+    from .models import Invoice
+    invoice = Invoice.objects.prefetch_related('items').filter(pk=pk).first()
+    if invoice is None:
+        return pk, None, None, None
+    modified = (invoice.date_updated or invoice.date_created).timetuple()[:6]
+    try:
+        _, data = get_document_export(invoice, fmt)
+    except Exception:
+        logger.exception(f"Bulk export of invoice {pk} failed")
+        data = None
+    return pk, export_filename(invoice, fmt), modified, data
+
+
+def render_exports(invoice_ids, fmt='pdf', workers=None):
+    """Yield _render_invoice() results for `invoice_ids`, in order.
+
+    At most two documents per worker are in flight, so memory use does not
+    grow with the number of invoices. If the pool breaks, the remaining
+    documents are rendered in this process.
+    """
+    workers = bulk_export_workers() if workers is None else workers
+    ids = iter(invoice_ids)
+    if workers > 1:
+        shared = workers == bulk_export_workers()
+        pool = _get_pool() if shared else _new_pool(workers)
+        pending = deque((pk, pool.submit(_render_invoice, pk, fmt)) for pk in islice(ids, workers * 2))
+        try:
+            while pending:
+                pk, future = pending[0]
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    logger.exception("Bulk export pool broke; rendering the rest in process")
+                    if shared:
+                        _discard_pool(pool)
+                    break
+                pending.popleft()
+                for next_pk in islice(ids, 1):
+                    pending.append((next_pk, pool.submit(_render_invoice, next_pk, fmt)))
+                yield result
+        finally:
+            # Also reached when the client goes away mid-download
+            for _, future in pending:
+                future.cancel()
+            if not shared:
+                pool.shutdown(wait=False, cancel_futures=True)
+        ids = iter([pk for pk, _ in pending] + list(ids))
+    for pk in ids:
+        yield _render_invoice(pk, fmt)
+
+
+class _ZipStream:
+    """Write-only file object collecting what ZipFile writes until pop()"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_invoice_zip(invoice_ids, fmt='pdf', workers=None):
+    """Yield a ZIP archive of invoice exports chunk by chunk.
+
+    Documents that could not be rendered are listed in errors.txt at the end
+    of the archive instead of aborting the download.
+    """
+    stream = _ZipStream()
+    names = set()
+    failed = []
+    # PDFs and DOCX files are already compressed, so entries are stored as-is
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED) as archive:
+        for pk, filename, modified, data in render_exports(invoice_ids, fmt, workers):
+            if data is None:
+                failed.append(f"{filename or 'Invoice'} (id {pk})")
+                continue
+            if filename in names:
+                stem, ext = os.path.splitext(filename)
+                filename = f'{stem}-{pk}{ext}'
+            names.add(filename)
+            archive.writestr(zipfile.ZipInfo(filename, date_time=modified), data)
+            yield stream.pop()
+        if failed:
+            archive.writestr('errors.txt', 'Could not export:\n' + '\n'.join(failed) + '\n')
+    yield stream.pop()
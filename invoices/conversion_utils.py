@@ -0,0 +1,91 @@
+"""Quotation to invoice conversion, for one or many quotations at a time.
+
+Invoices, their items and the M2M links are written with bulk_create, a
+chunk of quotations at a time, inside a single transaction. Items keep
+every field of the quotation's items (unit, image, lead time); images are
+shared with the quotation items through the content-addressed item image
+store rather than copied.
+"""
+from django.db import transaction
+from collections import defaultdict
+
+from .item_utils import bulk_create_documents
+from .models import Invoice
+from .numbering_utils import reserve_document_numbers
+from quotations.models import Item, Quotation
+
+
+def derived_invoice_number(quotation):
+    return f"INV-{quotation.quotation_number or quotation.id}".upper()
+
+
+def _invoice_from_quotation(quotation, number):
+    invoice = Invoice(
+        user_id=quotation.user_id,
+        invoice_number=number,
+        client_name=quotation.client_name,
+        currency=quotation.currency,
+        vat_percentage=quotation.vat_percentage,
+        due_date=quotation.date_created.date(),
+        status='Pending',
+        notes=quotation.notes,
+    )
+    items = [
+        Item(
+            name=item.name,
+            price=item.price,
+            quantity=item.quantity,
+            unit=item.unit,
+            image=item.image.name or None,
+            lead_time=item.lead_time,
+        )
+        for item in quotation.items.all()
+    ]
+    invoice.calculate_totals(items)
+    return invoice, items
+
+
+def _convert_chunk(quotations):
+    """Convert one chunk of quotations (with items prefetched); returns the invoices"""
+    by_user = defaultdict(list)
+    for quotation in quotations:
+        by_user[quotation.user_id].append(quotation)
+
+    numbers = {}
+    for user_quotations in by_user.values():
+        reserved = reserve_document_numbers(
+            Invoice, user_quotations[0].user, [derived_invoice_number(q) for q in user_quotations]
+        )
+        numbers.update(zip((q.pk for q in user_quotations), reserved))
+
+    invoices, invoice_items = [], []
+    for quotation in quotations:
+        invoice, items = _invoice_from_quotation(quotation, numbers[quotation.pk])
+        invoices.append(invoice)
+        invoice_items.append(items)
+
+    bulk_create_documents(Invoice, invoices, invoice_items)
+    return invoices
+
+
+def convert_quotations(quotations, batch_size=500):
+    """Create an invoice from each quotation, in one transaction.
+
+    `quotations` is a Quotation queryset or a list of quotations. Each
+    invoice belongs to the quotation's owner and is numbered INV-<quotation
+    number>, or from the owner's sequence when that number is taken.
+    Returns the new invoices, ordered by quotation id.
+    """
+    if isinstance(quotations, (list, tuple)):
+        ids = [quotation.pk for quotation in quotations]
+    else:
+        ids = list(quotations.order_by('pk').values_list('pk', flat=True))
+    invoices = []
+    with transaction.atomic():
+        for start in range(0, len(ids), batch_size):
+            chunk = list(
+                Quotation.objects.filter(pk__in=ids[start:start + batch_size])
+                .select_related('user').prefetch_related('items').order_by('pk')
+            )
+            invoices.extend(_convert_chunk(chunk))
+    return invoices
@@ -1,4 +1,3 @@
-from django.http import HttpResponse
 from django.template.loader import get_template
 import os
 from django.conf import settings
@@ -9,6 +8,12 @@ from docx.enum.table import WD_ALIGN_VERTICAL
 from docx.oxml.ns import qn
 from docx.oxml import OxmlElement
 from io import BytesIO
+from .export_utils import document_export_response
+from .artifact_cache import file_checksum
+from .path_resolver import resolve_image_path
+import logging
+
+logger = logging.getLogger(__name__)
 
 def add_watermark(document, image_path):
     """Add a watermark to all pages of the document"""
@@ -16,9 +21,11 @@ def add_watermark(document, image_path):
     # as requested by the user
     pass
 
-def generate_invoice_docx(invoice):
-    """Generate a Word document for an invoice"""
+def build_invoice_docx(invoice):
+    """Build the Word document for an invoice and return its bytes"""
     document = Document()
+    # Materialise items once; iterated again for the image pages below
+    items = list(invoice.items.all())
     
     # Document properties
     document.core_properties.title = f"INVOICE {invoice.invoice_number.upper() if invoice.invoice_number else invoice.id}"
@@ -133,7 +140,7 @@ def generate_invoice_docx(invoice):
                 run.bold = True
     
     # Add items
-    for item in invoice.items.all():
+    for item in items:
         row_cells = items_table.add_row().cells
         row_cells[0].text = item.name
         # Extract numeric part from quantity and add unit if available
@@ -178,7 +185,8 @@ def generate_invoice_docx(invoice):
         document.add_paragraph(invoice.notes)
     
     # Add images if any
-    if any(item.image for item in invoice.items.all()):
+    items_with_images = [item for item in items if item.image]
+    if items_with_images:
         document.add_page_break()
         
         # Add images title
@@ -188,9 +196,6 @@ def generate_invoice_docx(invoice):
         images_title_run.bold = True
         images_title_run.font.size = Pt(14)
         
-        # Create a 2x2 table for images
-        items_with_images = [item for item in invoice.items.all() if item.image]
-        
         # Process 4 images per page
         for i in range(0, len(items_with_images), 4):
             # Create a 2x2 table
@@ -218,36 +223,8 @@ def generate_invoice_docx(invoice):
                     
                     # Add image
                     try:
-                        image_path = item.image.path
-                        print(f"\n\n[DEBUG DOCX] Image path: {image_path} (Exists: {os.path.exists(image_path)})\n\n")
-                        
-                        # If the image path doesn't exist, try to find it in the media root
-                        if not os.path.exists(image_path):
-                            # Try to get the image URL and convert it to a path
-                            try:
-                                image_url = item.image.url
-                                print(f"[DEBUG DOCX] Image URL: {image_url}")
-                                
-                                # Convert URL to path
-                                if image_url.startswith(settings.MEDIA_URL):
-                                    rel_path = image_url.replace(settings.MEDIA_URL, '')
-                                    alt_path = os.path.join(settings.MEDIA_ROOT, rel_path)
-                                    print(f"[DEBUG DOCX] Alternative path from URL: {alt_path} (Exists: {os.path.exists(alt_path)})")
-                                    if os.path.exists(alt_path):
-                                        image_path = alt_path
-                                        
-                                # Try alternative path in item_images directory
-                                if not os.path.exists(image_path):
-                                    image_filename = os.path.basename(str(item.image))
-                                    alternative_path = os.path.join(settings.MEDIA_ROOT, 'item_images', image_filename)
-                                    print(f"[DEBUG DOCX] Trying alternative path in item_images: {alternative_path}")
-                                    if os.path.exists(alternative_path):
-                                        image_path = alternative_path
-                            except Exception as url_error:
-                                print(f"[DEBUG DOCX] Error getting image URL: {url_error}")
-                        
-                        # If we have a valid image path, add it to the document
-                        if os.path.exists(image_path):
+                        image_path = resolve_image_path(item.image, 'print') or resolve_image_path(item.image)
+                        if image_path:
                             run = paragraph.add_run()
                             run.add_picture(image_path, width=Inches(2.5))
                             
@@ -257,7 +234,6 @@ def generate_invoice_docx(invoice):
                             name_run = name_paragraph.add_run(item.name)
                             name_run.bold = True
                         else:
-                            print(f"[DEBUG DOCX] Image file not found: {image_path}")
                             paragraph.add_run(f"[Image not available for {item.name}]")
                             
                             # Add item name even if image is missing
@@ -266,7 +242,7 @@ def generate_invoice_docx(invoice):
                             name_run = name_paragraph.add_run(f"[No Image] {item.name}")
                             name_run.bold = True
                     except Exception as e:
-                        print(f"[DEBUG DOCX] Error adding image: {e}")
+                        logger.warning(f"Could not add image of item {item.pk} to DOCX: {e}")
                         paragraph.add_run(f"[Image not available for {item.name}]")
                         
                         # Add item name even if there's an error
@@ -278,24 +254,13 @@ def generate_invoice_docx(invoice):
     # Save to memory
     docx_buffer = BytesIO()
     document.save(docx_buffer)
-    docx_buffer.seek(0)
-    
-    # Create response
-    response = HttpResponse(docx_buffer.getvalue(), content_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
-    response['Content-Disposition'] = f'attachment; filename="Invoice_{invoice.invoice_number}.docx"'
-    
-    return response
+    return docx_buffer.getvalue()
 
-def generate_quotation_docx(quotation, request=None):
-    """Generate a Word document for a quotation"""
+def build_quotation_docx(quotation, request=None):
+    """Build the Word document for a quotation and return its bytes"""
     document = Document()
-    
-    # Print debug information about the request and media paths
-    if request:
-        print(f"[DEBUG DOCX] Request scheme: {request.scheme}")
-        print(f"[DEBUG DOCX] Request host: {request.get_host()}")
-        print(f"[DEBUG DOCX] MEDIA_ROOT: {settings.MEDIA_ROOT}")
-        print(f"[DEBUG DOCX] MEDIA_URL: {settings.MEDIA_URL}")
+    # Materialise items once; iterated again for the image pages below
+    items = list(quotation.items.all())
     
     # Document properties
     document.core_properties.title = f"Quotation Number {quotation.quotation_number.upper() if quotation.quotation_number else quotation.id}"
@@ -408,7 +373,7 @@ def generate_quotation_docx(quotation, request=None):
                 run.bold = True
     
     # Add items
-    for item in quotation.items.all():
+    for item in items:
         row_cells = items_table.add_row().cells
         row_cells[0].text = item.name
         # Extract numeric part from quantity and add unit if available
@@ -453,7 +418,8 @@ def generate_quotation_docx(quotation, request=None):
         document.add_paragraph(quotation.notes)
     
     # Add images if any
-    if any(item.image for item in quotation.items.all()):
+    items_with_images = [item for item in items if item.image]
+    if items_with_images:
         document.add_page_break()
         
         # Add images title
@@ -463,9 +429,6 @@ def generate_quotation_docx(quotation, request=None):
         images_title_run.bold = True
         images_title_run.font.size = Pt(14)
         
-        # Create a 2x2 table for images
-        items_with_images = [item for item in quotation.items.all() if item.image]
-        
         # Process 4 images per page
         for i in range(0, len(items_with_images), 4):
             # Create a 2x2 table
@@ -493,36 +456,8 @@ def generate_quotation_docx(quotation, request=None):
                     
                     # Add image
                     try:
-                        image_path = item.image.path
-                        print(f"\n\n[DEBUG DOCX] Quotation Image path: {image_path} (Exists: {os.path.exists(image_path)})\n\n")
-                        
-                        # If the image path doesn't exist, try to find it in the media root
-                        if not os.path.exists(image_path):
-                            # Try to get the image URL and convert it to a path
-                            try:
-                                image_url = item.image.url
-                                print(f"[DEBUG DOCX] Quotation Image URL: {image_url}")
-                                
-                                # Convert URL to path
-                                if image_url.startswith(settings.MEDIA_URL):
-                                    rel_path = image_url.replace(settings.MEDIA_URL, '')
-                                    alt_path = os.path.join(settings.MEDIA_ROOT, rel_path)
-                                    print(f"[DEBUG DOCX] Quotation Alternative path from URL: {alt_path} (Exists: {os.path.exists(alt_path)})")
-                                    if os.path.exists(alt_path):
-                                        image_path = alt_path
-                                        
-                                # Try alternative path in item_images directory
-                                if not os.path.exists(image_path):
-                                    image_filename = os.path.basename(str(item.image))
-                                    alternative_path = os.path.join(settings.MEDIA_ROOT, 'item_images', image_filename)
-                                    print(f"[DEBUG DOCX] Trying alternative path in item_images: {alternative_path}")
-                                    if os.path.exists(alternative_path):
-                                        image_path = alternative_path
-                            except Exception as url_error:
-                                print(f"[DEBUG DOCX] Error getting quotation image URL: {url_error}")
-                        
-                        # If we have a valid image path, add it to the document
-                        if os.path.exists(image_path):
+                        image_path = resolve_image_path(item.image, 'print') or resolve_image_path(item.image)
+                        if image_path:
                             run = paragraph.add_run()
                             run.add_picture(image_path, width=Inches(2.5))
                             
@@ -532,7 +467,6 @@ def generate_quotation_docx(quotation, request=None):
                             name_run = name_paragraph.add_run(item.name)
                             name_run.bold = True
                         else:
-                            print(f"[DEBUG DOCX] Quotation Image file not found: {image_path}")
                             paragraph.add_run(f"[Image not available for {item.name}]")
                             
                             # Add item name even if image is missing
@@ -541,7 +475,7 @@ def generate_quotation_docx(quotation, request=None):
                             name_run = name_paragraph.add_run(f"[No Image] {item.name}")
                             name_run.bold = True
                     except Exception as e:
-                        print(f"[DEBUG DOCX] Error adding quotation image: {e}")
+                        logger.warning(f"Could not add image of item {item.pk} to DOCX: {e}")
                         paragraph.add_run(f"[Image not available for {item.name}]")
                         
                         # Add item name even if there's an error
@@ -553,10 +487,22 @@ def generate_quotation_docx(quotation, request=None):
     # Save to memory
     docx_buffer = BytesIO()
     document.save(docx_buffer)
-    docx_buffer.seek(0)
-    
-    # Create response
-    response = HttpResponse(docx_buffer.getvalue(), content_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
-    response['Content-Disposition'] = f'attachment; filename="Quotation_{quotation.quotation_number}.docx"'
-    
-    return response
\ No newline at end of file
+    return docx_buffer.getvalue()
+
+
+def docx_version():
+    """Generator version for the artifact cache: changes when the embedded logo does"""
+    logo_path = os.path.join(settings.STATIC_ROOT, 'images/skids_logo.png')
+    if not os.path.exists(logo_path):
+        logo_path = os.path.join(settings.STATIC_ROOT, 'img/logo.png')
+    return f"docx-{file_checksum(logo_path)}"
+
+
+def generate_invoice_docx(invoice, request=None):
+    """Word document response for an invoice, served from the artifact cache when possible"""
+    return document_export_response(request, invoice, 'docx')
+
+
+def generate_quotation_docx(quotation, request=None):
+    """Word document response for a quotation, served from the artifact cache when possible"""
+    return document_export_response(request, quotation, 'docx')
@@ -0,0 +1,177 @@
+"""Database-backed outbox of invoice emails.
+
+Web requests add OutboundEmail rows and return immediately; the
+run_email_worker management command claims due emails a batch at a time
+and sends each batch over one mail connection from get_connection(), so
+SMTP is connected and authenticated once per batch rather than per
+message. A failed email is retried with exponential backoff (see
+retry_delay()) until MAX_ATTEMPTS, then marked Failed. Each row records
+the outcome for its invoice.
+
+Emails left Sending by a dead worker are requeued once they are older than
+STALE_AFTER, or marked Failed if they used their attempts. Building an email may render its PDF, so while a batch is
+delivered the emails still waiting in it are re-stamped every
+CLAIM_REFRESH_INTERVAL; a slow batch is not mistaken for a dead one and
+sent twice.
+"""
+from django.core.mail import get_connection
+from django.db.models import F
+from django.utils import timezone
+from datetime import timedelta
+import logging
+
+from .email_utils import build_invoice_email
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+
+EMAIL_BATCH_SIZE = 50
+
+RETRY_BASE_DELAY = timedelta(minutes=1)
+
+STALE_AFTER = timedelta(minutes=10)
+
+CLAIM_REFRESH_INTERVAL = timedelta(minutes=1)
+
+
+def retry_delay(attempts):
+    """Wait before the next try after `attempts` failures: 1, 2, 4, 8... minutes"""
+    return RETRY_BASE_DELAY * (2 ** max(attempts - 1, 0))
+
+
+def enqueue_invoice_email(user, invoice, recipient, message=''):
+    return OutboundEmail.objects.create(
+        user=user, invoice=invoice, recipient=recipient, message=message or '',
+    )
+
+
+def last_recipients(user, client_names=None):
+    """The address each client was last emailed at by `user`, as {client_name: email}; all clients by default"""
+    recipients = {}
+    rows = OutboundEmail.objects.filter(user=user)
+    if client_names is not None:
+        rows = rows.filter(invoice__client_name__in=set(client_names))
+    rows = rows.order_by('date_created', 'id').values_list('invoice__client_name', 'recipient')
+    for client_name, recipient in rows:
+        recipients[client_name] = recipient
+    return recipients
+
+
+def enqueue_invoice_emails(user, invoices, recipient=None, message=''):
+    """Queue one email per invoice; returns (queued emails, invoices skipped).
+
+    Without `recipient`, each invoice goes to the address its client was
+    last emailed at; invoices of clients never emailed before are skipped.
+    """
+    invoices = list(invoices)
+    recipients = {} if recipient else last_recipients(user, [invoice.client_name for invoice in invoices])
+    emails, skipped = [], []
+    for invoice in invoices:
+        to = recipient or recipients.get(invoice.client_name)
+        if not to:
+            skipped.append(invoice)
+            continue
+        emails.append(OutboundEmail(user=user, invoice=invoice, recipient=to, message=message or ''))
+    return OutboundEmail.objects.bulk_create(emails), skipped
+
+
+def requeue_stale_emails(older_than=STALE_AFTER):
+    """Put back emails left Sending by a worker that died; returns how many.
+
+    An email that already used its MAX_ATTEMPTS is marked Failed instead, so
+    one whose sending crashes the worker is not sent again on every restart.
+    """
+    now = timezone.now()
+    stale = OutboundEmail.objects.filter(status=OutboundEmail.SENDING, date_started__lt=now - older_than)
+    stale.filter(attempts__gte=MAX_ATTEMPTS).update(
+        status=OutboundEmail.FAILED, error='The email worker stopped while sending',
+    )
+    return stale.filter(attempts__lt=MAX_ATTEMPTS).update(status=OutboundEmail.QUEUED, next_attempt=now)
+
+
+def claim_batch(limit=EMAIL_BATCH_SIZE):
+    """Atomically move up to `limit` due emails to Sending and return them.
+
+    Each email is claimed with a conditional UPDATE on status, so
+    concurrent workers never send the same email, on any database backend.
+    """
+    now = timezone.now()
+    candidates = list(
+        OutboundEmail.objects.filter(status=OutboundEmail.QUEUED, next_attempt__lte=now)
+        .order_by('next_attempt', 'id')
+        .values_list('pk', flat=True)[:limit]
+    )
+    claimed = [
+        pk for pk in candidates
+        if OutboundEmail.objects.filter(pk=pk, status=OutboundEmail.QUEUED).update(
+            status=OutboundEmail.SENDING,
+            date_started=now,
+            attempts=F('attempts') + 1,
+        )
+    ]
+    return list(
+        OutboundEmail.objects.filter(pk__in=claimed)
+        .select_related('invoice').prefetch_related('invoice__items')
+        .order_by('next_attempt', 'id')
+    )
+
+
+def _refresh_claim(emails):
+    """Restart the stale clock of claimed emails not sent yet; returns the new date_started"""
+    now = timezone.now()
+    OutboundEmail.objects.filter(
+        pk__in=[email.pk for email in emails], status=OutboundEmail.SENDING,
+    ).update(date_started=now)
+    return now
+
+
+def _failed(email, error):
+    email.error = str(error)
+    if email.attempts < MAX_ATTEMPTS:
+        email.status = OutboundEmail.QUEUED
+        email.next_attempt = timezone.now() + retry_delay(email.attempts)
+    else:
+        email.status = OutboundEmail.FAILED
+    email.save(update_fields=['status', 'error', 'next_attempt'])
+
+
+def deliver_batch(emails, connection=None):
+    """Send claimed emails over one connection and record each outcome; returns the number sent"""
+    if not emails:
+        return 0
+    connection = connection or get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        logger.exception('Could not open the mail connection')
+        for email in emails:
+            _failed(email, e)
+        return 0
+    sent = 0
+    claimed = min(email.date_started or timezone.now() for email in emails)
+    try:
+        for i, email in enumerate(emails):
+            if timezone.now() - claimed >= CLAIM_REFRESH_INTERVAL:
+                claimed = _refresh_claim(emails[i:])
+            try:
+                message = build_invoice_email(
+                    email.invoice, email.recipient, email.message,
+                    connection=connection, reminder_days=email.reminder_days,
+                )
+                if not connection.send_messages([message]):
+                    raise RuntimeError('The mail backend did not accept the message')
+            except Exception as e:
+                logger.exception(f'Email {email.pk} failed')
+                _failed(email, e)
+                continue
+            email.status = OutboundEmail.SENT
+            email.error = ''
+            email.date_sent = timezone.now()
+            email.save(update_fields=['status', 'error', 'date_sent'])
+            sent += 1
+    finally:
+        connection.close()
+    return sent
+
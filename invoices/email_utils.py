@@ -1,62 +1,88 @@
 from django.core.mail import EmailMessage
 from django.template.loader import render_to_string
 from django.conf import settings
-from .utils import render_to_pdf
-import os
+from django.utils import timezone
+from .export_utils import CONTENT_TYPES, export_filename, get_document_export
+from .utils import COMPANY_DETAILS
+import logging
 
-def send_invoice_email(invoice, recipient_email, message=None):
+logger = logging.getLogger(__name__)
+
+
+def build_invoice_email(invoice, recipient_email, message=None, connection=None, reminder_days=None):
     """
-    Send an invoice to a client via email with PDF attachment
+    Build the email that sends an invoice to a client, without sending it
     
     Args:
         invoice: The Invoice model instance
         recipient_email: Email address of the recipient
         message: Optional custom message to include in the email
+        connection: Optional mail connection to send it with, e.g. one
+            shared by a batch of emails
+        reminder_days: Set for a payment reminder, the days overdue of the
+            reminder rule that sent it
+    
+    Returns:
+        EmailMessage
+    """
+    number = (invoice.invoice_number or str(invoice.id)).upper()
+    
+    # The same cached PDF the download endpoint serves; rendered only on a cache miss
+    _, pdf_bytes = get_document_export(invoice, 'pdf')
+    if pdf_bytes is None:
+        logger.warning(f"Could not render the PDF for invoice {invoice.pk}; emailing it without attachment")
+    
+    if reminder_days is not None:
+        default_message = (
+            f"This is a reminder that invoice {number}, due on {invoice.due_date:%B %d, %Y}, "
+            f"is now more than {reminder_days} day(s) overdue. Please arrange payment at your earliest convenience."
+        )
+    else:
+        default_message = f"Please find attached invoice {number} for your records."
+    
+    # Prepare context data for the email template
+    context = {
+        'invoice': invoice,
+        'invoice_number': number,
+        'is_reminder': reminder_days is not None,
+        'has_attachment': pdf_bytes is not None,
+        'current_year': timezone.localdate().year,
+        'message': message or default_message,
+        **COMPANY_DETAILS,
+    }
+    
+    # Render email content from template
+    email_html = render_to_string('invoices/email/invoice_email.html', context)
+    
+    # Create email
+    if reminder_days is not None:
+        subject = f"Payment reminder: Invoice {number} is overdue"
+    else:
+        subject = f"Invoice {number} from {context['company_name']}"
+    email = EmailMessage(
+        subject=subject,
+        body=email_html,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[recipient_email],
+        connection=connection,
+    )
+    email.content_subtype = "html"  # Set content type to HTML
+    if pdf_bytes is not None:
+        email.attach(export_filename(invoice, 'pdf'), pdf_bytes, CONTENT_TYPES['pdf'])
+    
+    return email
+
+
+def send_invoice_email(invoice, recipient_email, message=None):
+    """
+    Send an invoice email right away (see email_outbox for queued delivery)
     
     Returns:
         bool: True if email was sent successfully, False otherwise
     """
     try:
-        # Prepare context data for the email template
-        context = {
-            'invoice': invoice,
-            'company_name': 'Your Company Name',  # Customize with your company details
-            'message': message or f"Please find attached invoice #{invoice.id} for your records.",
-        }
-        
-        # Render email content from template
-        email_html = render_to_string('invoices/email/invoice_email.html', context)
-        
-        # Create email
-        subject = f"Invoice #{invoice.id} from {context['company_name']}"
-        email = EmailMessage(
-            subject=subject,
-            body=email_html,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            to=[recipient_email],
-        )
-        email.content_subtype = "html"  # Set content type to HTML
-        
-        # Generate PDF attachment
-        pdf_context = {
-            'invoice': invoice,
-            'company_name': context['company_name'],
-            'company_address': '123 Business Street, City, Country',
-            'company_phone': '+1 234 567 890',
-            'company_email': 'contact@yourcompany.com',
-            'company_website': 'www.yourcompany.com',
-        }
-        
-        # Temporarily disabled PDF attachment due to dependency issues
-        # pdf_content = render_to_pdf('invoices/invoice_pdf.html', pdf_context)
-        # 
-        # if pdf_content:
-        #     # Attach PDF to email
-        #     email.attach(f"Invoice_{invoice.id}.pdf", pdf_content.getvalue(), 'application/pdf')
-        
-        # For now, just send the email without attachment
-        email.send(fail_silently=False)
+        build_invoice_email(invoice, recipient_email, message).send(fail_silently=False)
         return True
-    except Exception as e:
-        print(f"Error sending invoice email: {str(e)}")
+    except Exception:
+        logger.exception(f"Error sending invoice email for invoice {invoice.pk}")
         return False
\ No newline at end of file
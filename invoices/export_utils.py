@@ -0,0 +1,130 @@
+"""Invoice and quotation exports (PDF, DOCX) backed by the artifact cache.
+
+Shared by the download views and the background render worker so both
+produce, and cache, byte-identical artifacts.
+"""
+from django.http import FileResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from io import BytesIO
+
+from .artifact_cache import document_fingerprint, get_artifact, open_artifact, put_artifact
+from .pdf_engines import get_pdf_engine
+from .utils import document_items, pdf_context, render_pdf_bytes
+
+EXPORT_FORMATS = ('pdf', 'docx')
+
+CONTENT_TYPES = {
+    'pdf': 'application/pdf',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+}
+
+# Fields an export does not show: changing only these keeps its cached
+# artifact (e.g. the PDF of an invoice marked Overdue)
+UNPRINTED_FIELDS = {
+    'pdf': ('status', 'date_updated'),
+    'docx': ('date_updated',),
+}
+
+PDF_TEMPLATES = {
+    'invoice': 'invoices/invoice_pdf.html',
+    'quotation': 'quotations/quotation_pdf.html',
+}
+
+
+def export_filename(document, fmt):
+    """e.g. Invoice_INV-001.pdf"""
+    model_name = document._meta.model_name
+    number = getattr(document, f'{model_name}_number', None)
+    return f"{model_name.capitalize()}_{number}.{fmt}"
+
+
+def _export_recipe(document, fmt):
+    """Return (items, version, build) for a document export.
+
+    build() returns the artifact bytes, or None when it cannot be produced.
+    """
+    model_name = document._meta.model_name
+    if fmt == 'pdf':
+        template_src = PDF_TEMPLATES[model_name]
+        context = pdf_context(document)
+        engine = get_pdf_engine()
+        if engine is None:
+            return context['items'], '', lambda: None
+        
+        def build():
+            pdf_bytes, _ = render_pdf_bytes(template_src, context, engine=engine.name)
+            return pdf_bytes
+        # Each engine renders differently, so it is part of the version
+        return context['items'], engine.version(template_src), build
+    if fmt == 'docx':
+        from .docx_utils import build_invoice_docx, build_quotation_docx, docx_version
+        builder = build_invoice_docx if model_name == 'invoice' else build_quotation_docx
+        items, _ = document_items(document)
+        return items, docx_version(), lambda: builder(document)
+    raise ValueError(f"Unsupported export format: {fmt}")
+
+
+def export_fingerprint(document, fmt):
+    """Cache fingerprint of a document export, without rendering it"""
+    items, version, _ = _export_recipe(document, fmt)
+    return document_fingerprint(document, items, version, UNPRINTED_FIELDS[fmt])
+
+
+def get_document_export(document, fmt):
+    """Return (fingerprint, bytes) for a document export, rendering on a cache miss.
+
+    bytes is None when the export could not be produced.
+    """
+    items, version, build = _export_recipe(document, fmt)
+    fingerprint = document_fingerprint(document, items, version, UNPRINTED_FIELDS[fmt])
+    data = get_artifact(document, fingerprint, fmt)
+    if data is None:
+        data = build()
+        if data is not None:
+            put_artifact(document, fingerprint, fmt, data)
+    return fingerprint, data
+
+
+def _set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Authenticated downloads: let browsers keep a copy but always revalidate
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def document_export_response(request, document, fmt):
+    """Download response for a document export.
+
+    Sends a strong ETag (the content fingerprint) and Last-Modified (the
+    document's date_updated) and answers conditional requests with 304 Not
+    Modified without loading the artifact. The artifact is streamed from
+    the cache file in chunks rather than read into memory. Returns None if
+    the export could not be produced.
+    """
+    items, version, build = _export_recipe(document, fmt)
+    fingerprint = document_fingerprint(document, items, version, UNPRINTED_FIELDS[fmt])
+    etag = f'"{fingerprint}"'
+    last_modified = int((document.date_updated or document.date_created).timestamp())
+    
+    if request is not None:
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return _set_validators(not_modified, etag, last_modified)
+    
+    artifact = open_artifact(document, fingerprint, fmt)
+    if artifact is None:
+        data = build()
+        if data is None:
+            return None
+        put_artifact(document, fingerprint, fmt, data)
+        # Served from memory only when the cache could not store it
+        artifact = open_artifact(document, fingerprint, fmt) or BytesIO(data)
+    response = FileResponse(
+        artifact,
+        as_attachment=fmt == 'docx',
+        filename=export_filename(document, fmt),
+        content_type=CONTENT_TYPES[fmt],
+    )
+    return _set_validators(response, etag, last_modified)
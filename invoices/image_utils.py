@@ -0,0 +1,116 @@
+"""Resized variants of item images for documents and pages.
+
+Uploads are kept at full resolution; PDFs, DOCX files and the view pages
+use a derivative sized for the purpose instead:
+
+    print   fits 1000x1000 px, enough for ~3 inches at 300 dpi
+    screen  fits 320x320 px, for thumbnails in the web views
+
+Variants are created lazily on first use and stored next to the uploads as
+item_images/variants/<hash>-<variant>.jpg, where the hash covers the source
+image contents and the variant settings. Identical images therefore share
+one variant, and replacing an image produces a new one. Variants go
+through the default storage, not the content-addressed item image store.
+"""
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from functools import lru_cache
+from io import BytesIO
+import hashlib
+import logging
+
+from PIL import Image, ImageOps
+
+from .artifact_cache import file_checksum
+
+logger = logging.getLogger(__name__)
+
+IMAGE_VARIANTS = {
+    'print': {'size': (1000, 1000), 'quality': 85},
+    'screen': {'size': (320, 320), 'quality': 80},
+}
+
+VARIANT_DIR = 'item_images/variants'
+
+
+@lru_cache(maxsize=1024)
+def _storage_checksum(storage, name):
+    digest = hashlib.sha256()
+    with storage.open(name, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _source_checksum(field_file):
+    try:
+        return file_checksum(field_file.path)
+    except (NotImplementedError, ValueError):
+        # Remote storage: the stored name of an upload never changes contents
+        return _storage_checksum(field_file.storage, field_file.name)
+
+
+def variant_name(field_file, variant):
+    """Content-addressed storage name of an image variant"""
+    spec = IMAGE_VARIANTS[variant]
+    key = f"{_source_checksum(field_file)}|{spec['size']}|{spec['quality']}"
+    return f"{VARIANT_DIR}/{hashlib.sha256(key.encode('utf-8')).hexdigest()[:40]}-{variant}.jpg"
+
+
+def _render_variant(fh, variant):
+    """JPEG bytes of the resized image, or None if it already fits"""
+    spec = IMAGE_VARIANTS[variant]
+    image = ImageOps.exif_transpose(Image.open(fh))
+    width, height = spec['size']
+    if image.width <= width and image.height <= height:
+        return None
+    image.thumbnail(spec['size'], Image.LANCZOS)
+    if image.mode not in ('RGB', 'L'):
+        # Flatten transparency onto white, the document background
+        rgba = image.convert('RGBA')
+        image = Image.new('RGB', rgba.size, 'white')
+        image.paste(rgba, mask=rgba.getchannel('A'))
+    output = BytesIO()
+    image.save(output, 'JPEG', quality=spec['quality'], optimize=True)
+    return output.getvalue()
+
+
+def _ensure_variant(storage, source_name, name, variant):
+    if default_storage.exists(name):
+        return name
+    try:
+        with storage.open(source_name, 'rb') as fh:
+            data = _render_variant(fh, variant)
+    except Exception as e:
+        # Not remembered: the next use tries again
+        logger.warning(f"Could not create {variant} variant of {source_name}: {e}")
+        return source_name
+    if data is None:
+        return source_name
+    return default_storage.save(name, ContentFile(data))
+
+
+def image_variant(field_file, variant):
+    """Storage name of an image's variant, creating it on first use.
+
+    Returns the original name when the image is already small enough or
+    cannot be processed, and None when there is no image.
+    """
+    if not field_file:
+        return None
+    try:
+        name = variant_name(field_file, variant)
+    except OSError:
+        # Missing source file; let callers handle the original name
+        return field_file.name
+    return _ensure_variant(field_file.storage, field_file.name, name, variant)
+
+
+def _storage_for(field_file, name):
+    return field_file.storage if name == field_file.name else default_storage
+
+
+def image_variant_url(field_file, variant):
+    name = image_variant(field_file, variant)
+    return _storage_for(field_file, name).url(name) if name else ''
+
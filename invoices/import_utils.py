@@ -0,0 +1,310 @@
+"""Bulk import of invoices and their items from CSV or XLSX.
+
+The sheet has one row per item, with the invoice columns repeated on each
+row; consecutive rows sharing an invoice number make up one invoice, whose
+details are taken from its first row.
+Rows are streamed (csv.reader, or openpyxl in read-only mode) and
+written IMPORT_BATCH_SIZE invoices at a time, each batch in its own
+transaction with bulk_create. Invalid rows are reported and skipped; an
+invoice with an invalid row is skipped as a whole rather than imported
+with missing items. Amounts are checked against their columns before the
+insert, so one value too large fails its invoice rather than its batch.
+
+Columns (headers are case-insensitive, spaces may replace underscores):
+
+    invoice_number, client_name, item_name, item_price, item_quantity
+        required
+    currency, vat_percentage, status, date_created, due_date, notes,
+    item_unit
+        optional; the defaults are those of the invoice form
+"""
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+from datetime import date, datetime, time as dt_time, timedelta
+from decimal import Decimal, InvalidOperation
+import csv
+import io
+import os
+import time
+
+from .item_utils import QUANTITY_RE, bulk_create_documents
+from .models import Invoice
+from .numbering_utils import lock_sequence, taken_numbers
+from quotations.models import Item
+
+IMPORT_FORMATS = ('csv', 'xlsx')
+
+IMPORT_BATCH_SIZE = 500
+
+# Stop collecting error messages past this many; they are still counted
+MAX_REPORTED_ERRORS = 1000
+
+REQUIRED_COLUMNS = ('invoice_number', 'client_name', 'item_name', 'item_price', 'item_quantity')
+
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y')
+
+
+class ImportReport:
+    """Counts, timing and per-row errors of one import"""
+
+    def __init__(self):
+        self.rows = 0
+        self.invoices = 0
+        self.items = 0
+        self.error_count = 0
+        self.errors = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def error(self, row_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((row_number, message))
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+        return self
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0
+
+
+def import_format(filename):
+    """'csv' or 'xlsx' from a file name, or None"""
+    extension = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    return extension if extension in IMPORT_FORMATS else None
+
+
+def _column(header):
+    return str(header or '').strip().lower().replace(' ', '_')
+
+
+def _csv_rows(fh):
+    text = io.TextIOWrapper(fh, encoding='utf-8-sig', newline='')
+    reader = csv.reader(text)
+    header = [_column(value) for value in next(reader, [])]
+    for row in reader:
+        yield header, row
+
+
+def _xlsx_rows(fh):
+    from openpyxl import load_workbook
+    workbook = load_workbook(fh, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = [_column(value) for value in next(rows, ())]
+        for row in rows:
+            yield header, row
+    finally:
+        workbook.close()
+
+
+def read_rows(fh, fmt):
+    """Yield (row_number, {column: value}) for the data rows of a binary file.
+
+    Raises ValueError if a required column is missing.
+    """
+    rows = _xlsx_rows(fh) if fmt == 'xlsx' else _csv_rows(fh)
+    for row_number, (header, row) in enumerate(rows, start=2):
+        if row_number == 2:
+            missing = [column for column in REQUIRED_COLUMNS if column not in header]
+            if missing:
+                raise ValueError(f"Missing column(s): {', '.join(missing)}")
+        values = {
+            column: value.strip() if isinstance(value, str) else value
+            for column, value in zip(header, row) if column
+        }
+        # Skip blank lines
+        if any(value not in (None, '') for value in values.values()):
+            yield row_number, values
+
+
+def _decimal(value, label):
+    try:
+        number = Decimal(str(value).replace(',', ''))
+    except InvalidOperation:
+        raise ValueError(f'{label} is not a number: {value}')
+    # NaN and Infinity parse, but cannot be stored or compared
+    if not number.is_finite():
+        raise ValueError(f'{label} is not a number: {value}')
+    return number
+
+
+def _check_fits(model, field_name, value, label):
+    """Raise ValueError if `value` does not fit the model's DecimalField once rounded"""
+    field = model._meta.get_field(field_name)
+    limit = Decimal(10) ** (field.max_digits - field.decimal_places)
+    if not abs(value) < limit or abs(value.quantize(Decimal(10) ** -field.decimal_places)) >= limit:
+        raise ValueError(f'{label} is too large: {value}')
+
+
+def _date(value, label):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(str(value), fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f'{label} is not a date (YYYY-MM-DD): {value}')
+
+
+def _parse_invoice(values):
+    """Unsaved Invoice from the invoice columns of a row; raises ValueError"""
+    client_name = str(values.get('client_name') or '')
+    if not client_name:
+        raise ValueError('Client name is required')
+
+    currency = str(values.get('currency') or 'NGN').upper()
+    if currency not in dict(Invoice.CURRENCY_CHOICES):
+        raise ValueError(f'Unknown currency: {currency}')
+    status = str(values.get('status') or 'Pending').capitalize()
+    if status not in dict(Invoice.STATUS_CHOICES):
+        raise ValueError(f'Unknown status: {status}')
+
+    vat = values.get('vat_percentage')
+    vat = Decimal('7.5') if vat in (None, '') else _decimal(vat, 'VAT percentage')
+    if not 0 <= vat <= 100:
+        raise ValueError(f'VAT percentage must be between 0 and 100: {vat}')
+    date_created = values.get('date_created')
+    due_date = values.get('due_date')
+    invoice = Invoice(
+        invoice_number=str(values['invoice_number']),
+        client_name=client_name,
+        currency=currency,
+        status=status,
+        vat_percentage=vat,
+        notes=values.get('notes') or '',
+    )
+    if date_created not in (None, ''):
+        invoice.date_created = timezone.make_aware(
+            datetime.combine(_date(date_created, 'Date created'), dt_time.min)
+        )
+    invoice.due_date = (
+        _date(due_date, 'Due date') if due_date not in (None, '')
+        else timezone.localtime(invoice.date_created).date() + timedelta(days=30)
+    )
+    return invoice
+
+
+def _parse_item(values):
+    """Unsaved Item from the item columns of a row; raises ValueError"""
+    name = str(values.get('item_name') or '')
+    price = values.get('item_price')
+    quantity = values.get('item_quantity')
+    if not name or price in (None, '') or quantity in (None, ''):
+        raise ValueError('Item name, price and quantity are required')
+    price = _decimal(price, 'Item price')
+    quantity_match = QUANTITY_RE.match(str(quantity))
+    if not quantity_match or price < 0:
+        raise ValueError(f'Invalid item price or quantity: {values.get("item_price")}, {quantity}')
+    _check_fits(Item, 'price', price, 'Item price')
+    # Stored in a PositiveIntegerField, which truncates
+    quantity = int(Decimal(quantity_match.group(1)))
+    if quantity > connection.ops.integer_field_range('PositiveIntegerField')[1]:
+        raise ValueError(f'Item quantity is too large: {quantity}')
+    return Item(
+        name=name,
+        price=price,
+        quantity=quantity,
+        unit=str(values.get('item_unit') or 'EA'),
+    )
+
+
+def _calculate_totals(pending):
+    """Set the invoice's totals from its items; raises ValueError if they do not fit"""
+    invoice = pending.invoice
+    invoice.calculate_totals(pending.items)
+    for field_name, label in (('subtotal', 'Subtotal'), ('vat_amount', 'VAT amount'), ('total', 'Total')):
+        _check_fits(Invoice, field_name, getattr(invoice, field_name), f'{label} of invoice {pending.number}')
+
+
+class _PendingInvoice:
+    def __init__(self, number, first_row):
+        self.number = number
+        self.first_row = first_row
+        self.invoice = None
+        self.items = []
+        self.failed = False
+
+
+def _group_invoices(rows, report):
+    """Yield the invoices of the sheet, each with its items"""
+    pending = None
+    seen = set()
+    for row_number, values in rows:
+        report.rows += 1
+        number = str(values.get('invoice_number') or '')
+        if not number:
+            report.error(row_number, 'Invoice number is required')
+            continue
+        if pending is None or number != pending.number:
+            if pending is not None:
+                yield pending
+            pending = _PendingInvoice(number, row_number)
+            if number in seen:
+                # Rows of an invoice must be consecutive
+                report.error(row_number, f'Invoice {number} appears more than once in the file')
+                pending.failed = True
+            seen.add(number)
+            try:
+                pending.invoice = _parse_invoice(values)
+            except ValueError as e:
+                report.error(row_number, str(e))
+                pending.failed = True
+        try:
+            pending.items.append(_parse_item(values))
+        except ValueError as e:
+            report.error(row_number, str(e))
+            pending.failed = True
+    if pending is not None:
+        yield pending
+
+
+def _write_batch(user, batch, report):
+    """Insert one batch of parsed invoices in a transaction"""
+    try:
+        with transaction.atomic():
+            # Serialises with invoices created from the form meanwhile
+            lock_sequence(Invoice, user)
+            taken = taken_numbers(Invoice, user, [pending.number for pending in batch])
+            invoices, invoice_items = [], []
+            for pending in batch:
+                if pending.number in taken:
+                    report.error(pending.first_row, f'Invoice number {pending.number} already exists')
+                    continue
+                pending.invoice.user = user
+                invoices.append(pending.invoice)
+                invoice_items.append(pending.items)
+            if invoices:
+                bulk_create_documents(Invoice, invoices, invoice_items)
+    except (DatabaseError, InvalidOperation) as e:
+        for pending in batch:
+            report.error(pending.first_row, f'Invoice {pending.number} not imported: {e}')
+        return
+    report.invoices += len(invoices)
+    report.items += sum(len(items) for items in invoice_items)
+
+
+def import_invoices(user, fh, fmt, batch_size=IMPORT_BATCH_SIZE):
+    """Import the invoices in a CSV or XLSX file for `user`; returns an ImportReport"""
+    report = ImportReport()
+    batch = []
+    for pending in _group_invoices(read_rows(fh, fmt), report):
+        if pending.failed:
+            continue
+        try:
+            _calculate_totals(pending)
+        except ValueError as e:
+            report.error(pending.first_row, str(e))
+            continue
+        batch.append(pending)
+        if len(batch) >= batch_size:
+            _write_batch(user, batch, report)
+            batch = []
+    if batch:
+        _write_batch(user, batch, report)
+    return report.finish()
@@ -0,0 +1,101 @@
+"""Item rows posted with the invoice and quotation forms.
+
+Rows are parsed into unsaved Items first so the document totals can be
+computed up front; the items and their links to the document are then
+written with one bulk INSERT each, instead of two queries per row.
+"""
+from collections import defaultdict
+from decimal import Decimal
+import re
+
+from .pagination_utils import bump_list_version
+from .search_utils import index_documents
+from .typeahead_utils import record_documents
+from .stats_utils import apply_stats_delta, stats_bucket
+from quotations.models import Item
+
+# Quantity fields may carry unit text, e.g. "12 pcs"
+QUANTITY_RE = re.compile(r'^(\d+(?:\.\d+)?)')
+
+
+def parse_item_rows(request, with_lead_time=False):
+    """Build unsaved Items from the item_*[] form fields; incomplete or invalid rows are skipped"""
+    data = request.POST
+    item_names = data.getlist('item_name[]')
+    item_prices = data.getlist('item_price[]')
+    item_quantity_displays = data.getlist('item_quantity_display[]')
+    item_units = data.getlist('item_unit[]')
+    item_lead_times = data.getlist('item_lead_time[]')
+    item_images = request.FILES.getlist('item_image[]')
+
+    items = []
+    for i, name in enumerate(item_names):
+        price_str = item_prices[i] if i < len(item_prices) else ''
+        qty_display = item_quantity_displays[i] if i < len(item_quantity_displays) else ''
+        unit = item_units[i] if i < len(item_units) else 'EA'
+        if not (name and price_str and qty_display):
+            continue
+        try:
+            price_val = Decimal(price_str)
+            qty_match = QUANTITY_RE.match(qty_display.strip())
+            qty_val = float(qty_match.group(1)) if qty_match else 0
+        except Exception:
+            continue
+        item = Item(
+            name=name,
+            price=price_val,
+            # Stored in a PositiveIntegerField, which truncates
+            quantity=int(qty_val),
+            unit=unit or '',
+            image=item_images[i] if i < len(item_images) else None,
+        )
+        if with_lead_time:
+            item.lead_time = item_lead_times[i] if i < len(item_lead_times) else ''
+        items.append(item)
+    return items
+
+
+def add_items(document, items):
+    """Insert unsaved items and link them to a saved Invoice or Quotation.
+
+    m2m_changed is not sent for the links.
+    """
+    Item.objects.bulk_create(items)
+    through = document.items.through
+    source = f'{document._meta.model_name}_id'
+    through.objects.bulk_create([
+        through(**{source: document.pk, 'item_id': item.pk}) for item in items
+    ])
+    record_documents([document], [items])
+
+
+def bulk_create_documents(model, documents, document_items):
+    """Insert many unsaved Invoices or Quotations with their unsaved items.
+
+    `document_items` holds one list of items per document. Documents, items
+    and links are each written with bulk_create; as that skips the model
+    signals, the statistics rollup, cached list counts, search entries and
+    typeahead indexes are updated here.
+    """
+    model.objects.bulk_create(documents)
+    Item.objects.bulk_create([item for items in document_items for item in items])
+    through = model.items.through
+    source = f'{model._meta.model_name}_id'
+    through.objects.bulk_create([
+        through(**{source: document.pk, 'item_id': item.pk})
+        for document, items in zip(documents, document_items)
+        for item in items
+    ])
+
+    deltas = defaultdict(lambda: [0, 0])
+    for document in documents:
+        key, amount = stats_bucket(document)
+        delta = deltas[tuple(sorted(key.items()))]
+        delta[0] += 1
+        delta[1] += amount
+    for key, (count, amount) in deltas.items():
+        apply_stats_delta(dict(key), count, amount)
+    for user_id in {document.user_id for document in documents}:
+        bump_list_version(model, user_id)
+    index_documents(model, documents, document_items)
+    record_documents(documents, document_items)
@@ -0,0 +1,117 @@
+"""CSV and XLSX ledgers of invoices and quotations.
+
+Rows are read with values_list(...).iterator(chunk_size=...), so neither
+format holds more than one chunk of rows in memory. CSV is streamed to the
+client as it is written. XLSX uses openpyxl's write-only mode, which
+spools rows to disk, and is sent from a temporary file once complete.
+"""
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from datetime import datetime
+import csv
+import tempfile
+
+from .pagination_utils import LIST_ORDERING
+
+LEDGER_FORMATS = ('csv', 'xlsx')
+
+LEDGER_CHUNK_SIZE = 2000
+
+LEDGER_COLUMNS = {
+    'invoice': (
+        ('invoice_number', 'Invoice Number'),
+        ('client_name', 'Client'),
+        ('currency', 'Currency'),
+        ('subtotal', 'Subtotal'),
+        ('vat_percentage', 'VAT %'),
+        ('vat_amount', 'VAT'),
+        ('total', 'Total'),
+        ('status', 'Status'),
+        ('date_created', 'Date Created'),
+        ('due_date', 'Due Date'),
+        ('user__email', 'Created By'),
+    ),
+    'quotation': (
+        ('quotation_number', 'Quotation Number'),
+        ('client_name', 'Client'),
+        ('rfq_number', 'RFQ Number'),
+        ('vessel_name', 'Vessel'),
+        ('currency', 'Currency'),
+        ('subtotal', 'Subtotal'),
+        ('vat_percentage', 'VAT %'),
+        ('vat_amount', 'VAT'),
+        ('total', 'Total'),
+        ('date_created', 'Date Created'),
+        ('user__email', 'Created By'),
+    ),
+}
+
+
+def _local(value):
+    # Spreadsheets have no time zones; write local wall-clock times
+    if isinstance(value, datetime) and timezone.is_aware(value):
+        return timezone.localtime(value).replace(tzinfo=None)
+    return value
+
+
+def ledger_rows(queryset, chunk_size=LEDGER_CHUNK_SIZE):
+    """Yield the header and then one tuple per document, newest first"""
+    columns = LEDGER_COLUMNS[queryset.model._meta.model_name]
+    yield tuple(label for _, label in columns)
+    rows = (
+        queryset.order_by(*LIST_ORDERING)
+        .values_list(*(field for field, _ in columns))
+        .iterator(chunk_size=chunk_size)
+    )
+    for row in rows:
+        yield tuple(_local(value) for value in row)
+
+
+class _Echo:
+    """File-like object whose write() returns the data, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def _ledger_filename(queryset, fmt):
+    return f"{queryset.model._meta.model_name}s_{timezone.localdate():%Y%m%d}.{fmt}"
+
+
+def csv_ledger_response(queryset):
+    writer = csv.writer(_Echo())
+    response = StreamingHttpResponse(
+        (writer.writerow(row) for row in ledger_rows(queryset)),
+        content_type='text/csv; charset=utf-8',
+    )
+    response['Content-Disposition'] = f'attachment; filename="{_ledger_filename(queryset, "csv")}"'
+    return response
+
+
+def write_xlsx_ledger(queryset, fh):
+    """Write the ledger as an XLSX workbook to a binary file object"""
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=f"{queryset.model._meta.verbose_name_plural.title()}")
+    for row in ledger_rows(queryset):
+        sheet.append(row)
+    workbook.save(fh)
+
+
+def xlsx_ledger_response(queryset):
+    # Deleted when the response closes it
+    spool = tempfile.TemporaryFile()
+    write_xlsx_ledger(queryset, spool)
+    spool.seek(0)
+    return FileResponse(
+        spool,
+        as_attachment=True,
+        filename=_ledger_filename(queryset, 'xlsx'),
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    )
+
+
+def ledger_response(queryset, fmt):
+    if fmt == 'xlsx':
+        return xlsx_ledger_response(queryset)
+    return csv_ledger_response(queryset)
@@ -0,0 +1,87 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.db import transaction
+from django.test import RequestFactory
+from django.utils import timezone
+from datetime import timedelta
+from decimal import Decimal
+import time
+
+from invoices.models import Invoice
+from invoices.views import invoice_list
+from users.views import dashboard, admin_dashboard
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Time invoice_list, dashboard and admin_dashboard against growing invoice tables (data is rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000,500000',
+                            help='Comma separated invoice counts to benchmark')
+        parser.add_argument('--repeat', type=int, default=5, help='Requests timed per view and size')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(s) for s in options['sizes'].split(',') if s.strip())
+        try:
+            with transaction.atomic():
+                self._run(sizes, options['repeat'], options['batch_size'])
+                raise _Rollback()
+        except _Rollback:
+            pass
+        self.stdout.write(self.style.SUCCESS('Benchmark finished, seeded data rolled back.'))
+
+    def _run(self, sizes, repeat, batch_size):
+        User = get_user_model()
+        user = User.objects.create_user(
+            email='benchmark-overdue@example.com', password=None,
+            first_name='Bench', last_name='Mark', is_staff=True,
+        )
+        factory = RequestFactory()
+        views = [
+            ('invoice_list', invoice_list, '/invoices/'),
+            ('dashboard', dashboard, '/dashboard/'),
+            ('admin_dashboard', admin_dashboard, '/admin-dashboard/'),
+        ]
+        today = timezone.now().date()
+        statuses = ['Pending', 'Paid', 'Overdue']
+        seeded = 0
+        for size in sizes:
+            batch = []
+            for i in range(seeded, size):
+                batch.append(Invoice(
+                    user=user,
+                    client_name=f'Client {i % 500}',
+                    subtotal=Decimal('100.00'),
+                    vat_amount=Decimal('7.50'),
+                    total=Decimal('107.50'),
+                    due_date=today + timedelta(days=(i % 120) - 60),
+                    status=statuses[i % 3],
+                ))
+                if len(batch) >= batch_size:
+                    Invoice.objects.bulk_create(batch)
+                    batch = []
+            if batch:
+                Invoice.objects.bulk_create(batch)
+            seeded = size
+
+            for name, view, path in views:
+                timings = []
+                for _ in range(repeat):
+                    request = factory.get(path)
+                    request.user = user
+                    request.session = {}
+                    setattr(request, '_messages', FallbackStorage(request))
+                    started = time.perf_counter()
+                    view(request)
+                    timings.append((time.perf_counter() - started) * 1000)
+                timings.sort()
+                self.stdout.write(
+                    f'{size:>8} invoices  {name:<16} median {timings[len(timings) // 2]:8.1f} ms  '
+                    f'max {timings[-1]:8.1f} ms'
+                )
@@ -0,0 +1,139 @@
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.test import override_settings
+from django.utils import timezone
+from decimal import Decimal
+from io import BytesIO
+import multiprocessing
+import resource
+import shutil
+import tempfile
+import time
+
+from PIL import Image
+
+from invoices.export_utils import PDF_TEMPLATES
+from invoices.image_utils import image_variant
+from invoices.models import Invoice
+from invoices.pdf_engines import PDF_ENGINES
+from invoices.utils import load_document, pdf_context, render_pdf_bytes
+from quotations.models import Item, Quotation
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _measure(engine, template_src, context, repeat, results):
+    """Render in a forked process, so its peak RSS belongs to this engine and document alone"""
+    timings, size = [], 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        pdf_bytes, _ = render_pdf_bytes(template_src, context, engine=engine)
+        timings.append((time.perf_counter() - started) * 1000)
+        size = len(pdf_bytes or b'')
+    results.put((sorted(timings), size, _peak_rss_mb()))
+
+
+def _photo(seed, size=(1600, 1200)):
+    """A noisy JPEG, roughly as large and incompressible as a phone photo"""
+    channels = [Image.effect_noise(size, 20 + (seed + offset) % 60) for offset in (0, 7, 13)]
+    output = BytesIO()
+    Image.merge('RGB', channels).save(output, 'JPEG', quality=85)
+    return ContentFile(output.getvalue(), name=f'benchmark-{seed}.jpg')
+
+
+class Command(BaseCommand):
+    help = ('Render invoices and quotations of growing size with each PDF engine and report '
+            'latency, peak RSS and output size (data is rolled back)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--engines', default=','.join(PDF_ENGINES),
+                            help='Comma separated engines to compare (default: all installed)')
+        parser.add_argument('--items', default='1,20,200', help='Comma separated item counts')
+        parser.add_argument('--images', default='0,4,40',
+                            help='Comma separated image counts, capped at the item count')
+        parser.add_argument('--repeat', type=int, default=3, help='Renders timed per engine and document')
+
+    def handle(self, *args, **options):
+        engines = [name.strip() for name in options['engines'].split(',') if name.strip()]
+        unknown = [name for name in engines if name not in PDF_ENGINES]
+        if unknown:
+            raise CommandError(f"Unknown PDF engine(s): {', '.join(unknown)}")
+        for name in [name for name in engines if not PDF_ENGINES[name].available()]:
+            self.stdout.write(self.style.WARNING(f'Skipping {name}: not installed'))
+            engines.remove(name)
+        item_counts = sorted({int(s) for s in options['items'].split(',') if s.strip()})
+        image_counts = sorted({int(s) for s in options['images'].split(',') if s.strip()})
+        cases = sorted({(items, min(images, items)) for items in item_counts for images in image_counts})
+
+        media_root = tempfile.mkdtemp()
+        try:
+            # Seeded images go to a scratch MEDIA_ROOT, removed afterwards
+            with override_settings(MEDIA_ROOT=media_root), transaction.atomic():
+                self._run(engines, cases, options['repeat'])
+                raise _Rollback()
+        except _Rollback:
+            pass
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+        self.stdout.write(self.style.SUCCESS('Benchmark finished, seeded data rolled back.'))
+
+    def _seed(self, user, model, item_count, image_count, photos):
+        items = []
+        for i in range(item_count):
+            item = Item(
+                name=f'Benchmark item {i} with a description long enough to wrap in the table',
+                price=Decimal('1250.00') + i, quantity=1 + i % 5, unit=['', 'PCS', 'KG', 'BOX'][i % 4],
+                lead_time='2-3 WEEKS' if i % 3 else None, image=photos[i] if i < image_count else None,
+            )
+            items.append(item)
+        Item.objects.bulk_create(items)
+        totals = sum(item.total for item in items)
+        fields = {'due_date': timezone.localdate()} if model is Invoice else {'rfq_number': 'RFQ-1', 'vessel_name': 'MV Bench'}
+        document = model.objects.create(
+            user=user, client_name='Benchmark Client', subtotal=totals,
+            vat_amount=totals * Decimal('0.075'), total=totals * Decimal('1.075'),
+            notes='Benchmark document.', **fields,
+        )
+        document.items.add(*items)
+        return load_document(model, document.pk, user)
+
+    def _run(self, engines, cases, repeat):
+        user = get_user_model().objects.create_user(
+            username='benchmark-pdf', email='benchmark-pdf@example.com', password=None,
+        )
+        image_storage = Item._meta.get_field('image').storage
+        max_images = max((images for _, images in cases), default=0)
+        photos = [image_storage.save(f'benchmark-{i}.jpg', _photo(i)) for i in range(max_images)]
+        fork = multiprocessing.get_context('fork')
+
+        self.stdout.write(f"{'engine':<11}{'document':<11}{'items':>6}{'images':>7}"
+                          f"{'median ms':>11}{'max ms':>9}{'peak RSS MB':>13}{'size KB':>9}")
+        for model in (Invoice, Quotation):
+            model_name = model._meta.model_name
+            for item_count, image_count in cases:
+                document = self._seed(user, model, item_count, image_count, photos)
+                context = pdf_context(document)
+                # Resize the images once, up front; every engine uses the same print variants
+                for item in context['items_with_images']:
+                    image_variant(item.image, 'print')
+                for engine in engines:
+                    results = fork.Queue()
+                    process = fork.Process(
+                        target=_measure, args=(engine, PDF_TEMPLATES[model_name], context, repeat, results),
+                    )
+                    process.start()
+                    timings, size, peak_rss = results.get()
+                    process.join()
+                    self.stdout.write(
+                        f'{engine:<11}{model_name:<11}{item_count:>6}{image_count:>7}'
+                        f'{timings[len(timings) // 2]:>11.1f}{timings[-1]:>9.1f}{peak_rss:>13.1f}{size / 1024:>9.1f}'
+                    )
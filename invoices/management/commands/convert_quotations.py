@@ -0,0 +1,98 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from decimal import Decimal
+import time
+
+from invoices.conversion_utils import convert_quotations
+from invoices.utils import filter_documents
+from quotations.models import Item, Quotation
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Convert quotations to invoices in bulk (or benchmark conversion with --benchmark)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ids', help='Comma separated quotation ids')
+        parser.add_argument('--user', help='Only quotations of the user with this email')
+        parser.add_argument('--all', action='store_true', help='Convert every matching quotation')
+        parser.add_argument('--q', help='Client name contains')
+        parser.add_argument('--start', help='Created on or after (YYYY-MM-DD)')
+        parser.add_argument('--end', help='Created on or before (YYYY-MM-DD)')
+        parser.add_argument('--min', help='Minimum total')
+        parser.add_argument('--max', help='Maximum total')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--benchmark', type=int, metavar='N',
+                            help='Convert N generated quotations and report throughput (data is rolled back)')
+        parser.add_argument('--items', type=int, default=3, help='Items per generated quotation with --benchmark')
+
+    def handle(self, *args, **options):
+        if options['benchmark']:
+            return self._benchmark(options['benchmark'], options['items'], options['batch_size'])
+
+        quotations = Quotation.objects.all()
+        if options['ids']:
+            ids = [int(pk) for pk in options['ids'].split(',') if pk.strip()]
+            quotations = quotations.filter(pk__in=ids)
+        elif not (options['user'] or options['all']):
+            raise CommandError('Pass --ids, --user or --all to choose the quotations to convert')
+        if options['user']:
+            try:
+                user = get_user_model().objects.get(email=options['user'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"No user found with email: {options['user']}")
+            quotations = quotations.filter(user=user)
+        quotations = filter_documents(quotations, options)
+
+        started = time.perf_counter()
+        invoices = convert_quotations(quotations, batch_size=options['batch_size'])
+        self._report(len(invoices), time.perf_counter() - started)
+
+    def _report(self, count, elapsed):
+        rate = count / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Converted {count} quotation(s) in {elapsed:.2f}s ({rate:.0f} quotations/s)'
+        ))
+
+    def _benchmark(self, size, items_per_quotation, batch_size):
+        try:
+            with transaction.atomic():
+                user = get_user_model().objects.create_user(
+                    email='benchmark-convert@example.com', password=None,
+                    first_name='Bench', last_name='Mark',
+                )
+                self.stdout.write(f'Seeding {size} quotations with {items_per_quotation} item(s) each...')
+                quotations = Quotation.objects.bulk_create([
+                    Quotation(
+                        user=user,
+                        quotation_number=f'BENCH-{i}',
+                        client_name=f'Client {i % 500}',
+                        vessel_name=f'Vessel {i % 50}',
+                        currency='USD',
+                        subtotal=Decimal('300.00'),
+                        vat_amount=Decimal('22.50'),
+                        total=Decimal('322.50'),
+                    )
+                    for i in range(size)
+                ], batch_size=batch_size)
+                items = Item.objects.bulk_create([
+                    Item(name=f'Part {n}', price=Decimal('100.00'), quantity=1, unit='PCS', lead_time='2 weeks')
+                    for _ in quotations for n in range(items_per_quotation)
+                ], batch_size=batch_size)
+                through = Quotation.items.through
+                through.objects.bulk_create([
+                    through(quotation_id=quotation.pk, item_id=items[i * items_per_quotation + n].pk)
+                    for i, quotation in enumerate(quotations) for n in range(items_per_quotation)
+                ], batch_size=batch_size)
+
+                started = time.perf_counter()
+                invoices = convert_quotations(Quotation.objects.filter(user=user), batch_size=batch_size)
+                self._report(len(invoices), time.perf_counter() - started)
+                raise _Rollback()
+        except _Rollback:
+            pass
+        self.stdout.write(self.style.SUCCESS('Benchmark finished, seeded data rolled back.'))
@@ -0,0 +1,97 @@
+from django.core.management.base import BaseCommand
+from django.core.files import File
+
+from quotations.models import Item
+from quotations.storage import (
+    HASHED_NAME_RE, ITEM_IMAGE_DIR, content_hash, delete_unreferenced_image, hashed_name, recently_used,
+)
+
+
+def _format_bytes(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} GB'
+
+
+class Command(BaseCommand):
+    help = 'Move item images into the content-addressed store, sharing one file per distinct image'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without touching files')
+        parser.add_argument('--prune-orphans', action='store_true',
+                            help='Also delete files in item_images/ that no item refers to')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        storage = Item._meta.get_field('image').storage
+        names = (
+            Item.objects.exclude(image='').exclude(image__isnull=True)
+            .order_by().values_list('image', flat=True).distinct()
+        )
+        stored = set()
+        moved = duplicates = missing = reclaimed = 0
+        for name in names.iterator(chunk_size=1000):
+            if HASHED_NAME_RE.match(name):
+                stored.add(name)
+                continue
+            try:
+                with storage.open(name, 'rb') as fh:
+                    target = hashed_name(content_hash(File(fh)), name)
+                    size = storage.size(name)
+                    exists = target in stored or storage.exists(target)
+                    if not dry_run and not exists:
+                        storage.save(target, File(fh, name))
+            except OSError:
+                self.stdout.write(self.style.WARNING(f'Missing file: {name}'))
+                missing += 1
+                continue
+            if exists:
+                duplicates += 1
+                reclaimed += size
+            else:
+                moved += 1
+            stored.add(target)
+            if not dry_run:
+                Item.objects.filter(image=name).update(image=target)
+                storage.delete(name)
+
+        orphans = 0
+        if options['prune_orphans']:
+            referenced = set(names)
+            for name, size in self._stored_files(storage):
+                if name in referenced or name in stored:
+                    continue
+                # Checked again under the image lock: an upload may have just reused it
+                if dry_run:
+                    if recently_used(name):
+                        continue
+                elif not delete_unreferenced_image(storage, name):
+                    continue
+                orphans += 1
+                reclaimed += size
+
+        prefix = 'Would reclaim' if dry_run else 'Reclaimed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix} {_format_bytes(reclaimed)}: {duplicates} duplicate(s) merged, '
+            f'{moved} image(s) moved to the content store, {orphans} orphan(s) removed, '
+            f'{missing} missing file(s)'
+        ))
+
+    def _stored_files(self, storage):
+        """Yield (name, size) of item image uploads, skipping generated variants"""
+        try:
+            directories, files = storage.listdir(ITEM_IMAGE_DIR)
+        except (OSError, NotImplementedError):
+            return
+        for filename in files:
+            name = f'{ITEM_IMAGE_DIR}/{filename}'
+            yield name, storage.size(name)
+        for directory in directories:
+            if directory == 'variants':
+                continue
+            _, files = storage.listdir(f'{ITEM_IMAGE_DIR}/{directory}')
+            for filename in files:
+                name = f'{ITEM_IMAGE_DIR}/{directory}/{filename}'
+                yield name, storage.size(name)
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+import time
+
+from invoices.bulk_export import bulk_export_workers, stream_invoice_zip
+from invoices.export_utils import EXPORT_FORMATS
+from invoices.models import Invoice
+from invoices.pagination_utils import LIST_ORDERING
+from invoices.utils import filter_documents
+
+
+class Command(BaseCommand):
+    help = 'Export invoices matching the invoice list filters to a ZIP archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Path of the ZIP file to write')
+        parser.add_argument('--user', help='Email of the invoice owner (default: all users)')
+        parser.add_argument('--q', help='Client name contains')
+        parser.add_argument('--status', help='Invoice status, e.g. Paid')
+        parser.add_argument('--start', help='Created on or after (YYYY-MM-DD)')
+        parser.add_argument('--end', help='Created on or before (YYYY-MM-DD)')
+        parser.add_argument('--min', help='Minimum total')
+        parser.add_argument('--max', help='Maximum total')
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='pdf')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Render processes (default: settings.BULK_EXPORT_WORKERS)')
+
+    def handle(self, *args, **options):
+        invoices = Invoice.objects.all()
+        if options['user']:
+            try:
+                user = get_user_model().objects.get(email=options['user'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"No user found with email: {options['user']}")
+            invoices = invoices.filter(user=user)
+        invoices = filter_documents(invoices, options)
+        invoice_ids = list(invoices.order_by(*LIST_ORDERING).values_list('pk', flat=True))
+        if not invoice_ids:
+            raise CommandError('No invoices match the given filters')
+
+        workers = options['workers'] or bulk_export_workers()
+        started = time.perf_counter()
+        size = 0
+        with open(options['output'], 'wb') as fh:
+            for chunk in stream_invoice_zip(invoice_ids, options['format'], workers):
+                fh.write(chunk)
+                size += len(chunk)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {len(invoice_ids)} invoice(s) to {options['output']} "
+            f"({size / 1024:.0f} KB) in {elapsed:.1f}s with {workers} worker(s)"
+        ))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+
+from invoices.import_utils import IMPORT_BATCH_SIZE, import_format, import_invoices
+
+
+class Command(BaseCommand):
+    help = 'Import invoices and their items from a CSV or XLSX file (one row per item)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or XLSX file to import')
+        parser.add_argument('--user', required=True, help='Email of the user the invoices belong to')
+        parser.add_argument('--format', choices=('csv', 'xlsx'),
+                            help='File format (default: from the file extension)')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+                            help='Invoices written per transaction')
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(email=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"No user found with email: {options['user']}")
+        fmt = options['format'] or import_format(options['path'])
+        if fmt is None:
+            raise CommandError('Cannot tell the file format; pass --format csv or --format xlsx')
+
+        try:
+            with open(options['path'], 'rb') as fh:
+                report = import_invoices(user, fh, fmt, batch_size=options['batch_size'])
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not import {options['path']}: {e}")
+
+        for row_number, message in report.errors:
+            self.stderr.write(f'Row {row_number}: {message}')
+        if report.error_count > len(report.errors):
+            self.stderr.write(f'... and {report.error_count - len(report.errors)} more')
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {report.invoices} invoice(s) with {report.items} item(s) from {report.rows} row(s) '
+            f'in {report.elapsed:.2f}s ({report.rows_per_second:.0f} rows/s), {report.error_count} error(s)'
+        ))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+
+from invoices.search_utils import rebuild_search_index, search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search entries of invoices, quotations and their items'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Email of a single user to rebuild (default: all users)')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = get_user_model().objects.get(email=options['user'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"No user found with email: {options['user']}")
+        count = rebuild_search_index(user=user, batch_size=options['batch_size'])
+        scope = user.email if user else 'all users'
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {count} documents for {scope} ({search_backend()} search)'
+        ))
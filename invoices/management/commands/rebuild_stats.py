@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+
+from invoices.stats_utils import rebuild_stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-user invoice/quotation statistics rollup from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Email of a single user to rebuild (default: all users)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = get_user_model().objects.get(email=options['user'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"No user found with email: {options['user']}")
+        rows = rebuild_stats(user=user, batch_size=options['batch_size'])
+        scope = user.email if user else 'all users'
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rows} statistics rows for {scope}'))
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from datetime import timedelta
+import time
+
+from invoices.email_outbox import EMAIL_BATCH_SIZE, STALE_AFTER, claim_batch, deliver_batch, requeue_stale_emails
+
+# Seconds between checks for emails left sending by a dead worker
+STALE_CHECK_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    help = 'Send queued invoice emails, a batch per mail connection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit when no email is due')
+        parser.add_argument('--sleep', type=float, default=5.0, help='Seconds to wait when no email is due')
+        parser.add_argument('--batch-size', type=int, default=EMAIL_BATCH_SIZE,
+                            help='Emails sent per mail connection')
+        parser.add_argument('--stale-minutes', type=int, default=int(STALE_AFTER.total_seconds() // 60),
+                            help='Requeue emails left sending longer than this by a dead worker')
+
+    def recover_stale_emails(self, older_than):
+        requeued = requeue_stale_emails(older_than)
+        if requeued:
+            self.stdout.write(self.style.WARNING(f'Requeued {requeued} stale email(s)'))
+
+    def handle(self, *args, **options):
+        stale_after = timedelta(minutes=options['stale_minutes'])
+        self.recover_stale_emails(stale_after)
+        self.stdout.write(self.style.SUCCESS('Email worker started'))
+        sent = attempted = 0
+        next_recovery = time.monotonic() + STALE_CHECK_INTERVAL
+        try:
+            while True:
+                close_old_connections()
+                # Other workers may die while this one keeps running
+                if time.monotonic() >= next_recovery:
+                    self.recover_stale_emails(stale_after)
+                    next_recovery = time.monotonic() + STALE_CHECK_INTERVAL
+                emails = claim_batch(options['batch_size'])
+                if not emails:
+                    if options['once']:
+                        break
+                    time.sleep(options['sleep'])
+                    continue
+                started = time.perf_counter()
+                batch_sent = deliver_batch(emails)
+                elapsed = (time.perf_counter() - started) * 1000
+                style = self.style.SUCCESS if batch_sent == len(emails) else self.style.WARNING
+                self.stdout.write(style(f'Sent {batch_sent} of {len(emails)} email(s) in {elapsed:.0f} ms'))
+                sent += batch_sent
+                attempted += len(emails)
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'Email worker stopped after sending {sent} of {attempted} email(s)'))
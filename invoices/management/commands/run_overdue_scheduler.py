@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from datetime import date
+import time
+
+from invoices.overdue_utils import REMINDER_BATCH_SIZE, enqueue_reminders, mark_overdue
+
+
+class Command(BaseCommand):
+    help = 'Mark past-due invoices Overdue and queue the payment reminders due (safe to run repeatedly, e.g. from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Run as of this date, YYYY-MM-DD (default: today)')
+        parser.add_argument('--skip-reminders', action='store_true', help='Only mark invoices Overdue')
+        parser.add_argument('--batch-size', type=int, default=REMINDER_BATCH_SIZE,
+                            help='Invoices read and reminders inserted per query')
+
+    def handle(self, *args, **options):
+        today = None
+        if options['date']:
+            try:
+                today = date.fromisoformat(options['date'])
+            except ValueError:
+                raise CommandError(f"Invalid date: {options['date']}")
+
+        started = time.perf_counter()
+        marked = mark_overdue(today)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Marked {marked} invoice(s) Overdue in {elapsed:.2f}s'))
+        if options['skip_reminders']:
+            return
+
+        started = time.perf_counter()
+        queued, skipped = enqueue_reminders(today, batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Queued {queued} payment reminder(s) in {elapsed:.2f}s'))
+        if skipped:
+            self.stdout.write(self.style.WARNING(
+                f'Skipped {skipped} overdue invoice(s) whose client has never been emailed'
+            ))
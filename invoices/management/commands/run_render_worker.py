@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from datetime import timedelta
+import time
+
+from invoices.models import RenderJob
+from invoices.render_queue import claim_next_job, process_job, requeue_stale_jobs
+
+# Seconds between checks for jobs left running by a dead worker
+STALE_CHECK_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    help = 'Process queued PDF/DOCX export jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+        parser.add_argument('--sleep', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--stale-minutes', type=int, default=10,
+                            help='Requeue jobs left running longer than this by a dead worker')
+
+    def recover_stale_jobs(self, older_than):
+        requeued = requeue_stale_jobs(older_than)
+        if requeued:
+            self.stdout.write(self.style.WARNING(f'Requeued {requeued} stale job(s)'))
+
+    def handle(self, *args, **options):
+        stale_after = timedelta(minutes=options['stale_minutes'])
+        self.recover_stale_jobs(stale_after)
+        self.stdout.write(self.style.SUCCESS('Render worker started'))
+        processed = 0
+        next_recovery = time.monotonic() + STALE_CHECK_INTERVAL
+        try:
+            while True:
+                close_old_connections()
+                # Other workers may die while this one keeps running
+                if time.monotonic() >= next_recovery:
+                    self.recover_stale_jobs(stale_after)
+                    next_recovery = time.monotonic() + STALE_CHECK_INTERVAL
+                job = claim_next_job()
+                if job is None:
+                    if options['once']:
+                        break
+                    time.sleep(options['sleep'])
+                    continue
+                started = time.perf_counter()
+                job = process_job(job)
+                elapsed = (time.perf_counter() - started) * 1000
+                style = self.style.SUCCESS if job.status == RenderJob.DONE else self.style.ERROR
+                self.stdout.write(style(f'Job {job.pk} {job} in {elapsed:.0f} ms'))
+                processed += 1
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'Render worker stopped after {processed} job(s)'))
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.7 on 2026-10-18 02:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0007_remove_unique_invoice_number'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserInvoiceStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document_type', models.CharField(choices=[('invoice', 'Invoice'), ('quotation', 'Quotation')], max_length=10)),
+                ('month', models.DateField(help_text='First day of the month the documents were created in')),
+                ('currency', models.CharField(max_length=3)),
+                ('status', models.CharField(blank=True, default='', max_length=10)),
+                ('count', models.IntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='invoice_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'User invoice statistics',
+                'verbose_name_plural': 'User invoice statistics',
+                'constraints': [models.UniqueConstraint(fields=('user', 'document_type', 'month', 'currency', 'status'), name='unique_user_invoice_stats_bucket')],
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.1.7 on 2026-10-18 02:29
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def add_client_name_trigram_index(apps, schema_editor):
+    """PostgreSQL only: trigram index so client_name__icontains can avoid a sequential scan.
+
+    icontains compiles to UPPER(client_name) LIKE UPPER(%s), so the index is on UPPER(client_name).
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS invoice_client_name_trgm_idx '
+        'ON invoices_invoice USING gin (UPPER(client_name) gin_trgm_ops)'
+    )
+
+
+def remove_client_name_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS invoice_client_name_trgm_idx')
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0008_userinvoicestats'),
+        ('quotations', '0012_list_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['user', '-date_created', '-id'], name='invoice_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['user', 'status', 'due_date'], name='invoice_user_status_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['invoice_number'], name='invoice_number_idx'),
+        ),
+        migrations.RunPython(add_client_name_trigram_index, remove_client_name_trigram_index),
+    ]
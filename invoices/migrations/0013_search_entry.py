@@ -0,0 +1,81 @@
+# Generated by Django 5.1.7 on 2026-10-18 02:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.utils import OperationalError
+
+# Must match search_utils.PG_SEARCH_VECTOR for the index to be used
+PG_SEARCH_VECTOR = (
+    "(setweight(to_tsvector('simple'::regconfig, title), 'A') || "
+    "setweight(to_tsvector('simple'::regconfig, body), 'B'))"
+)
+
+SQLITE_FTS = [
+    "CREATE VIRTUAL TABLE invoices_searchentry_fts USING fts5("
+    "title, body, content='invoices_searchentry', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    # Keep the external-content FTS table in step with invoices_searchentry
+    "CREATE TRIGGER invoices_searchentry_fts_ai AFTER INSERT ON invoices_searchentry BEGIN "
+    "INSERT INTO invoices_searchentry_fts(rowid, title, body) VALUES (new.id, new.title, new.body); END",
+    "CREATE TRIGGER invoices_searchentry_fts_ad AFTER DELETE ON invoices_searchentry BEGIN "
+    "INSERT INTO invoices_searchentry_fts(invoices_searchentry_fts, rowid, title, body) "
+    "VALUES ('delete', old.id, old.title, old.body); END",
+    "CREATE TRIGGER invoices_searchentry_fts_au AFTER UPDATE ON invoices_searchentry BEGIN "
+    "INSERT INTO invoices_searchentry_fts(invoices_searchentry_fts, rowid, title, body) "
+    "VALUES ('delete', old.id, old.title, old.body); "
+    "INSERT INTO invoices_searchentry_fts(rowid, title, body) VALUES (new.id, new.title, new.body); END",
+]
+
+
+def add_full_text_index(apps, schema_editor):
+    """GIN index on PostgreSQL, an FTS5 table on SQLite; other databases search with icontains"""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS search_entry_vector_idx ON invoices_searchentry USING gin ({PG_SEARCH_VECTOR})'
+        )
+    elif vendor == 'sqlite':
+        try:
+            for statement in SQLITE_FTS:
+                schema_editor.execute(statement)
+        except OperationalError:
+            # SQLite built without FTS5
+            pass
+
+
+def remove_full_text_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS search_entry_vector_idx')
+    elif vendor == 'sqlite':
+        for suffix in ('ai', 'ad', 'au'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS invoices_searchentry_fts_{suffix}')
+        schema_editor.execute('DROP TABLE IF EXISTS invoices_searchentry_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0012_document_sequence'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document_type', models.CharField(choices=[('invoice', 'Invoice'), ('quotation', 'Quotation')], max_length=10)),
+                ('document_id', models.PositiveBigIntegerField()),
+                ('item_id', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('title', models.CharField(max_length=255)),
+                ('body', models.TextField(blank=True, default='')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['document_type', 'document_id'], name='search_entry_document_idx'), models.Index(fields=['item_id'], name='search_entry_item_idx')],
+            },
+        ),
+        migrations.RunPython(add_full_text_index, remove_full_text_index),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.1.7 on 2026-10-18 03:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0014_outbound_email'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReminderRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('days_overdue', models.PositiveSmallIntegerField()),
+                ('message', models.TextField(blank=True, default='')),
+                ('active', models.BooleanField(default=True)),
+            ],
+            options={
+                'ordering': ['days_overdue'],
+            },
+        ),
+        migrations.AddField(
+            model_name='outboundemail',
+            name='reminder_days',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='outboundemail',
+            constraint=models.UniqueConstraint(fields=('invoice', 'reminder_days'), name='unique_invoice_reminder'),
+        ),
+        migrations.AddField(
+            model_name='reminderrule',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reminder_rules', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='reminderrule',
+            constraint=models.UniqueConstraint(fields=('user', 'days_overdue'), name='unique_reminder_rule'),
+        ),
+    ]
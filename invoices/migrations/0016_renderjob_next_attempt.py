@@ -0,0 +1,29 @@
+# Generated by Django 5.1.7 on 2026-10-18 03:38
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0015_reminder_rules'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='renderjob',
+            name='renderjob_status_created_idx',
+        ),
+        migrations.AddField(
+            model_name='renderjob',
+            name='next_attempt',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='renderjob',
+            index=models.Index(fields=['status', 'next_attempt'], name='renderjob_status_next_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 04:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0016_renderjob_next_attempt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='renderjob',
+            name='artifact',
+            field=models.FileField(blank=True, default='', max_length=255, upload_to='render_jobs/'),
+        ),
+    ]
@@ -1,8 +1,23 @@
 from django.db import models
 from django.conf import settings
 from django.utils import timezone
+from decimal import Decimal
 from quotations.models import Item
 
+
+class InvoiceQuerySet(models.QuerySet):
+    def overdue(self):
+        """Invoices past their due date that have not been paid.
+
+        Mirrors Invoice.is_overdue() but is evaluated by the database so
+        callers can .count() without loading rows. The unpaid statuses are
+        listed rather than excluding 'Paid', so the (user, status, due_date)
+        index can seek on them.
+        """
+        unpaid = [status for status, _ in Invoice.STATUS_CHOICES if status != 'Paid']
+        return self.filter(status__in=unpaid, due_date__lt=timezone.now().date())
+
+
 class Invoice(models.Model):
     STATUS_CHOICES = (
         ('Pending', 'Pending'),
@@ -29,18 +44,256 @@ class Invoice(models.Model):
     vat_amount = models.DecimalField(max_digits=10, decimal_places=2)
     total = models.DecimalField(max_digits=10, decimal_places=2)
     date_created = models.DateTimeField(default=timezone.now)
+    date_updated = models.DateTimeField(auto_now=True)
     due_date = models.DateField()
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='Pending')
     notes = models.TextField(blank=True, null=True)
     
+    objects = InvoiceQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-date_created', '-id'], name='invoice_user_created_idx'),
+            models.Index(fields=['user', 'status', 'due_date'], name='invoice_user_status_due_idx'),
+            models.Index(fields=['user', 'invoice_number'], name='invoice_user_number_idx'),
+        ]
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The stored values, so the stats signals can tell what a save changed
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+    
+    def refresh_from_db(self, *args, **kwargs):
+        # Stale once the row is read again; the signals then query it
+        self.__dict__.pop('_loaded_values', None)
+        super().refresh_from_db(*args, **kwargs)
+    
     def __str__(self):
         return f"Invoice {(self.invoice_number or self.id).upper()} for {self.client_name}"
     
-    def calculate_totals(self):
-        self.subtotal = sum(item.total for item in self.items.all())
+    def calculate_totals(self, items=None):
+        # Pass the items when they are not saved yet (or already loaded)
+        items = self.items.all() if items is None else items
+        self.subtotal = sum(item.total for item in items)
         self.vat_amount = self.subtotal * (self.vat_percentage / 100)
         self.total = self.subtotal + self.vat_amount
         return self.total
     
     def is_overdue(self):
         return self.due_date < timezone.now().date() and self.status != 'Paid'
+
+
+class UserInvoiceStatsQuerySet(models.QuerySet):
+    def invoice_status_counts(self):
+        """Invoice counts per status, e.g. {'Paid': 3, 'Pending': 5}"""
+        rows = (
+            self.filter(document_type=UserInvoiceStats.INVOICE)
+            .values('status')
+            .annotate(total_count=models.Sum('count'))
+            .order_by()
+        )
+        return {row['status']: row['total_count'] or 0 for row in rows}
+    
+    def quotation_count(self):
+        result = self.filter(document_type=UserInvoiceStats.QUOTATION).aggregate(total_count=models.Sum('count'))
+        return result['total_count'] or 0
+    
+    def monthly_totals(self, since):
+        """Invoice totals per calendar month from the month of `since`, keyed by (year, month)"""
+        rows = (
+            self.filter(document_type=UserInvoiceStats.INVOICE, month__gte=since.replace(day=1))
+            .values('month')
+            .annotate(amount=models.Sum('total_amount'))
+            .order_by('month')
+        )
+        return {(row['month'].year, row['month'].month): row['amount'] or Decimal('0.00') for row in rows}
+
+
+class UserInvoiceStats(models.Model):
+    """Per user rollup of invoice and quotation counts and totals.
+    
+    One row per (user, document type, month, currency, status). Rows are
+    kept up to date by the signal handlers in invoices.signals and can be
+    rebuilt from scratch with the rebuild_stats management command.
+    """
+    INVOICE = 'invoice'
+    QUOTATION = 'quotation'
+    DOCUMENT_TYPE_CHOICES = (
+        (INVOICE, 'Invoice'),
+        (QUOTATION, 'Quotation'),
+    )
+    
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='invoice_stats')
+    document_type = models.CharField(max_length=10, choices=DOCUMENT_TYPE_CHOICES)
+    month = models.DateField(help_text="First day of the month the documents were created in")
+    currency = models.CharField(max_length=3)
+    status = models.CharField(max_length=10, blank=True, default='')
+    count = models.IntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    objects = UserInvoiceStatsQuerySet.as_manager()
+    
+    class Meta:
+        verbose_name = "User invoice statistics"
+        verbose_name_plural = "User invoice statistics"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'document_type', 'month', 'currency', 'status'],
+                name='unique_user_invoice_stats_bucket',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.user} {self.document_type} {self.month:%Y-%m} {self.currency} {self.status}: {self.count}"
+
+
+class RenderJob(models.Model):
+    """A queued PDF/DOCX export, processed by the run_render_worker command"""
+    QUEUED = 'Queued'
+    RUNNING = 'Running'
+    DONE = 'Done'
+    FAILED = 'Failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+    
+    DOCUMENT_TYPE_CHOICES = (
+        ('invoice', 'Invoice'),
+        ('quotation', 'Quotation'),
+    )
+    FORMAT_CHOICES = (
+        ('pdf', 'PDF'),
+        ('docx', 'Word'),
+    )
+    
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='render_jobs')
+    document_type = models.CharField(max_length=10, choices=DOCUMENT_TYPE_CHOICES)
+    document_id = models.PositiveBigIntegerField()
+    format = models.CharField(max_length=4, choices=FORMAT_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    fingerprint = models.CharField(max_length=64, blank=True, default='')
+    # The finished export, in the storage shared by the web and worker processes
+    artifact = models.FileField(upload_to='render_jobs/', max_length=255, blank=True, default='')
+    error = models.TextField(blank=True, default='')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    date_created = models.DateTimeField(default=timezone.now)
+    date_started = models.DateTimeField(null=True, blank=True)
+    date_finished = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt'], name='renderjob_status_next_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.format.upper()} {self.document_type} {self.document_id} ({self.status})"
+
+
+class DocumentSequence(models.Model):
+    """Last number handed out per user, document type and year (see invoices.numbering_utils)"""
+    DOCUMENT_TYPE_CHOICES = (
+        ('invoice', 'Invoice'),
+        ('quotation', 'Quotation'),
+    )
+    
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='document_sequences')
+    document_type = models.CharField(max_length=10, choices=DOCUMENT_TYPE_CHOICES)
+    year = models.PositiveSmallIntegerField()
+    last_number = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'document_type', 'year'], name='unique_document_sequence'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user} {self.document_type} {self.year}: {self.last_number}"
+
+
+class SearchEntry(models.Model):
+    """Searchable text of an invoice, quotation or one of their items (see invoices.search_utils)"""
+    DOCUMENT_TYPE_CHOICES = (
+        ('invoice', 'Invoice'),
+        ('quotation', 'Quotation'),
+    )
+    
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='search_entries')
+    document_type = models.CharField(max_length=10, choices=DOCUMENT_TYPE_CHOICES)
+    document_id = models.PositiveBigIntegerField()
+    # Set on the entries of items, which link to their document
+    item_id = models.PositiveBigIntegerField(null=True, blank=True)
+    title = models.CharField(max_length=255)
+    body = models.TextField(blank=True, default='')
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['document_type', 'document_id'], name='search_entry_document_idx'),
+            models.Index(fields=['item_id'], name='search_entry_item_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.document_type} {self.document_id}: {self.title}"
+
+
+class OutboundEmail(models.Model):
+    """An invoice email waiting in the outbox, sent by the run_email_worker command"""
+    QUEUED = 'Queued'
+    SENDING = 'Sending'
+    SENT = 'Sent'
+    FAILED = 'Failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    )
+    
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='outbound_emails')
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='emails')
+    recipient = models.EmailField()
+    message = models.TextField(blank=True, default='')
+    # Set on payment reminders: the days_overdue of the ReminderRule that sent it
+    reminder_days = models.PositiveSmallIntegerField(null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    error = models.TextField(blank=True, default='')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Not sent before this time; pushed back after each failed attempt
+    next_attempt = models.DateTimeField(default=timezone.now)
+    date_created = models.DateTimeField(default=timezone.now)
+    date_started = models.DateTimeField(null=True, blank=True)
+    date_sent = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt'], name='email_status_next_idx'),
+        ]
+        constraints = [
+            # One reminder per invoice and rule, however often the scheduler runs
+            models.UniqueConstraint(fields=['invoice', 'reminder_days'], name='unique_invoice_reminder'),
+        ]
+    
+    def __str__(self):
+        return f"Invoice {self.invoice_id} to {self.recipient} ({self.status})"
+
+
+class ReminderRule(models.Model):
+    """Email a reminder for invoices this many days past due (see invoices.overdue_utils)"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='reminder_rules')
+    days_overdue = models.PositiveSmallIntegerField()
+    message = models.TextField(blank=True, default='')
+    active = models.BooleanField(default=True)
+    
+    class Meta:
+        ordering = ['days_overdue']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'days_overdue'], name='unique_reminder_rule'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user}: {self.days_overdue} day(s) overdue"
@@ -0,0 +1,118 @@
+"""Race-free invoice and quotation numbers.
+
+Each user has one DocumentSequence row per document type and year. Numbers
+are handed out while that row is locked with SELECT ... FOR UPDATE, so
+concurrent submits by the same user are serialised. The lock is held
+until the surrounding transaction commits, which must also insert the
+document. Numbers are formatted as <prefix><year>-<nnnn>, e.g.
+INV-2026-0001, and the counter starts again each year. Prefixes come from
+settings.DOCUMENT_NUMBER_PREFIXES.
+"""
+from django.conf import settings
+from django.utils import timezone
+
+from .models import DocumentSequence
+
+DEFAULT_NUMBER_PREFIXES = {
+    'invoice': 'INV-',
+    'quotation': 'QTN-',
+}
+
+
+def number_prefix(document_type):
+    prefixes = getattr(settings, 'DOCUMENT_NUMBER_PREFIXES', {})
+    return prefixes.get(document_type, DEFAULT_NUMBER_PREFIXES[document_type])
+
+
+def format_document_number(document_type, year, number):
+    return f'{number_prefix(document_type)}{year}-{number:04d}'
+
+
+def number_taken(model, user, number):
+    """Whether the user already has a document with this number (indexed on user, number)"""
+    field = f'{model._meta.model_name}_number'
+    return model.objects.filter(user=user, **{field: number}).exists()
+
+
+def _next_free(model, user, year, last_number, reserved=()):
+    """First sequence number after last_number not already typed in by hand"""
+    document_type = model._meta.model_name
+    while True:
+        last_number += 1
+        number = format_document_number(document_type, year, last_number)
+        if number not in reserved and not number_taken(model, user, number):
+            return last_number, number
+
+
+def taken_numbers(model, user, numbers, batch_size=500):
+    """The subset of `numbers` the user already has documents with"""
+    field = f'{model._meta.model_name}_number'
+    numbers = list(numbers)
+    taken = set()
+    for start in range(0, len(numbers), batch_size):
+        taken.update(
+            model.objects.filter(user=user, **{f'{field}__in': numbers[start:start + batch_size]})
+            .values_list(field, flat=True)
+        )
+    return taken
+
+
+def lock_sequence(model, user):
+    """Lock and return (sequence, year) for the user's current year; call inside a transaction"""
+    year = timezone.localdate().year
+    sequence, _ = DocumentSequence.objects.select_for_update().get_or_create(
+        user=user, document_type=model._meta.model_name, year=year,
+    )
+    return sequence, year
+
+
+def reserve_document_number(model, user, number=None):
+    """Claim a number for a new Invoice or Quotation of `user`.
+
+    With `number` (typed in by the user) returns it, or None if it is
+    already used; otherwise returns the next number of the sequence. Must
+    be called inside transaction.atomic() together with the insert of the
+    document, which keeps the sequence row locked until then.
+    """
+    sequence, year = lock_sequence(model, user)
+    if number:
+        return None if number_taken(model, user, number) else number
+    sequence.last_number, number = _next_free(model, user, year, sequence.last_number)
+    sequence.save(update_fields=['last_number'])
+    return number
+
+
+def reserve_document_numbers(model, user, numbers):
+    """reserve_document_number() for many new documents of one user.
+
+    Returns one number per entry of `numbers`: the requested number, or the
+    next of the sequence when it is blank, already used or repeated.
+    """
+    sequence, year = lock_sequence(model, user)
+    requested = {number for number in numbers if number}
+    taken = taken_numbers(model, user, requested)
+    reserved = taken | requested
+    last_number = sequence.last_number
+    result = []
+    for number in numbers:
+        if not number or number in taken:
+            last_number, number = _next_free(model, user, year, last_number, reserved)
+            reserved.add(number)
+        taken.add(number)
+        result.append(number)
+    if last_number != sequence.last_number:
+        sequence.last_number = last_number
+        sequence.save(update_fields=['last_number'])
+    return result
+
+
+def peek_document_number(model, user):
+    """The number reserve_document_number() would assign next, without claiming it"""
+    year = timezone.localdate().year
+    last_number = (
+        DocumentSequence.objects
+        .filter(user=user, document_type=model._meta.model_name, year=year)
+        .values_list('last_number', flat=True)
+        .first()
+    ) or 0
+    return _next_free(model, user, year, last_number)[1]
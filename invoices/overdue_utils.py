@@ -0,0 +1,99 @@
+"""Overdue invoices: the status flip and the payment reminders.
+
+mark_overdue() moves every Pending invoice past its due date to Overdue
+with one UPDATE; the statistics rollup is adjusted with one GROUP BY
+query, as the UPDATE skips the model signals.
+
+enqueue_reminders() queues payment reminders in the email outbox
+according to each user's active ReminderRules. A rule of N days sends one
+reminder per invoice once it is N days past due. When the scheduler has
+not run for a while only the latest rule an invoice has reached is sent,
+not every rule it has passed. Reminders go to the address the client was
+last emailed at, so clients never emailed are skipped.
+
+Both steps are idempotent; the run_overdue_scheduler command runs them
+and is meant to be run from cron, e.g. daily.
+"""
+from django.db import transaction
+from django.utils import timezone
+from datetime import timedelta
+from functools import partial
+from itertools import groupby
+
+from .artifact_cache import delete_model_artifacts
+from .email_outbox import last_recipients
+from .models import Invoice, OutboundEmail, ReminderRule
+from .pagination_utils import bump_list_version
+from .stats_utils import move_invoice_status
+
+REMINDER_BATCH_SIZE = 1000
+
+
+def mark_overdue(today=None):
+    """Set Pending invoices due before `today` to Overdue; returns how many changed"""
+    today = today or timezone.localdate()
+    due = Invoice.objects.filter(status='Pending', due_date__lt=today)
+    with transaction.atomic():
+        # Lock the rows so the stats moved below match the rows updated
+        locked = list(due.select_for_update().values_list('pk', 'user_id'))
+        if not locked:
+            return 0
+        move_invoice_status(due, 'Pending', 'Overdue')
+        updated = due.update(status='Overdue', date_updated=timezone.now())
+        for user_id in {user_id for _, user_id in locked}:
+            bump_list_version(Invoice, user_id)
+        # The DOCX shows the status; the PDFs stay cached for the reminders
+        transaction.on_commit(partial(delete_model_artifacts, Invoice, [pk for pk, _ in locked], 'docx'))
+    return updated
+
+
+def _due_reminders(rule, today):
+    """Overdue invoices of the rule's user that reached it and got no reminder from it or a later rule"""
+    return (
+        Invoice.objects
+        .filter(user_id=rule.user_id, status='Overdue', due_date__lte=today - timedelta(days=rule.days_overdue))
+        .exclude(emails__reminder_days__gte=rule.days_overdue)
+        .order_by('pk')
+    )
+
+
+def enqueue_reminders(today=None, batch_size=REMINDER_BATCH_SIZE):
+    """Queue the payment reminders due by `today`; returns (queued, invoices skipped without recipient)"""
+    today = today or timezone.localdate()
+    queued = 0
+    skipped = set()
+    rules = (
+        ReminderRule.objects.filter(active=True)
+        .select_related('user').order_by('user_id', '-days_overdue')
+    )
+    for _, user_rules in groupby(rules, key=lambda rule: rule.user_id):
+        recipients = None
+        # Latest rule first, so an invoice past several rules gets only that one
+        for rule in user_rules:
+            last_pk = 0
+            while True:
+                batch = list(
+                    _due_reminders(rule, today).filter(pk__gt=last_pk)
+                    .only('pk', 'client_name')[:batch_size]
+                )
+                if not batch:
+                    break
+                last_pk = batch[-1].pk
+                if recipients is None:
+                    # Once per user; the reminders queued below do not change it
+                    recipients = last_recipients(rule.user)
+                emails = [
+                    OutboundEmail(
+                        user_id=rule.user_id,
+                        invoice_id=invoice.pk,
+                        recipient=recipients[invoice.client_name],
+                        message=rule.message,
+                        reminder_days=rule.days_overdue,
+                    )
+                    for invoice in batch if invoice.client_name in recipients
+                ]
+                # A concurrent run may have queued some of them already
+                OutboundEmail.objects.bulk_create(emails, ignore_conflicts=True)
+                queued += len(emails)
+                skipped.update(invoice.pk for invoice in batch if invoice.client_name not in recipients)
+    return queued, len(skipped)
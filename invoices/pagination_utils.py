@@ -0,0 +1,120 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator, Page, InvalidPage
+from django.db.models import Q
+from django.utils.functional import cached_property
+from datetime import datetime
+import hashlib
+
+PAGE_SIZE_CHOICES = (10, 25, 50, 100)
+LIST_COUNT_CACHE_TIMEOUT = 300
+
+# List views are ordered newest first; id breaks ties between equal timestamps
+LIST_ORDERING = ('-date_created', '-id')
+
+
+def get_page_size(request):
+    """Page size from ?page_size=, limited to PAGE_SIZE_CHOICES"""
+    default = getattr(settings, 'LIST_PAGE_SIZE', 25)
+    try:
+        page_size = int(request.GET.get('page_size', default))
+    except (TypeError, ValueError):
+        return default
+    return page_size if page_size in PAGE_SIZE_CHOICES else default
+
+
+def _list_version_key(model, user_id):
+    return f'list_version:{model._meta.label_lower}:{user_id}'
+
+
+def bump_list_version(model, user_id):
+    """Invalidate every cached list count of `model` for a user"""
+    key = _list_version_key(model, user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 2, None)
+
+
+def list_count_cache_key(model, user_id, params):
+    """Cache key for the row count of one filter combination"""
+    version = cache.get_or_set(_list_version_key(model, user_id), 1, None)
+    filters = '&'.join(f'{name}={params.get(name, "")}' for name in sorted(params))
+    digest = hashlib.md5(filters.encode('utf-8')).hexdigest()
+    return f'list_count:{model._meta.label_lower}:{user_id}:{version}:{digest}'
+
+
+class CachedCountPaginator(Paginator):
+    """Paginator whose COUNT(*) is cached under `count_cache_key`"""
+
+    def __init__(self, object_list, per_page, count_cache_key=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_cache_key = count_cache_key
+
+    @cached_property
+    def count(self):
+        if not self.count_cache_key:
+            return super().count
+        count = cache.get(self.count_cache_key)
+        if count is None:
+            count = super().count
+            cache.set(self.count_cache_key, count, LIST_COUNT_CACHE_TIMEOUT)
+        return count
+
+
+def encode_cursor(obj):
+    return f'{obj.date_created.isoformat()}_{obj.pk}'
+
+
+def decode_cursor(token):
+    """Return (date_created, pk) from a cursor token, or None if it is malformed"""
+    try:
+        created, pk = token.rsplit('_', 1)
+        return datetime.fromisoformat(created), int(pk)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def paginate_list(request, queryset, count_cache_key=None):
+    """Paginate a list view queryset ordered by LIST_ORDERING.
+
+    Numbered links use ?page=N (OFFSET). Previous/next links also carry an
+    ?after= or ?before= keyset cursor taken from the current page's last or
+    first row, so stepping through deep pages seeks on (date_created, id)
+    instead of scanning past every earlier row.
+
+    Returns the page together with an elided page range for the template.
+    """
+    queryset = queryset.order_by(*LIST_ORDERING)
+    paginator = CachedCountPaginator(queryset, get_page_size(request), count_cache_key=count_cache_key)
+
+    try:
+        number = paginator.validate_number(request.GET.get('page') or 1)
+    except InvalidPage:
+        number = paginator.num_pages if str(request.GET.get('page', '')).isdigit() else 1
+
+    after = decode_cursor(request.GET.get('after'))
+    before = decode_cursor(request.GET.get('before'))
+    if after:
+        created, pk = after
+        rows = list(
+            queryset.filter(Q(date_created__lt=created) | Q(date_created=created, pk__lt=pk))[:paginator.per_page]
+        )
+        page = Page(rows, number, paginator)
+    elif before:
+        created, pk = before
+        rows = list(
+            queryset.filter(Q(date_created__gt=created) | Q(date_created=created, pk__gt=pk))
+            .order_by('date_created', 'id')[:paginator.per_page]
+        )
+        rows.reverse()
+        page = Page(rows, number, paginator)
+    else:
+        page = paginator.page(number)
+
+    rows = list(page.object_list)
+    page.object_list = rows
+    page.next_cursor = encode_cursor(rows[-1]) if rows else None
+    page.previous_cursor = encode_cursor(rows[0]) if rows else None
+    page_range = paginator.get_elided_page_range(number, on_each_side=2, on_ends=1)
+    return page, page_range
@@ -0,0 +1,113 @@
+"""Resolve static/media URIs to local file paths for PDF and DOCX generation.
+
+xhtml2pdf calls its link_callback for every image, font and stylesheet in
+a template, and DOCX generation needs the file behind every item image.
+Results are kept in a small in-process LRU keyed by URI. A hit is trusted
+only while the file's mtime is unchanged, so replaced or deleted files
+are resolved again.
+"""
+from django.conf import settings
+from collections import OrderedDict
+import os
+import threading
+
+RESOLVER_CACHE_SIZE = 1024
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def _candidates(uri):
+    """Possible local paths for a URI, most likely first"""
+    static_url = settings.STATIC_URL
+    media_url = settings.MEDIA_URL
+    if uri.startswith(static_url):
+        rel_path = uri[len(static_url):]
+        # Prefer STATIC_ROOT if collected; otherwise the STATICFILES_DIRS
+        static_root = getattr(settings, 'STATIC_ROOT', '')
+        if static_root and os.path.isdir(static_root):
+            yield os.path.join(static_root, rel_path)
+        static_dirs = getattr(settings, 'STATICFILES_DIRS', []) or [os.path.join(settings.BASE_DIR, 'static')]
+        for static_dir in static_dirs:
+            yield os.path.join(static_dir, rel_path)
+        return
+    for prefix in (media_url, '/media/'):
+        if uri.startswith(prefix):
+            rel_path = uri[len(prefix):]
+            yield os.path.join(settings.MEDIA_ROOT, rel_path)
+            # Older uploads may have been moved flat into item_images/
+            yield os.path.join(settings.MEDIA_ROOT, 'item_images', os.path.basename(rel_path))
+            return
+    yield os.path.join(settings.BASE_DIR, uri.lstrip('/'))
+
+
+def _resolve(uri):
+    if os.path.isabs(uri) and os.path.exists(uri):
+        return uri
+    candidates = list(_candidates(uri))
+    for path in candidates:
+        if os.path.exists(path):
+            return path
+    return candidates[0]
+
+
+def _lookup(uri):
+    """Return (path, exists) for a URI, from the cache when still valid"""
+    with _lock:
+        entry = _cache.get(uri)
+        if entry is not None:
+            _cache.move_to_end(uri)
+    if entry is not None:
+        path, mtime_ns = entry
+        try:
+            if os.stat(path).st_mtime_ns == mtime_ns:
+                return path, True
+        except OSError:
+            pass
+
+    path = _resolve(uri)
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        # Missing files are not cached, so they are found once they appear
+        with _lock:
+            _cache.pop(uri, None)
+        return path, False
+    with _lock:
+        _cache[uri] = (path, mtime_ns)
+        _cache.move_to_end(uri)
+        while len(_cache) > RESOLVER_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return path, True
+
+
+def resolve_uri(uri):
+    """Local path for a static/media URI or absolute path.
+
+    Returns the most likely path even when no file exists, as xhtml2pdf
+    expects; use resolve_existing() to get None instead.
+    """
+    return _lookup(uri)[0]
+
+
+def resolve_existing(uri):
+    """Like resolve_uri(), but None when the file does not exist"""
+    path, exists = _lookup(uri)
+    return path if exists else None
+
+
+def resolve_image_path(field_file, variant=None):
+    """Local path of an item image (or of its resized variant), or None"""
+    if not field_file:
+        return None
+    if variant:
+        from .image_utils import image_variant_url
+        url = image_variant_url(field_file, variant)
+    else:
+        url = field_file.url
+    return resolve_existing(url)
+
+
+def clear_resolver_cache():
+    with _lock:
+        _cache.clear()
@@ -0,0 +1,123 @@
+"""PDF engines for invoice and quotation exports.
+
+The engine is chosen with the PDF_ENGINE setting:
+
+    xhtml2pdf   renders the PDF templates with xhtml2pdf (the default)
+    weasyprint  renders the same templates with WeasyPrint
+    reportlab   draws the layout directly with ReportLab (see
+                invoices.reportlab_pdf); the templates are not used
+
+An engine whose library is not installed falls back to xhtml2pdf. Each
+engine has its own version() for the artifact cache, so switching engines
+renders the documents again instead of serving the other engine's PDFs.
+Compare the engines with the benchmark_pdf_engines command.
+"""
+from django.conf import settings
+from django.template.loader import get_template
+from io import BytesIO
+from pathlib import Path
+import logging
+
+from .artifact_cache import template_version
+from .path_resolver import resolve_existing, resolve_uri
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PDF_ENGINE = 'xhtml2pdf'
+
+
+class PDFRenderError(Exception):
+    pass
+
+
+class XHTML2PDFEngine:
+    name = 'xhtml2pdf'
+
+    def available(self):
+        try:
+            from xhtml2pdf import pisa  # noqa: F401
+        except Exception:
+            return False
+        return True
+
+    def version(self, template_src):
+        return f'{self.name}-{template_version(template_src)}'
+
+    def render(self, template_src, context):
+        from xhtml2pdf import pisa
+        html = get_template(template_src).render(context)
+        result = BytesIO()
+        # link_callback resolves static/media URIs to local files
+        pdf = pisa.CreatePDF(
+            src=BytesIO(html.encode('utf-8')), dest=result, encoding='utf-8',
+            link_callback=lambda uri, rel: resolve_uri(uri),
+        )
+        if pdf.err:
+            raise PDFRenderError(f'xhtml2pdf reported {pdf.err} error(s)')
+        return result.getvalue()
+
+
+def _weasyprint_fetcher(url):
+    """Serve /static/ and /media/ URLs from the local files"""
+    from weasyprint import default_url_fetcher
+    if url.startswith('file://'):
+        path = resolve_existing(url[len('file://'):])
+        if path:
+            url = Path(path).as_uri()
+    return default_url_fetcher(url)
+
+
+class WeasyPrintEngine(XHTML2PDFEngine):
+    name = 'weasyprint'
+
+    def available(self):
+        try:
+            import weasyprint  # noqa: F401
+        except Exception:
+            return False
+        return True
+
+    def render(self, template_src, context):
+        from weasyprint import HTML
+        html = get_template(template_src).render(context)
+        return HTML(string=html, base_url='file:///', url_fetcher=_weasyprint_fetcher).write_pdf()
+
+
+class ReportLabEngine:
+    name = 'reportlab'
+
+    def available(self):
+        try:
+            from . import reportlab_pdf  # noqa: F401
+        except Exception:
+            return False
+        return True
+
+    def version(self, template_src):
+        from .reportlab_pdf import layout_version
+        return layout_version()
+
+    def render(self, template_src, context):
+        from .reportlab_pdf import render_document_pdf
+        document = context.get('invoice') or context.get('quotation')
+        return render_document_pdf(document, context['items'], context['items_with_images'])
+
+
+PDF_ENGINES = {
+    engine.name: engine
+    for engine in (XHTML2PDFEngine(), WeasyPrintEngine(), ReportLabEngine())
+}
+
+
+def get_pdf_engine(name=None):
+    """The engine called `name`, by default the PDF_ENGINE setting; None if none is installed"""
+    name = name or getattr(settings, 'PDF_ENGINE', DEFAULT_PDF_ENGINE)
+    engine = PDF_ENGINES.get(name)
+    if engine is None:
+        logger.warning(f'Unknown PDF engine {name!r}; using {DEFAULT_PDF_ENGINE}')
+    elif engine.available():
+        return engine
+    else:
+        logger.warning(f'PDF engine {name!r} is not installed; using {DEFAULT_PDF_ENGINE}')
+    engine = PDF_ENGINES[DEFAULT_PDF_ENGINE]
+    return engine if engine.available() else None
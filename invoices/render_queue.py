@@ -0,0 +1,180 @@
+"""Database-backed queue of PDF/DOCX exports.
+
+Web requests enqueue a RenderJob and return immediately; the
+run_render_worker management command claims queued jobs, renders them
+through invoices.export_utils (which stores the bytes in its local
+artifact cache) and saves the file in the job's `artifact`, in the default
+storage, with the resulting fingerprint. The worker runs as its own
+service with its own disk, so the download endpoint streams the file from
+that storage, not from the artifact cache. A failed render is retried with exponential
+backoff (see retry_delay()) until MAX_ATTEMPTS, then marked Failed; so is
+a job whose worker died mid-render, as the render itself may be the cause.
+"""
+from django.core.files.base import ContentFile
+from django.db.models import F
+from django.urls import reverse
+from django.utils import timezone
+from datetime import timedelta
+import logging
+import os
+
+from .artifact_cache import artifact_path, open_artifact
+from .export_utils import export_fingerprint, get_document_export
+from .models import Invoice, RenderJob
+from quotations.models import Quotation
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 3
+
+RETRY_BASE_DELAY = timedelta(seconds=15)
+
+DOCUMENT_MODELS = {
+    'invoice': Invoice,
+    'quotation': Quotation,
+}
+
+
+def retry_delay(attempts):
+    """Wait before the next try after `attempts` failures: 15, 30, 60... seconds"""
+    return RETRY_BASE_DELAY * (2 ** max(attempts - 1, 0))
+
+
+def job_document(job):
+    """The Invoice or Quotation a job renders, with items prefetched (None if deleted)"""
+    model = DOCUMENT_MODELS[job.document_type]
+    return model.objects.prefetch_related('items').filter(pk=job.document_id).first()
+
+
+def open_job_artifact(job, document=None):
+    """A finished job's artifact as an open binary file, or None if it is gone or out of date"""
+    if job.status != RenderJob.DONE or not job.fingerprint:
+        return None
+    document = document or job_document(job)
+    if document is None or export_fingerprint(document, job.format) != job.fingerprint:
+        return None
+    if not job.artifact:
+        # Done when enqueued, from this process's artifact cache
+        return open_artifact(document, job.fingerprint, job.format)
+    storage = job.artifact.storage
+    if not storage.exists(job.artifact.name):
+        return None
+    return storage.open(job.artifact.name, 'rb')
+
+
+def _store_artifact(job, fingerprint, data):
+    name = f'{job.document_type}-{job.document_id}-{fingerprint}.{job.format}'
+    job.artifact.save(name, ContentFile(data), save=False)
+
+
+def enqueue_render_job(user, document, fmt):
+    """Queue an export of `document`, or reuse the cached artifact if it is current.
+
+    Returns the RenderJob; it is already Done when the artifact is cached.
+    """
+    job = RenderJob(
+        user=user,
+        document_type=document._meta.model_name,
+        document_id=document.pk,
+        format=fmt,
+    )
+    fingerprint = export_fingerprint(document, fmt)
+    if os.path.exists(artifact_path(document, fingerprint, fmt)):
+        now = timezone.now()
+        job.status = RenderJob.DONE
+        job.fingerprint = fingerprint
+        job.date_started = job.date_finished = now
+    job.save()
+    return job
+
+
+def requeue_job(job):
+    """Render a finished job again, e.g. after its artifact was deleted or the document changed"""
+    if job.artifact:
+        job.artifact.delete(save=False)
+    RenderJob.objects.filter(pk=job.pk).update(
+        status=RenderJob.QUEUED, fingerprint='', artifact='', error='', attempts=0, next_attempt=timezone.now(),
+    )
+    job.refresh_from_db()
+    return job
+
+
+def requeue_stale_jobs(older_than=timedelta(minutes=10)):
+    """Recover jobs left Running by a worker that died; returns how many were requeued.
+
+    A job that already used its MAX_ATTEMPTS is marked Failed instead, so a
+    document that crashes the worker every time is not retried forever.
+    """
+    now = timezone.now()
+    stale = RenderJob.objects.filter(status=RenderJob.RUNNING, date_started__lt=now - older_than)
+    stale.filter(attempts__gte=MAX_ATTEMPTS).update(
+        status=RenderJob.FAILED, error='The render worker stopped while rendering', date_finished=now,
+    )
+    return stale.filter(attempts__lt=MAX_ATTEMPTS).update(status=RenderJob.QUEUED, next_attempt=now)
+
+
+def claim_next_job():
+    """Atomically move the oldest due job to Running and return it.
+
+    Claiming is a conditional UPDATE on status, so concurrent workers never
+    process the same job, on any database backend.
+    """
+    while True:
+        candidate = (
+            RenderJob.objects.filter(status=RenderJob.QUEUED, next_attempt__lte=timezone.now())
+            .order_by('next_attempt', 'id')
+            .values_list('pk', flat=True)
+            .first()
+        )
+        if candidate is None:
+            return None
+        claimed = RenderJob.objects.filter(pk=candidate, status=RenderJob.QUEUED).update(
+            status=RenderJob.RUNNING,
+            date_started=timezone.now(),
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return RenderJob.objects.get(pk=candidate)
+
+
+def process_job(job):
+    """Render one claimed job and record the outcome"""
+    try:
+        document = job_document(job)
+        if document is None:
+            raise LookupError(f"{job.document_type} {job.document_id} no longer exists")
+        fingerprint, data = get_document_export(document, job.format)
+        if data is None:
+            raise RuntimeError(f"Rendering {job.format} produced no output")
+        _store_artifact(job, fingerprint, data)
+    except Exception as e:
+        logger.exception(f"Render job {job.pk} failed")
+        retry = job.attempts < MAX_ATTEMPTS and not isinstance(e, LookupError)
+        job.status = RenderJob.QUEUED if retry else RenderJob.FAILED
+        job.error = str(e)
+        if retry:
+            job.next_attempt = timezone.now() + retry_delay(job.attempts)
+        else:
+            job.date_finished = timezone.now()
+        job.save(update_fields=['status', 'error', 'next_attempt', 'date_finished'])
+        return job
+    job.status = RenderJob.DONE
+    job.fingerprint = fingerprint
+    job.error = ''
+    job.date_finished = timezone.now()
+    job.save(update_fields=['status', 'fingerprint', 'artifact', 'error', 'date_finished'])
+    return job
+
+
+def job_payload(job):
+    """JSON-serialisable status of a job for the export endpoints"""
+    payload = {
+        'job_id': job.pk,
+        'status': job.status,
+        'format': job.format,
+        'error': job.error,
+        'status_url': reverse('render_job_status', args=[job.pk]),
+    }
+    if job.status == RenderJob.DONE:
+        payload['download_url'] = reverse('render_job_download', args=[job.pk])
+    return payload
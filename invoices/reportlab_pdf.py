@@ -0,0 +1,240 @@
+"""Invoice and quotation PDFs built directly with ReportLab platypus.
+
+Produces the layout of invoices/invoice_pdf.html and
+quotations/quotation_pdf.html from the model data, without rendering or
+parsing HTML: address box, logo, client and date table, item table (with
+units and lead times, its heading repeated on every page), totals, notes
+and the item images in a 2x2 grid, four to a page. Used by the
+'reportlab' PDF engine (see invoices.pdf_engines).
+"""
+from django.templatetags.static import static
+from io import BytesIO
+
+from reportlab import rl_config
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.units import cm
+from reportlab.platypus import (
+    HRFlowable, Image, PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle,
+)
+from xml.sax.saxutils import escape
+
+from .artifact_cache import file_checksum
+from .path_resolver import resolve_existing, resolve_image_path
+from .utils import COMPANY_DETAILS
+
+MARGIN = 1.5 * cm
+CONTENT_WIDTH = A4[0] - 2 * MARGIN
+
+TEXT_COLOR = colors.HexColor('#333333')
+BORDER_COLOR = colors.HexColor('#333333')
+HEADING_BACKGROUND = colors.HexColor('#f8f8f8')
+
+FONT = 'Helvetica'
+BOLD = 'Helvetica-Bold'
+
+BODY = ParagraphStyle('body', fontName=FONT, fontSize=10, leading=13, textColor=TEXT_COLOR)
+ADDRESS = ParagraphStyle('address', parent=BODY, fontSize=9, leading=12)
+TITLE = ParagraphStyle('title', parent=BODY, fontName=BOLD, fontSize=16, leading=20, alignment=TA_CENTER)
+CELL = ParagraphStyle('cell', parent=BODY, fontSize=8, leading=10)
+CAPTION = ParagraphStyle('caption', parent=BODY, fontName=BOLD, alignment=TA_CENTER)
+
+# ITEM, DESCRIPTION, QTY, UNIT PRICE, TOTAL, LEAD TIME
+ITEM_COLUMNS = [w * CONTENT_WIDTH for w in (0.07, 0.37, 0.12, 0.15, 0.15, 0.14)]
+
+ITEM_TABLE_STYLE = TableStyle([
+    ('FONT', (0, 0), (-1, 0), BOLD, 8),
+    ('FONT', (0, 1), (-1, -1), FONT, 8),
+    ('TEXTCOLOR', (0, 0), (-1, -1), TEXT_COLOR),
+    ('BACKGROUND', (0, 0), (-1, 0), HEADING_BACKGROUND),
+    ('GRID', (0, 0), (-1, -1), 1.5, BORDER_COLOR),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ('TOPPADDING', (0, 0), (-1, -1), 4),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
+])
+
+# Item images: two columns, two rows per page
+IMAGE_CELL_WIDTH = CONTENT_WIDTH / 2
+IMAGE_MAX_HEIGHT = 225
+
+
+def _logo_path():
+    return resolve_existing(static('images/skids_logo.png'))
+
+
+def layout_version():
+    """Version for the artifact cache: changes with this module and the logo"""
+    logo_path = _logo_path()
+    logo = file_checksum(logo_path) if logo_path else ''
+    return f"reportlab-{file_checksum(__file__)}-{logo}"
+
+
+def _amount(value, places=0):
+    return f'{value:,.{places}f}'
+
+
+def _quantity(item):
+    return f'{item.quantity} {item.unit}' if item.unit else str(item.quantity)
+
+
+def _header():
+    address = escape(
+        f"{COMPANY_DETAILS['company_address']}, T: {COMPANY_DETAILS['company_phone']}, "
+        f"E: {COMPANY_DETAILS['company_email']}."
+    )
+    box = Table([[Paragraph(address, ADDRESS)]], colWidths=[CONTENT_WIDTH], style=[
+        ('BOX', (0, 0), (-1, -1), 2, BORDER_COLOR),
+        ('ROUNDEDCORNERS', [5, 5, 5, 5]),
+        ('LEFTPADDING', (0, 0), (-1, -1), 10),
+        ('TOPPADDING', (0, 0), (-1, -1), 8),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+    ])
+    flowables = [box, Spacer(0, 15)]
+    logo_path = _logo_path()
+    if logo_path:
+        flowables += [Image(logo_path, width=225, height=112, kind='proportional', hAlign='LEFT'), Spacer(0, 15)]
+    flowables += [HRFlowable(width='100%', thickness=3, color=colors.black, spaceAfter=20)]
+    return flowables
+
+
+def _info(document):
+    """Client, then the invoice dates or the quotation's RFQ, vessel and date"""
+    if document._meta.model_name == 'invoice':
+        rows = [
+            ('Date:', f'{document.date_created:%d/%m/%Y}'),
+            ('Due Date:', f'{document.due_date:%d/%m/%Y}'),
+        ]
+    else:
+        rows = [
+            ('RFQ:', document.rfq_number or 'N/A'),
+            ('Vessel:', document.vessel_name or 'N/A'),
+            ('Date:', f'{document.date_created:%d-%m-%Y}'),
+        ]
+    rows = [('Client:', document.client_name), ('', '')] + rows
+    return Table(
+        [[label, Paragraph(escape(value), BODY)] for label, value in rows],
+        colWidths=[60, CONTENT_WIDTH - 60], hAlign='LEFT',
+        style=[
+            ('FONT', (0, 0), (0, -1), BOLD, 10),
+            ('TEXTCOLOR', (0, 0), (-1, -1), TEXT_COLOR),
+            ('LEFTPADDING', (0, 0), (-1, -1), 0),
+            ('TOPPADDING', (0, 0), (-1, -1), 1),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 1),
+        ],
+    )
+
+
+def _items_table(items, currency):
+    rows = [['ITEM', 'DESCRIPTION', 'QTY', f'UNIT PRICE\n({currency})', f'TOTAL\n({currency})', 'LEAD TIME']]
+    for number, item in enumerate(items, 1):
+        rows.append([
+            str(number),
+            Paragraph(escape(item.name), CELL),
+            _quantity(item),
+            _amount(item.price),
+            _amount(item.total),
+            item.lead_time or '1-7 DAYS',
+        ])
+    return Table(rows, colWidths=ITEM_COLUMNS, repeatRows=1, style=ITEM_TABLE_STYLE)
+
+
+def _totals(document):
+    currency = document.currency
+    rows = [
+        ('Subtotal:', f'{_amount(document.subtotal, 2)} {currency}'),
+        (f'VAT ({document.vat_percentage}%):', f'{_amount(document.vat_amount, 2)} {currency}'),
+        ('Total:', f'{_amount(document.total, 2)} {currency}'),
+    ]
+    table = Table(rows, hAlign='RIGHT', style=[
+        ('FONT', (0, 0), (-1, -1), BOLD, 11),
+        ('FONT', (0, -1), (-1, -1), BOLD, 13),
+        ('TEXTCOLOR', (0, 0), (-1, -1), TEXT_COLOR),
+        ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+        ('LINEABOVE', (0, -1), (-1, -1), 1, colors.HexColor('#cccccc')),
+        ('TOPPADDING', (0, -1), (-1, -1), 8),
+    ])
+    return [
+        Spacer(0, 20),
+        HRFlowable(width='100%', thickness=2, color=BORDER_COLOR, spaceAfter=10),
+        table,
+    ]
+
+
+def _notes(notes):
+    paragraphs = [Paragraph('<b>Notes:</b>', BODY)]
+    paragraphs += [Paragraph(escape(line), BODY) for line in notes.splitlines() if line.strip()]
+    return [Spacer(0, 20), Table([[paragraphs]], colWidths=[CONTENT_WIDTH], style=[
+        ('BACKGROUND', (0, 0), (-1, -1), HEADING_BACKGROUND),
+        ('LINEBEFORE', (0, 0), (0, -1), 4, BORDER_COLOR),
+        ('LEFTPADDING', (0, 0), (-1, -1), 10),
+        ('TOPPADDING', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
+    ])]
+
+
+def _image_cell(item):
+    caption = Paragraph(escape(item.name), CAPTION)
+    path = resolve_image_path(item.image, 'print') or resolve_image_path(item.image)
+    if not path:
+        return [Paragraph(escape(f'[Image not available for {item.name}]'), CELL), caption]
+    try:
+        # A JPEG path is embedded as it is, without decoding the image
+        image = Image(path, width=IMAGE_CELL_WIDTH - 30, height=IMAGE_MAX_HEIGHT, kind='bound')
+    except Exception:
+        return [Paragraph(escape(f'[Image not available for {item.name}]'), CELL), caption]
+    return [image, Spacer(0, 8), caption]
+
+
+def _image_pages(items_with_images):
+    flowables = [PageBreak(), Paragraph('ITEM IMAGES', TITLE), Spacer(0, 20)]
+    for start in range(0, len(items_with_images), 4):
+        if start:
+            flowables.append(PageBreak())
+        cells = [_image_cell(item) for item in items_with_images[start:start + 4]]
+        cells += [''] * (len(cells) % 2)
+        rows = [cells[i:i + 2] for i in range(0, len(cells), 2)]
+        flowables.append(Table(rows, colWidths=[IMAGE_CELL_WIDTH] * 2, style=[
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 30),
+        ]))
+    return flowables
+
+
+def build_document_pdf(document, items, items_with_images, output):
+    """Write the PDF of an Invoice or Quotation to `output`, a path or binary file"""
+    model_name = document._meta.model_name
+    number = getattr(document, f'{model_name}_number') or document.id
+    title = f'{model_name.upper()} {number}'
+    story = _header()
+    story += [_info(document), Spacer(0, 20), Paragraph(f'<u>{escape(title)}</u>', TITLE), Spacer(0, 16)]
+    story.append(_items_table(items, document.currency or 'NGN'))
+    story += _totals(document)
+    if document.notes:
+        story += _notes(document.notes)
+    if items_with_images:
+        story += _image_pages(items_with_images)
+    doc = SimpleDocTemplate(
+        output, pagesize=A4, title=title, author=COMPANY_DETAILS['company_name'],
+        leftMargin=MARGIN, rightMargin=MARGIN, topMargin=MARGIN, bottomMargin=MARGIN,
+    )
+    # ReportLab's ASCII85 encoding of streams is pure Python without _rl_accel
+    # and dominates renders with images; binary streams are also 20% smaller.
+    # The setting is global, so it is restored for xhtml2pdf and other callers.
+    use_a85 = rl_config.useA85
+    rl_config.useA85 = 0
+    try:
+        doc.build(story)
+    finally:
+        rl_config.useA85 = use_a85
+
+
+def render_document_pdf(document, items, items_with_images):
+    """PDF bytes of an Invoice or Quotation"""
+    output = BytesIO()
+    build_document_pdf(document, items, items_with_images, output)
+    return output.getvalue()
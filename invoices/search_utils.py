@@ -0,0 +1,249 @@
+"""Full-text search over invoices, quotations and their items.
+
+Each document has one SearchEntry holding its number, client and other
+text fields, plus one entry per item (name, unit, lead time) linking back
+to the document. Entries are matched and ranked by the database:
+
+    PostgreSQL  weighted tsvector with a GIN index (migration 0013)
+    SQLite      an FTS5 table kept in step by triggers, ranked with bm25
+    otherwise   icontains on every search term, unranked
+
+Titles weigh more than bodies, so a document number or client name ranks
+above a mention in the notes. Entries are refreshed by the signals in
+invoices.signals and by bulk_create_documents(); the rebuild_search_index
+command fills them in for existing data.
+"""
+from django.db import connection
+from django.db.models import BooleanField, F, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.urls import reverse
+import re
+
+from .models import Invoice, SearchEntry
+from quotations.models import Quotation
+
+# Must match the index expression of migration 0013
+PG_SEARCH_VECTOR = (
+    "(setweight(to_tsvector('simple'::regconfig, title), 'A') || "
+    "setweight(to_tsvector('simple'::regconfig, body), 'B'))"
+)
+
+FTS_TABLE = 'invoices_searchentry_fts'
+
+# bm25 column weights for title and body
+FTS_WEIGHTS = (10.0, 1.0)
+
+MAX_TERMS = 8
+
+SEARCH_LIMIT = 20
+
+DOCUMENT_MODELS = {
+    'invoice': Invoice,
+    'quotation': Quotation,
+}
+
+_fts_available = None
+
+
+def search_backend():
+    """'postgresql', 'fts5' or 'basic'"""
+    global _fts_available
+    if connection.vendor == 'postgresql':
+        return 'postgresql'
+    if connection.vendor == 'sqlite':
+        if _fts_available is None:
+            _fts_available = FTS_TABLE in connection.introspection.table_names()
+        if _fts_available:
+            return 'fts5'
+    return 'basic'
+
+
+def search_terms(query):
+    """Words of a search box query; punctuation is dropped, as by the tokenizers"""
+    return re.findall(r'\w+', (query or '').lower())[:MAX_TERMS]
+
+
+def _document_text(document):
+    number = getattr(document, f'{document._meta.model_name}_number') or ''
+    title = f'{number} {document.client_name}'.strip()
+    fields = [document.notes]
+    if isinstance(document, Quotation):
+        fields = [document.rfq_number, document.vessel_name] + fields
+    return title[:255], ' '.join(field for field in fields if field)
+
+
+def _item_text(item):
+    return item.name[:255], ' '.join(field for field in (item.unit, item.lead_time) if field)
+
+
+def _entries_for(document, items):
+    document_type = document._meta.model_name
+    title, body = _document_text(document)
+    entries = [SearchEntry(
+        user_id=document.user_id, document_type=document_type, document_id=document.pk,
+        title=title, body=body,
+    )]
+    for item in items:
+        title, body = _item_text(item)
+        entries.append(SearchEntry(
+            user_id=document.user_id, document_type=document_type, document_id=document.pk,
+            item_id=item.pk, title=title, body=body,
+        ))
+    return entries
+
+
+def index_documents(model, documents, document_items=None):
+    """Replace the entries of saved Invoices or Quotations.
+
+    `document_items` holds one list of items per document, when they are
+    already at hand; otherwise the items are loaded.
+    """
+    documents = list(documents)
+    if not documents:
+        return
+    if document_items is None:
+        documents = list(model.objects.filter(pk__in=[d.pk for d in documents]).prefetch_related('items'))
+        document_items = [document.items.all() for document in documents]
+    remove_documents(model, [document.pk for document in documents])
+    entries = []
+    for document, items in zip(documents, document_items):
+        entries.extend(_entries_for(document, items))
+    SearchEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+def index_document(model, pk):
+    """Refresh the entries of one document, e.g. once its transaction commits"""
+    document = model.objects.filter(pk=pk).first()
+    if document is None:
+        remove_documents(model, [pk])
+    else:
+        index_documents(model, [document])
+
+
+def remove_documents(model, pks):
+    SearchEntry.objects.filter(document_type=model._meta.model_name, document_id__in=pks).delete()
+
+
+def update_item(item):
+    title, body = _item_text(item)
+    SearchEntry.objects.filter(item_id=item.pk).update(title=title, body=body)
+
+
+def remove_item(item_pk):
+    SearchEntry.objects.filter(item_id=item_pk).delete()
+
+
+def _matching(entries, terms):
+    backend = search_backend()
+    if backend == 'postgresql':
+        # Prefix matching, so partial words find their documents as the user types
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        return entries.filter(RawSQL(
+            f"{PG_SEARCH_VECTOR} @@ to_tsquery('simple', %s)", (tsquery,), output_field=BooleanField()
+        ))
+    if backend == 'fts5':
+        return entries.filter(
+            id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', (_fts_match(terms),))
+        )
+    for term in terms:
+        entries = entries.filter(Q(title__icontains=term) | Q(body__icontains=term))
+    return entries
+
+
+def _fts_match(terms):
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def _rank(terms):
+    # Refers to invoices_searchentry by name, so only for the outer query
+    backend = search_backend()
+    if backend == 'postgresql':
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        return RawSQL(
+            f"ts_rank({PG_SEARCH_VECTOR}, to_tsquery('simple', %s))", (tsquery,), output_field=FloatField()
+        )
+    if backend == 'fts5':
+        weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+        return RawSQL(
+            # bm25 is negative, lower meaning a better match
+            f'(SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = invoices_searchentry.id)',
+            (_fts_match(terms),), output_field=FloatField(),
+        )
+    return Value(0.0, output_field=FloatField())
+
+
+def search_entries(query):
+    """SearchEntry queryset matching every term of `query`, annotated with rank (higher is better)"""
+    terms = search_terms(query)
+    if not terms:
+        # e.g. only punctuation; annotated all the same for callers ordering by rank
+        return SearchEntry.objects.none().annotate(rank=Value(0.0, output_field=FloatField()))
+    return _matching(SearchEntry.objects.all(), terms).annotate(rank=_rank(terms))
+
+
+def matching_document_ids(model, query):
+    """Subquery of the ids of documents of `model` with an entry matching `query`"""
+    terms = search_terms(query)
+    if not terms:
+        return SearchEntry.objects.none().values('document_id')
+    entries = SearchEntry.objects.filter(document_type=model._meta.model_name)
+    return _matching(entries, terms).values('document_id')
+
+
+def _document_url(document_type, pk):
+    if document_type == 'invoice':
+        return reverse('view_invoice', args=[pk])
+    return reverse('view_quotation', args=[pk])
+
+
+def search(user, query, limit=SEARCH_LIMIT):
+    """The user's best matching invoices, quotations and items, best first.
+
+    Each hit is a dict with type ('invoice', 'quotation' or 'item'), title,
+    snippet, rank, and the document it belongs to (document_type,
+    document_id, document_title, url).
+    """
+    entries = list(
+        search_entries(query).filter(user=user)
+        .order_by(F('rank').desc(), '-document_id')
+        .values('document_type', 'document_id', 'item_id', 'title', 'body', 'rank')[:limit]
+    )
+    documents = {}
+    for document_type, model in DOCUMENT_MODELS.items():
+        ids = [entry['document_id'] for entry in entries if entry['document_type'] == document_type]
+        if ids:
+            for document in model.objects.filter(user=user, pk__in=ids):
+                documents[document_type, document.pk] = document
+
+    hits = []
+    for entry in entries:
+        document = documents.get((entry['document_type'], entry['document_id']))
+        if document is None:
+            # Entry left behind by a bulk delete
+            continue
+        hits.append({
+            'type': 'item' if entry['item_id'] else entry['document_type'],
+            'title': entry['title'],
+            'snippet': entry['body'][:200],
+            'rank': round(entry['rank'] or 0, 4),
+            'document_type': entry['document_type'],
+            'document_id': document.pk,
+            'document_title': str(document),
+            'url': _document_url(entry['document_type'], document.pk),
+        })
+    return hits
+
+
+def rebuild_search_index(user=None, batch_size=500):
+    """Re-create the entries of every document (of one user); returns the number indexed"""
+    stale = SearchEntry.objects.all() if user is None else SearchEntry.objects.filter(user=user)
+    stale.delete()
+    count = 0
+    for model in DOCUMENT_MODELS.values():
+        documents = model.objects.all() if user is None else model.objects.filter(user=user)
+        ids = list(documents.order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(ids), batch_size):
+            index_documents(model, model.objects.filter(pk__in=ids[start:start + batch_size]))
+            count += len(ids[start:start + batch_size])
+    return count
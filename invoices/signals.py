@@ -0,0 +1,122 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from functools import partial
+
+from .models import Invoice, RenderJob
+from .stats_utils import apply_stats_delta, loaded_stats_bucket, stats_bucket, stats_fields
+from .pagination_utils import bump_list_version
+from .artifact_cache import delete_artifacts
+from . import search_utils, typeahead_utils
+from quotations.models import Item, Quotation
+from quotations.storage import release_item_image
+
+
+@receiver(pre_save, sender=Invoice)
+@receiver(pre_save, sender=Quotation)
+def remember_previous_bucket(sender, instance, raw=False, **kwargs):
+    """Stash the bucket the stored row counted towards before it is overwritten"""
+    instance._stats_previous = None
+    if raw or instance.pk is None:
+        return
+    # Loaded instances carry their stored values; others read the row
+    instance._stats_previous = loaded_stats_bucket(instance)
+    if instance._stats_previous is None:
+        previous = sender.objects.filter(pk=instance.pk).first()
+        if previous is not None:
+            instance._stats_previous = stats_bucket(previous)
+
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_save, sender=Quotation)
+def update_stats_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    bump_list_version(sender, instance.user_id)
+    key, amount = stats_bucket(instance)
+    previous = getattr(instance, '_stats_previous', None)
+    # The saved values are what the next save of this instance changes
+    loaded = getattr(instance, '_loaded_values', {})
+    instance._loaded_values = {**loaded, **{field: getattr(instance, field) for field in stats_fields(instance)}}
+    if previous is None:
+        apply_stats_delta(key, 1, amount)
+        return
+    # Exports embed the document fields (e.g. status); drop stale renders
+    delete_artifacts(instance)
+    previous_key, previous_amount = previous
+    if previous_key == key:
+        apply_stats_delta(key, 0, amount - previous_amount)
+    else:
+        apply_stats_delta(previous_key, -1, -previous_amount)
+        apply_stats_delta(key, 1, amount)
+
+
+@receiver(post_delete, sender=Invoice)
+@receiver(post_delete, sender=Quotation)
+def update_stats_on_delete(sender, instance, **kwargs):
+    bump_list_version(sender, instance.user_id)
+    delete_artifacts(instance)
+    key, amount = stats_bucket(instance)
+    apply_stats_delta(key, -1, -amount)
+
+
+
+@receiver(post_delete, sender=Invoice)
+@receiver(post_delete, sender=Quotation)
+def invalidate_typeahead_on_delete(sender, instance, **kwargs):
+    # New documents are added to the indexes in place; removals need a rebuild
+    transaction.on_commit(partial(typeahead_utils.invalidate, instance.user_id))
+
+
+@receiver(post_delete, sender=Item)
+def release_image_on_delete(sender, instance, **kwargs):
+    # Images are shared between items; the file goes with the last reference
+    if instance.image:
+        release_item_image(instance.image.storage, instance.image.name)
+
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_save, sender=Quotation)
+def index_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # Items are linked after the document is saved; index once both are in
+    transaction.on_commit(partial(search_utils.index_document, sender, instance.pk))
+
+
+@receiver(m2m_changed, sender=Invoice.items.through)
+@receiver(m2m_changed, sender=Quotation.items.through)
+def index_on_items_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # instance is the Item; pk_set holds the documents
+        document_model = Invoice if sender is Invoice.items.through else Quotation
+        for pk in pk_set or ():
+            transaction.on_commit(partial(search_utils.index_document, document_model, pk))
+    else:
+        transaction.on_commit(partial(search_utils.index_document, type(instance), instance.pk))
+
+
+@receiver(post_delete, sender=Invoice)
+@receiver(post_delete, sender=Quotation)
+def unindex_on_delete(sender, instance, **kwargs):
+    search_utils.remove_documents(sender, [instance.pk])
+
+
+@receiver(post_save, sender=Item)
+def index_item_on_save(sender, instance, created, raw=False, **kwargs):
+    # New items get their entries when linked to a document
+    if not (raw or created):
+        search_utils.update_item(instance)
+
+
+@receiver(post_delete, sender=Item)
+def unindex_item_on_delete(sender, instance, **kwargs):
+    search_utils.remove_item(instance.pk)
+
+
+@receiver(post_delete, sender=RenderJob)
+def delete_job_artifact(sender, instance, **kwargs):
+    if instance.artifact:
+        transaction.on_commit(partial(instance.artifact.delete, save=False))
@@ -0,0 +1,132 @@
+from django.db import transaction
+from django.db.models import Count, DateField, F, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+from decimal import Decimal
+from functools import partial
+
+from .models import Invoice, UserInvoiceStats
+from quotations.models import Quotation
+
+
+def month_start(value):
+    """First day of the (local) month a datetime falls in"""
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value.date().replace(day=1)
+
+
+def stats_fields(instance):
+    """The fields stats_bucket() reads from an Invoice or Quotation"""
+    fields = ('user_id', 'date_created', 'currency', 'total')
+    return fields + ('status',) if isinstance(instance, Invoice) else fields
+
+
+def stats_bucket(instance, values=None):
+    """The UserInvoiceStats key and amount an Invoice or Quotation contributes.
+    
+    `values` maps stats_fields() to the values to use instead of the
+    instance's, e.g. those it was loaded with.
+    """
+    value = values.__getitem__ if values is not None else partial(getattr, instance)
+    if isinstance(instance, Invoice):
+        document_type, status = UserInvoiceStats.INVOICE, value('status') or ''
+    else:
+        document_type, status = UserInvoiceStats.QUOTATION, ''
+    key = {
+        'user_id': value('user_id'),
+        'document_type': document_type,
+        'month': month_start(value('date_created')),
+        'currency': value('currency') or '',
+        'status': status,
+    }
+    return key, Decimal(value('total') or 0)
+
+
+def loaded_stats_bucket(instance):
+    """The bucket of the values `instance` was loaded with; None unless all were loaded"""
+    loaded = getattr(instance, '_loaded_values', None)
+    if loaded is None or any(field not in loaded for field in stats_fields(instance)):
+        return None
+    return stats_bucket(instance, loaded)
+
+
+def apply_stats_delta(key, count, amount):
+    """Add count/amount to a stats bucket, creating it for positive deltas"""
+    if not count and not amount:
+        return
+    updated = UserInvoiceStats.objects.filter(**key).update(
+        count=F('count') + count,
+        total_amount=F('total_amount') + amount,
+    )
+    if updated or count <= 0:
+        # Removals never create rows; a missing bucket means it was already
+        # deleted, e.g. by a cascading user delete.
+        return
+    _, created = UserInvoiceStats.objects.get_or_create(
+        **key, defaults={'count': count, 'total_amount': amount}
+    )
+    if not created:
+        UserInvoiceStats.objects.filter(**key).update(
+            count=F('count') + count,
+            total_amount=F('total_amount') + amount,
+        )
+
+
+def _aggregate_rows(queryset, document_type, with_status):
+    fields = ['user_id', 'month', 'currency'] + (['status'] if with_status else [])
+    rows = (
+        queryset.annotate(month=TruncMonth('date_created', output_field=DateField()))
+        .values(*fields)
+        .annotate(doc_count=Count('id'), amount=Sum('total'))
+        .order_by()
+    )
+    for row in rows:
+        yield UserInvoiceStats(
+            user_id=row['user_id'],
+            document_type=document_type,
+            month=row['month'],
+            currency=row['currency'] or '',
+            status=(row['status'] or '') if with_status else '',
+            count=row['doc_count'],
+            total_amount=row['amount'] or Decimal('0.00'),
+        )
+
+
+def move_invoice_status(queryset, old_status, new_status):
+    """Move the invoices of `queryset` between status buckets, before a bulk UPDATE of their status.
+
+    Aggregates in the database, so the cost does not grow with the number
+    of invoices, only with the number of buckets they fall in.
+    """
+    for row in _aggregate_rows(queryset, UserInvoiceStats.INVOICE, with_status=False):
+        key = {
+            'user_id': row.user_id,
+            'document_type': row.document_type,
+            'month': row.month,
+            'currency': row.currency,
+        }
+        apply_stats_delta({**key, 'status': old_status}, -row.count, -row.total_amount)
+        apply_stats_delta({**key, 'status': new_status}, row.count, row.total_amount)
+
+
+def rebuild_stats(user=None, batch_size=1000):
+    """Recompute UserInvoiceStats from the Invoice and Quotation tables.
+    
+    Rebuilds every user's rows, or only `user`'s when given. Returns the
+    number of rows written.
+    """
+    invoices = Invoice.objects.all()
+    quotations = Quotation.objects.all()
+    stats = UserInvoiceStats.objects.all()
+    if user is not None:
+        invoices = invoices.filter(user=user)
+        quotations = quotations.filter(user=user)
+        stats = stats.filter(user=user)
+    
+    with transaction.atomic():
+        stats.delete()
+        rows = list(_aggregate_rows(invoices, UserInvoiceStats.INVOICE, with_status=True))
+        rows += _aggregate_rows(quotations, UserInvoiceStats.QUOTATION, with_status=False)
+        UserInvoiceStats.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
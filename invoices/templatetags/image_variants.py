@@ -0,0 +1,11 @@
+from django import template
+
+from invoices.image_utils import image_variant_url
+
+register = template.Library()
+
+
+@register.filter
+def variant_url(image, variant='screen'):
+    """URL of a resized item image, e.g. {{ item.image|variant_url:'print' }}"""
+    return image_variant_url(image, variant)
@@ -1,3 +1,1165 @@
-from django.test import TestCase
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+import csv
+import os
+import shutil
+import tempfile
+import zipfile
 
-# Create your tests here.
+from openpyxl import Workbook, load_workbook
+from PIL import Image
+from pypdf import PdfReader
+
+from quotations.models import Item, Quotation
+from users.views import get_monthly_revenue
+from . import export_utils, import_utils, render_queue, search_utils, typeahead_utils, utils
+from .bulk_export import render_exports
+from .email_outbox import MAX_ATTEMPTS, STALE_AFTER, claim_batch, deliver_batch, requeue_stale_emails
+from .email_utils import build_invoice_email
+from .export_utils import export_fingerprint, get_document_export
+from .image_utils import VARIANT_DIR, image_variant
+from .import_utils import import_invoices
+from .item_utils import add_items
+from .ledger_utils import ledger_rows
+from .models import Invoice, OutboundEmail, ReminderRule, RenderJob, UserInvoiceStats
+from .pagination_utils import LIST_ORDERING, list_count_cache_key
+from .render_queue import claim_next_job, open_job_artifact, process_job, requeue_stale_jobs
+from .reportlab_pdf import render_document_pdf
+from .stats_utils import rebuild_stats
+from .typeahead_utils import PrefixIndex, get_index, suggest
+from .utils import filter_documents
+
+
+class CountingBackend(EmailBackend):
+    opened = 0
+
+    def open(self):
+        CountingBackend.opened += 1
+        return super().open()
+
+
+class FailingBackend(EmailBackend):
+    def send_messages(self, messages):
+        raise ConnectionError('SMTP unavailable')
+
+
+class TempArtifactCacheMixin:
+    """Keep rendered exports out of the project's artifact cache and media"""
+
+    def setUp(self):
+        super().setUp()
+        cache_dir, media_root = tempfile.mkdtemp(), tempfile.mkdtemp()
+        for directory in (cache_dir, media_root):
+            self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        override = override_settings(ARTIFACT_CACHE_DIR=cache_dir, MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+
+def make_user(username, **fields):
+    """A user with the password 'pw' and an address at example.com"""
+    fields.setdefault('email', f'{username}@example.com')
+    return get_user_model().objects.create_user(username=username, password='pw', **fields)
+
+
+def make_invoice(user, **fields):
+    """An invoice to Harbour Marine for 100.00 plus 7.50 VAT, due today, unless `fields` say otherwise"""
+    fields = {
+        'client_name': 'Harbour Marine', 'subtotal': Decimal('100.00'), 'vat_amount': Decimal('7.50'),
+        'total': Decimal('107.50'), 'due_date': timezone.localdate(), **fields,
+    }
+    return Invoice.objects.create(user=user, **fields)
+
+
+class UserInvoiceStatsTests(TempArtifactCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('stats')
+
+    def make_invoice(self, total='107.50', **fields):
+        return make_invoice(
+            self.user, total=Decimal(total), due_date=timezone.localdate() + timedelta(days=30), **fields
+        )
+
+    def stats(self):
+        return sorted(
+            UserInvoiceStats.objects.filter(count__gt=0)
+            .values_list('document_type', 'status', 'month', 'count', 'total_amount')
+        )
+
+    def assertMatchesRebuild(self):
+        incremental = self.stats()
+        rebuild_stats(user=self.user)
+        self.assertEqual(incremental, self.stats())
+
+    def test_saving_a_loaded_invoice_does_not_read_it_again(self):
+        invoice = Invoice.objects.get(pk=self.make_invoice().pk)
+        invoice.status = 'Paid'
+        with CaptureQueriesContext(connection) as queries:
+            invoice.save()
+        self.assertFalse([
+            query['sql'] for query in queries
+            if query['sql'].startswith('SELECT') and '"invoices_invoice"' in query['sql']
+        ])
+        self.assertEqual(UserInvoiceStats.objects.invoice_status_counts(), {'Paid': 1, 'Pending': 0})
+
+    def test_repeated_saves_keep_the_rollup_exact(self):
+        invoice = self.make_invoice()
+        other = self.make_invoice(total='50.00', date_created=timezone.now() - timedelta(days=70))
+        invoice.status = 'Paid'
+        invoice.save()
+        invoice.total = Decimal('200.00')
+        invoice.save()
+        self.assertMatchesRebuild()
+
+        # A bulk UPDATE behind the instance's back, then a save after a refresh
+        Invoice.objects.filter(pk=other.pk).update(status='Overdue')
+        rebuild_stats(user=self.user)
+        other.refresh_from_db()
+        other.status = 'Paid'
+        other.save()
+        self.assertMatchesRebuild()
+
+        deferred = Invoice.objects.only('pk', 'notes').get(pk=invoice.pk)
+        deferred.notes = 'Paid by transfer'
+        deferred.save()
+        self.assertMatchesRebuild()
+
+    def test_monthly_revenue_from_the_rollup_matches_the_invoices(self):
+        self.make_invoice()
+        self.make_invoice(total='50.00', date_created=timezone.now() - timedelta(days=70))
+        self.make_invoice(total='900.00', date_created=timezone.now() - timedelta(days=400))
+        invoices = Invoice.objects.filter(user=self.user)
+        stats = UserInvoiceStats.objects.filter(user=self.user)
+        for months in (6, 12, 24):
+            revenue = get_monthly_revenue(stats, months)
+            self.assertEqual(len(revenue), months)
+            self.assertEqual(revenue, get_monthly_revenue(invoices, months))
+        self.assertEqual(sum(month['amount'] for month in get_monthly_revenue(stats, 24)), 1057.5)
+
+
+class ListCountCacheTests(TestCase):
+    def setUp(self):
+        self.user = make_user('lister')
+        self.client.force_login(self.user)
+
+    def count_key(self):
+        # The key invoice_list uses without filters
+        params = dict.fromkeys(('q', 'status', 'start', 'end', 'min', 'max'), '')
+        return list_count_cache_key(Invoice, self.user.pk, params)
+
+    def test_counts_and_invalidations_reach_other_workers(self):
+        # Per process memory would leave the other workers' counts stale
+        self.assertNotIsInstance(caches['default'], LocMemCache)
+        # A second backend instance stands in for another gunicorn worker
+        other_worker = caches.create_connection('default')
+        make_invoice(self.user)
+        self.client.get(reverse('invoice_list'))
+        self.assertEqual(other_worker.get(self.count_key()), 1)
+
+        make_invoice(self.user)
+        self.assertIsNone(other_worker.get(self.count_key()))
+        response = self.client.get(reverse('invoice_list'))
+        self.assertEqual(response.context['total_invoices'], 2)
+
+
+class IndexUsageTests(TestCase):
+    """The list, status/due and number lookup queries are served by the composite indexes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        users = [
+            make_user(f'owner{i}')
+            for i in range(5)
+        ]
+        cls.user = users[2]
+        now, today = timezone.now(), timezone.localdate()
+        invoices, quotations = [], []
+        # bulk_create skips the signals, which these tests do not need
+        for user in users:
+            for i in range(1000):
+                created = now - timedelta(hours=i)
+                invoices.append(Invoice(
+                    user=user, invoice_number=f'INV-{user.pk}-{i}', client_name=f'Client {i % 50}',
+                    subtotal=Decimal('100.00'), vat_amount=Decimal('7.50'), total=Decimal('107.50'),
+                    date_created=created, due_date=today + timedelta(days=i % 60 - 30),
+                    status=('Pending', 'Paid', 'Overdue')[i % 3],
+                ))
+                quotations.append(Quotation(
+                    user=user, quotation_number=f'QUO-{user.pk}-{i}', client_name=f'Client {i % 50}',
+                    subtotal=Decimal('100.00'), vat_amount=Decimal('7.50'), total=Decimal('107.50'),
+                    date_created=created,
+                ))
+        Invoice.objects.bulk_create(invoices)
+        Quotation.objects.bulk_create(quotations)
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+
+    def test_invoice_queries(self):
+        invoices = Invoice.objects.filter(user=self.user)
+        self.assertUsesIndex(invoices.order_by(*LIST_ORDERING)[:25], 'invoice_user_created_idx')
+        self.assertUsesIndex(invoices.overdue(), 'invoice_user_status_due_idx')
+        self.assertUsesIndex(invoices.filter(status='Paid'), 'invoice_user_status_due_idx')
+        self.assertUsesIndex(invoices.filter(invoice_number=f'INV-{self.user.pk}-5'), 'invoice_user_number_idx')
+
+    def test_quotation_queries(self):
+        quotations = Quotation.objects.filter(user=self.user)
+        self.assertUsesIndex(quotations.order_by(*LIST_ORDERING)[:25], 'quotation_user_created_idx')
+        self.assertUsesIndex(
+            quotations.filter(quotation_number=f'QUO-{self.user.pk}-5'), 'quotation_user_number_idx'
+        )
+
+
+class InvoiceQueryCountTests(TempArtifactCacheMixin, TestCase):
+    """Pages and exports load a document and its items in a fixed number of queries"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('counter')
+        self.client.force_login(self.user)
+        self.invoice = make_invoice(self.user)
+
+    def add_items(self, count):
+        start = self.invoice.items.count()
+        self.invoice.items.add(*[
+            Item.objects.create(name=f'Line {i}', price=Decimal('10.00'), quantity=2, unit='PCS', lead_time='1 WEEK')
+            for i in range(start, start + count)
+        ])
+
+    def test_query_counts_do_not_grow_with_items(self):
+        for count in (1, 20):
+            self.add_items(count)
+            for name in ('invoice_detail', 'view_invoice', 'invoice_pdf', 'invoice_docx'):
+                with self.subTest(items=self.invoice.items.count(), view=name):
+                    # session, user, then the invoice with its owner and its items
+                    with self.assertNumQueries(4):
+                        response = self.client.get(reverse(name, args=[self.invoice.pk]))
+                    self.assertEqual(response.status_code, 200)
+
+    def test_list_query_count_does_not_grow_with_rows(self):
+        self.client.get(reverse('invoice_list'))
+        for _ in range(2):
+            for _ in range(10):
+                make_invoice(self.user, subtotal=Decimal('1.00'), vat_amount=Decimal('0.00'), total=Decimal('1.00'))
+            self.client.get(reverse('invoice_list'))
+            # session, user, list version, cached count, page rows, paid and overdue counts
+            with self.assertNumQueries(7):
+                self.client.get(reverse('invoice_list'))
+
+
+class RenderQueueTests(TempArtifactCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('renderer')
+        self.invoice = make_invoice(self.user)
+
+    def enqueue(self, **fields):
+        return RenderJob.objects.create(
+            user=self.user, document_type='invoice', document_id=self.invoice.pk, format='docx', **fields
+        )
+
+    def make_due(self, job):
+        RenderJob.objects.filter(pk=job.pk).update(next_attempt=timezone.now())
+
+    def test_claims_due_jobs_oldest_first_and_once(self):
+        later = self.enqueue(next_attempt=timezone.now() + timedelta(minutes=5))
+        first = self.enqueue()
+        second = self.enqueue()
+        self.assertEqual(claim_next_job().pk, first.pk)
+        self.assertEqual(claim_next_job().pk, second.pk)
+        # Backing off, and the claimed ones are Running
+        self.assertIsNone(claim_next_job())
+        self.make_due(later)
+        claimed = claim_next_job()
+        self.assertEqual((claimed.pk, claimed.status, claimed.attempts), (later.pk, RenderJob.RUNNING, 1))
+
+        job = process_job(claimed)
+        self.assertEqual(job.status, RenderJob.DONE)
+        with open_job_artifact(job) as artifact:
+            self.assertTrue(artifact.read().startswith(b'PK'))
+
+    def test_failures_back_off_then_give_up(self):
+        job = self.enqueue()
+        with mock.patch('invoices.render_queue.get_document_export', side_effect=RuntimeError('renderer crashed')), \
+                self.assertLogs('invoices.render_queue', 'ERROR'):
+            for attempt in range(1, render_queue.MAX_ATTEMPTS + 1):
+                self.make_due(job)
+                job = process_job(claim_next_job())
+                self.assertEqual(job.attempts, attempt)
+                if attempt < render_queue.MAX_ATTEMPTS:
+                    self.assertEqual(job.status, RenderJob.QUEUED)
+                    self.assertGreater(job.next_attempt, timezone.now() + render_queue.retry_delay(attempt) - timedelta(seconds=5))
+                    self.assertIsNone(claim_next_job())
+        self.assertEqual((job.status, job.error), (RenderJob.FAILED, 'renderer crashed'))
+        self.assertIsNotNone(job.date_finished)
+
+    def test_download_reads_the_worker_artifact_from_storage(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('prepare_invoice_export', args=[self.invoice.pk, 'pdf']))
+        self.assertEqual((response.status_code, response.json()['status']), (202, RenderJob.QUEUED))
+        job = process_job(claim_next_job())
+        self.assertTrue(job.artifact.name.startswith('render_jobs/'))
+
+        # The web process has its own disk: nothing in its artifact cache
+        web_cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, web_cache_dir, ignore_errors=True)
+        with self.settings(ARTIFACT_CACHE_DIR=web_cache_dir):
+            response = self.client.get(reverse('render_job_download', args=[job.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+    def test_changed_document_is_rendered_again(self):
+        self.client.force_login(self.user)
+        self.enqueue()
+        job = process_job(claim_next_job())
+        name = job.artifact.name
+        self.invoice.client_name = 'Harbour Marine Ltd'
+        self.invoice.save()
+
+        response = self.client.get(reverse('render_job_download', args=[job.pk]))
+        self.assertEqual((response.status_code, response.json()['status']), (202, RenderJob.QUEUED))
+        self.assertFalse(job.artifact.storage.exists(name))
+        job = process_job(claim_next_job())
+        self.assertEqual(self.client.get(reverse('render_job_download', args=[job.pk])).status_code, 200)
+
+        name = job.artifact.name
+        with self.captureOnCommitCallbacks(execute=True):
+            job.delete()
+        self.assertFalse(job.artifact.storage.exists(name))
+
+    def test_stale_jobs_are_requeued_until_their_attempts_run_out(self):
+        started = timezone.now() - timedelta(minutes=30)
+        retried = self.enqueue(status=RenderJob.RUNNING, attempts=1, date_started=started)
+        exhausted = self.enqueue(status=RenderJob.RUNNING, attempts=render_queue.MAX_ATTEMPTS, date_started=started)
+        running = self.enqueue(status=RenderJob.RUNNING, attempts=1, date_started=timezone.now())
+
+        self.assertEqual(requeue_stale_jobs(timedelta(minutes=10)), 1)
+        statuses = dict(RenderJob.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[retried.pk], RenderJob.QUEUED)
+        self.assertEqual(statuses[exhausted.pk], RenderJob.FAILED)
+        self.assertEqual(statuses[running.pk], RenderJob.RUNNING)
+        self.assertEqual(claim_next_job().pk, retried.pk)
+
+
+@override_settings(BULK_EXPORT_WORKERS=1)
+class BulkExportTests(TempArtifactCacheMixin, TestCase):
+    # Spawned pool workers could not see the test database; render in process
+
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('zipper')
+        self.client.force_login(self.user)
+
+    def make_invoice(self, number):
+        invoice = make_invoice(
+            self.user, invoice_number=number, subtotal=Decimal('20.00'), vat_amount=Decimal('1.50'),
+            total=Decimal('21.50'),
+        )
+        invoice.items.add(Item.objects.create(name='Hose', price=Decimal('10.00'), quantity=2))
+        return invoice
+
+    def download(self, **params):
+        response = self.client.get(reverse('export_invoices_zip'), params)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertTrue(response.streaming)
+        return zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+
+    def test_streams_every_invoice_and_lists_failures(self):
+        first = self.make_invoice('INV-001')
+        twin = self.make_invoice('INV-001')
+        broken = self.make_invoice('INV-002')
+        real_export = export_utils.get_document_export
+
+        def export(document, fmt):
+            if document.pk == broken.pk:
+                raise RuntimeError('renderer crashed')
+            return real_export(document, fmt)
+
+        with mock.patch('invoices.export_utils.get_document_export', side_effect=export), \
+                self.assertLogs('invoices.bulk_export', 'ERROR'):
+            archive = self.download(format='docx')
+        self.assertEqual(
+            sorted(archive.namelist()),
+            # Newest first, so the older of two equal numbers gets its id appended
+            [f'Invoice_INV-001-{first.pk}.docx', 'Invoice_INV-001.docx', 'errors.txt'],
+        )
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(
+            archive.read('errors.txt').decode(),
+            f'Could not export:\nInvoice_INV-002.docx (id {broken.pk})\n',
+        )
+        self.assertEqual(
+            # The cached export, not a second render
+            archive.read('Invoice_INV-001.docx'), get_document_export(Invoice.objects.get(pk=twin.pk), 'docx')[1]
+        )
+
+    def test_renders_in_process_when_the_pool_breaks(self):
+        pks = [self.make_invoice(f'INV-00{i}').pk for i in range(1, 6)]
+        future = mock.Mock()
+        future.result.side_effect = BrokenProcessPool('worker died')
+        pool = mock.Mock()
+        pool.submit.return_value = future
+        with mock.patch('invoices.bulk_export._new_pool', return_value=pool), \
+                self.assertLogs('invoices.bulk_export', 'ERROR'):
+            results = list(render_exports(pks, 'docx', workers=2))
+        self.assertEqual([pk for pk, *_ in results], pks)
+        self.assertTrue(all(data for *_, data in results))
+        pool.shutdown.assert_called_once()
+
+    def test_command_sizes_the_pool_from_workers(self):
+        pks = [self.make_invoice(f'INV-00{i}').pk for i in range(1, 4)]
+
+        def submit(fn, *args):
+            # Run in this process, which sees the test database
+            future = Future()
+            future.set_result(fn(*args))
+            return future
+
+        pool = mock.Mock()
+        pool.submit.side_effect = submit
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir, ignore_errors=True)
+        path = os.path.join(output_dir, 'invoices.zip')
+        out = StringIO()
+        with mock.patch('invoices.bulk_export.ProcessPoolExecutor', return_value=pool) as executor:
+            call_command('export_invoices_zip', path, '--format', 'docx', '--workers', '3', stdout=out)
+        self.assertEqual(executor.call_args.kwargs['max_workers'], 3)
+        self.assertEqual(pool.submit.call_count, len(pks))
+        # Not the shared pool: shut down with the export
+        pool.shutdown.assert_called_once()
+        self.assertIn('with 3 worker(s)', out.getvalue())
+        with zipfile.ZipFile(path) as archive:
+            self.assertEqual(len(archive.namelist()), len(pks))
+
+    def test_follows_the_list_filters(self):
+        self.make_invoice('INV-001')
+        paid = self.make_invoice('INV-002')
+        paid.status = 'Paid'
+        paid.save()
+        archive = self.download(format='docx', status='Paid')
+        self.assertEqual(archive.namelist(), ['Invoice_INV-002.docx'])
+
+
+class LedgerExportTests(TestCase):
+    def setUp(self):
+        self.user = make_user('ledger')
+        self.client.force_login(self.user)
+        now = timezone.now()
+        self.invoices = [
+            make_invoice(
+                self.user, invoice_number=f'INV-{i}', client_name=f'Client {i}', currency='USD',
+                subtotal=Decimal('100.00') * i, vat_amount=Decimal('7.50') * i, total=Decimal('107.50') * i,
+                date_created=now - timedelta(days=i), status='Paid' if i % 2 else 'Pending',
+            )
+            for i in range(1, 6)
+        ]
+        other = make_user('other')
+        make_invoice(
+            other, invoice_number='INV-OTHER', client_name='Not yours', subtotal=Decimal('1.00'),
+            vat_amount=Decimal('0.00'), total=Decimal('1.00'),
+        )
+
+    def csv_rows(self, **params):
+        response = self.client.get(reverse('invoice_ledger', args=['csv']), params)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('attachment; filename="invoices_', response['Content-Disposition'])
+        return list(csv.reader(StringIO(b''.join(response.streaming_content).decode())))
+
+    def test_csv_streams_the_filtered_list_newest_first(self):
+        rows = self.csv_rows()
+        self.assertEqual(rows[0][:3], ['Invoice Number', 'Client', 'Currency'])
+        self.assertEqual([row[0] for row in rows[1:]], ['INV-1', 'INV-2', 'INV-3', 'INV-4', 'INV-5'])
+        created = timezone.localtime(self.invoices[0].date_created).replace(tzinfo=None)
+        self.assertEqual(rows[1][6:10], ['107.50', 'Paid', str(created), str(timezone.localdate())])
+        self.assertEqual(rows[1][10], 'ledger@example.com')
+
+        self.assertEqual([row[0] for row in self.csv_rows(status='Paid')[1:]], ['INV-1', 'INV-3', 'INV-5'])
+
+    def test_xlsx_matches_the_csv(self):
+        response = self.client.get(reverse('invoice_ledger', args=['xlsx']))
+        self.assertEqual(
+            response['Content-Type'], 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+        sheet = load_workbook(BytesIO(b''.join(response.streaming_content)), read_only=True).active
+        rows = [list(row) for row in sheet.iter_rows(values_only=True)]
+        self.assertEqual(rows[0], self.csv_rows()[0])
+        self.assertEqual([row[0] for row in rows[1:]], ['INV-1', 'INV-2', 'INV-3', 'INV-4', 'INV-5'])
+        self.assertEqual(rows[1][6], 107.5)
+        # Excel keeps milliseconds
+        created = timezone.localtime(self.invoices[0].date_created).replace(tzinfo=None)
+        self.assertAlmostEqual(rows[1][8], created, delta=timedelta(milliseconds=1))
+
+    def test_rows_are_read_in_chunks(self):
+        queryset = Invoice.objects.filter(user=self.user)
+        for chunk_size in (1, 2, 5, 100):
+            with self.subTest(chunk_size=chunk_size):
+                rows = list(ledger_rows(queryset, chunk_size=chunk_size))
+                self.assertEqual([row[0] for row in rows[1:]], ['INV-1', 'INV-2', 'INV-3', 'INV-4', 'INV-5'])
+
+    def test_unknown_format_is_refused(self):
+        response = self.client.get(reverse('invoice_ledger', args=['pdf']))
+        self.assertRedirects(response, reverse('invoice_list'), fetch_redirect_response=False)
+
+    def test_quotation_ledger(self):
+        Quotation.objects.create(
+            user=self.user, quotation_number='QTN-1', client_name='Harbour Marine', vessel_name='MV Tide',
+            subtotal=Decimal('10.00'), vat_amount=Decimal('0.75'), total=Decimal('10.75'),
+        )
+        response = self.client.get(reverse('quotation_ledger', args=['csv']))
+        rows = list(csv.reader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0][:4], ['Quotation Number', 'Client', 'RFQ Number', 'Vessel'])
+        self.assertEqual(rows[1][:4], ['QTN-1', 'Harbour Marine', '', 'MV Tide'])
+
+
+class SearchBehaviourMixin:
+    """Search behaviour every backend must share; subclasses pick the backend"""
+    backend = None
+    ranked = True
+
+    def setUp(self):
+        super().setUp()
+        self.assertEqual(search_utils.search_backend(), self.backend)
+        self.user = make_user('searcher')
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.invoice = make_invoice(self.user, invoice_number='INV-2026-0042', notes='Paid by Coastline Ltd')
+            self.invoice.items.add(Item.objects.create(
+                name='Stainless shackle', price=Decimal('12.50'), quantity=4, unit='PCS', lead_time='2 WEEKS',
+            ))
+            self.other_invoice = make_invoice(self.user, invoice_number='INV-2026-0043', client_name='Coastline Ltd')
+            self.quotation = Quotation.objects.create(
+                user=self.user, quotation_number='QTN-9', client_name='Delta Shipping', vessel_name='MV Northern Star',
+                subtotal=Decimal('10.00'), vat_amount=Decimal('0.75'), total=Decimal('10.75'),
+            )
+            someone_else = make_user('nosy')
+            make_invoice(someone_else, invoice_number='INV-2026-0042')
+
+    def hits(self, query):
+        return [(hit['type'], hit['document_id']) for hit in search_utils.search(self.user, query)]
+
+    def test_finds_documents_and_items_by_word_prefix(self):
+        self.assertEqual(self.hits('harb'), [('invoice', self.invoice.pk)])
+        self.assertEqual(self.hits('0042'), [('invoice', self.invoice.pk)])
+        self.assertEqual(self.hits('northern'), [('quotation', self.quotation.pk)])
+        self.assertEqual(self.hits('shackle 2 weeks'), [('item', self.invoice.pk)])
+        self.assertEqual(self.hits('harbour delta'), [])
+        self.assertEqual(self.hits('!!!'), [])
+
+    def test_titles_rank_above_bodies(self):
+        hits = self.hits('coastline')
+        self.assertCountEqual(hits, [('invoice', self.other_invoice.pk), ('invoice', self.invoice.pk)])
+        if self.ranked:
+            self.assertEqual(hits[0], ('invoice', self.other_invoice.pk))
+
+    def test_follows_edits_and_deletes(self):
+        item = self.invoice.items.get()
+        item.name = 'Galvanised anchor chain'
+        item.save()
+        self.assertEqual(self.hits('shackle'), [])
+        self.assertEqual(self.hits('anchor'), [('item', self.invoice.pk)])
+        self.quotation.delete()
+        self.assertEqual(self.hits('northern'), [])
+
+    def test_list_filter_and_json_view(self):
+        invoices = filter_documents(Invoice.objects.filter(user=self.user), {'q': 'shackle'})
+        self.assertEqual(list(invoices), [self.invoice])
+        response = self.client.get(reverse('search'), {'q': 'harb', 'format': 'json'})
+        self.assertEqual(
+            [(hit['type'], hit['url']) for hit in response.json()['results']],
+            [('invoice', reverse('view_invoice', args=[self.invoice.pk]))],
+        )
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite only')
+class FTS5SearchTests(SearchBehaviourMixin, TestCase):
+    backend = 'fts5'
+
+
+@skipUnless(connection.vendor == 'postgresql', 'PostgreSQL only')
+class PostgreSQLSearchTests(SearchBehaviourMixin, TestCase):
+    backend = 'postgresql'
+
+
+class BasicSearchTests(SearchBehaviourMixin, TestCase):
+    backend = 'basic'
+    ranked = False
+
+    def setUp(self):
+        patcher = mock.patch('invoices.search_utils.search_backend', return_value='basic')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super().setUp()
+
+
+IMPORT_HEADER = ['Invoice Number', 'Client Name', 'Item Name', 'Item Price', 'Item Quantity', 'VAT Percentage']
+
+
+class ImportTests(TestCase):
+    def setUp(self):
+        self.user = make_user('importer')
+
+    def csv_file(self, rows):
+        output = StringIO()
+        csv.writer(output).writerows([IMPORT_HEADER] + rows)
+        return BytesIO(output.getvalue().encode())
+
+    def xlsx_file(self, rows):
+        workbook = Workbook()
+        for row in [IMPORT_HEADER] + rows:
+            workbook.active.append(row)
+        output = BytesIO()
+        workbook.save(output)
+        output.seek(0)
+        return output
+
+    def import_rows(self, rows, fmt='csv', **kwargs):
+        fh = self.xlsx_file(rows) if fmt == 'xlsx' else self.csv_file(rows)
+        return import_invoices(self.user, fh, fmt, **kwargs)
+
+    def test_csv_groups_consecutive_rows_into_invoices(self):
+        report = self.import_rows([
+            ['INV-1', 'Acme', 'Bolt', '1,000.50', '2', '10'],
+            ['INV-1', 'Acme', 'Nut', '10', '3.7 PCS', '10'],
+            ['INV-2', 'Globex', 'Pump', '250', '1', ''],
+        ])
+        self.assertEqual((report.rows, report.invoices, report.items, report.error_count), (3, 2, 3, 0))
+        invoice = Invoice.objects.get(invoice_number='INV-1')
+        self.assertEqual(invoice.user, self.user)
+        self.assertEqual(sorted(invoice.items.values_list('name', 'quantity')), [('Bolt', 2), ('Nut', 3)])
+        self.assertEqual(invoice.subtotal, Decimal('2031.00'))
+        self.assertEqual(invoice.vat_amount, Decimal('203.10'))
+        self.assertEqual(invoice.total, Decimal('2234.10'))
+        self.assertEqual(Invoice.objects.get(invoice_number='INV-2').vat_percentage, Decimal('7.5'))
+
+    def test_xlsx_reads_numeric_cells(self):
+        report = self.import_rows([
+            ['INV-1', 'Acme', 'Bolt', 12.5, 4, 7.5],
+            ['INV-2', 'Globex', 'Pump', 250, 1, 0],
+        ], fmt='xlsx')
+        self.assertEqual((report.invoices, report.items, report.error_count), (2, 2, 0))
+        self.assertEqual(Invoice.objects.get(invoice_number='INV-1').subtotal, Decimal('50.00'))
+        self.assertEqual(Invoice.objects.get(invoice_number='INV-2').total, Decimal('250.00'))
+
+    def test_bad_rows_skip_their_invoice_only(self):
+        report = self.import_rows([
+            ['INV-NAN', 'Acme', 'Bolt', 'NaN', '1', ''],
+            ['INV-INF', 'Acme', 'Bolt', '-Infinity', '1', ''],
+            ['INV-VATNAN', 'Acme', 'Bolt', '10', '1', 'nan'],
+            ['INV-VAT', 'Acme', 'Bolt', '10', '1', '150'],
+            ['INV-PRICE', 'Acme', 'Bolt', '123456789', '1', ''],
+            ['INV-QTY', 'Acme', 'Bolt', '10', '9' * 400, ''],
+            ['INV-TOTAL', 'Acme', 'Bolt', '90000000', '1', '20'],
+            ['INV-PART', 'Acme', 'Bolt', '10', '1', ''],
+            ['INV-PART', 'Acme', 'Nut', 'ten', '1', ''],
+            ['INV-OK', 'Acme', 'Bolt', '10', '1', ''],
+        ], fmt='xlsx')
+        self.assertEqual(report.error_count, 8)
+        messages = dict(report.errors)
+        self.assertEqual(messages[2], 'Item price is not a number: NaN')
+        self.assertEqual(messages[3], 'Item price is not a number: -Infinity')
+        self.assertEqual(messages[4], 'VAT percentage is not a number: nan')
+        self.assertEqual(messages[5], 'VAT percentage must be between 0 and 100: 150')
+        self.assertEqual(messages[6], 'Item price is too large: 123456789')
+        self.assertIn('Item quantity is too large', messages[7])
+        self.assertIn('Total of invoice INV-TOTAL is too large', messages[8])
+        self.assertEqual(messages[10], 'Item price is not a number: ten')
+        self.assertEqual(list(Invoice.objects.values_list('invoice_number', flat=True)), ['INV-OK'])
+
+    def test_duplicate_numbers_are_reported(self):
+        make_invoice(self.user, invoice_number='INV-1', client_name='Existing')
+        report = self.import_rows([
+            ['INV-1', 'Acme', 'Bolt', '10', '1', ''],
+            ['INV-2', 'Acme', 'Bolt', '10', '1', ''],
+            ['INV-3', 'Acme', 'Bolt', '10', '1', ''],
+            ['INV-2', 'Acme', 'Nut', '10', '1', ''],
+        ])
+        self.assertEqual(report.errors, [
+            (5, 'Invoice INV-2 appears more than once in the file'),
+            (2, 'Invoice number INV-1 already exists'),
+        ])
+        self.assertEqual(Invoice.objects.get(invoice_number='INV-1').client_name, 'Existing')
+        self.assertEqual(
+            sorted(Invoice.objects.filter(client_name='Acme').values_list('invoice_number', flat=True)),
+            ['INV-2', 'INV-3'],
+        )
+
+    def test_batches_keep_items_with_their_invoice(self):
+        rows = [[f'INV-{i}', 'Acme', f'Item {i}-{j}', str(i), '1', ''] for i in range(1, 6) for j in range(i)]
+        with mock.patch('invoices.import_utils._write_batch', wraps=import_utils._write_batch) as write_batch:
+            report = self.import_rows(rows, batch_size=2)
+        self.assertEqual([len(call.args[1]) for call in write_batch.call_args_list], [2, 2, 1])
+        self.assertEqual((report.invoices, report.items, report.error_count), (5, 15, 0))
+        for i in range(1, 6):
+            invoice = Invoice.objects.get(invoice_number=f'INV-{i}')
+            self.assertEqual(
+                sorted(invoice.items.values_list('name', flat=True)), [f'Item {i}-{j}' for j in range(i)]
+            )
+            self.assertEqual(invoice.subtotal, Decimal(i * i))
+
+    def test_duplicate_in_a_batch_does_not_fail_the_others(self):
+        make_invoice(self.user, invoice_number='INV-2', client_name='Existing')
+        report = self.import_rows([[f'INV-{i}', 'Acme', 'Bolt', '10', '1', ''] for i in range(1, 5)], batch_size=2)
+        self.assertEqual(report.errors, [(3, 'Invoice number INV-2 already exists')])
+        self.assertEqual(report.invoices, 3)
+
+    def test_missing_column_is_an_error(self):
+        with self.assertRaisesMessage(ValueError, 'Missing column(s): item_quantity'):
+            import_invoices(self.user, BytesIO(b'invoice_number,client_name,item_name,item_price\nINV-1,Acme,Bolt,10\n'), 'csv')
+
+    def test_view_reports_the_import(self):
+        self.client.force_login(self.user)
+        upload = self.csv_file([
+            ['INV-1', 'Acme', 'Bolt', '10', '1', ''],
+            ['INV-2', 'Acme', 'Bolt', 'NaN', '1', ''],
+        ])
+        upload.name = 'invoices.csv'
+        response = self.client.post(reverse('import_invoices'), {'file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['report'].errors, [(3, 'Item price is not a number: NaN')])
+        self.assertContains(response, 'Imported 1 invoice(s) with 1 item(s).')
+        self.assertContains(response, '1 row(s) could not be imported.')
+
+
+class TypeaheadTests(TestCase):
+    def setUp(self):
+        typeahead_utils.clear_typeahead_cache()
+        self.addCleanup(typeahead_utils.clear_typeahead_cache)
+        self.user = make_user('typeahead')
+        self.client.force_login(self.user)
+
+    def create_invoice(self, client_name, items, user=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice = make_invoice(user or self.user, client_name=client_name)
+            add_items(invoice, [
+                Item(name=name, price=Decimal(price), quantity=1, unit=unit) for name, price, unit in items
+            ])
+        return invoice
+
+    def test_prefix_index(self):
+        index = PrefixIndex([('  Acme   Ltd ', 1), ('acme corp', 2), ('Globex', 3), ('', 4)])
+        self.assertEqual(index.keys, ['acme corp', 'acme ltd', 'globex'])
+        self.assertEqual(index.lookup('ACME'), [2, 1])
+        self.assertEqual(index.lookup('acme  l'), [1])
+        self.assertEqual(index.lookup('acme', limit=1), [2])
+        self.assertEqual(index.lookup('  '), [])
+        self.assertEqual(index.lookup('zz'), [])
+
+        index.add('ACME LTD', 5)
+        index.add('Acme Bolts', 6)
+        self.assertEqual(len(index), 4)
+        self.assertEqual(index.lookup('acme'), [6, 2, 5])
+
+    def test_new_documents_are_added_in_place(self):
+        self.create_invoice('Acme Ltd', [('Bolt', '1.50', 'PCS')])
+        index = get_index(self.user.pk)
+        with mock.patch('invoices.typeahead_utils.build_index') as build_index:
+            self.create_invoice('Acme Corp', [('Bolt', '2', 'KG'), ('Nut', '0.25', '')])
+            self.assertEqual(suggest(self.user.pk, 'client', 'acme'), [{'name': 'Acme Corp'}, {'name': 'Acme Ltd'}])
+            # The last price and unit used win
+            self.assertEqual(suggest(self.user.pk, 'item', 'b'), [{'name': 'Bolt', 'price': '2.00', 'unit': 'KG'}])
+        build_index.assert_not_called()
+        self.assertIs(get_index(self.user.pk), index)
+
+    def test_update_from_another_process_rebuilds(self):
+        index = get_index(self.user.pk)
+        # Another process adds a document and bumps the shared version
+        make_invoice(self.user, client_name='Initech')
+        caches['default'].incr(typeahead_utils._version_key(self.user.pk))
+        self.assertIsNot(get_index(self.user.pk), index)
+        self.assertEqual(suggest(self.user.pk, 'client', 'ini'), [{'name': 'Initech'}])
+
+    def test_copies_expire_after_the_ttl(self):
+        index = get_index(self.user.pk)
+        self.assertIs(get_index(self.user.pk), index)
+        later = index.built + typeahead_utils.TYPEAHEAD_TTL
+        with mock.patch('invoices.typeahead_utils.time.monotonic', return_value=later):
+            self.assertIsNot(get_index(self.user.pk), index)
+
+    def test_deleting_a_document_invalidates(self):
+        invoice = self.create_invoice('Acme Ltd', [('Bolt', '1.50', 'PCS')])
+        self.create_invoice('Acme Corp', [])
+        index = get_index(self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice.items.all().delete()
+            invoice.delete()
+        self.assertEqual(suggest(self.user.pk, 'client', 'acme'), [{'name': 'Acme Corp'}])
+        self.assertEqual(suggest(self.user.pk, 'item', 'bolt'), [])
+        self.assertIsNot(get_index(self.user.pk), index)
+
+    def test_view(self):
+        self.create_invoice('Acme Ltd', [('Bolt', '1.50', 'PCS')])
+        other = make_user('other')
+        self.create_invoice('Acme Other', [('Bolt cutter', '99', '')], user=other)
+
+        response = self.client.get(reverse('typeahead'), {'field': 'client', 'q': 'ac'})
+        self.assertEqual(response.json(), {'results': [{'name': 'Acme Ltd'}]})
+        response = self.client.get(reverse('typeahead'), {'field': 'item', 'q': 'BOL'})
+        self.assertEqual(response.json(), {'results': [{'name': 'Bolt', 'price': '1.50', 'unit': 'PCS'}]})
+        self.assertEqual(self.client.get(reverse('typeahead'), {'field': 'client'}).json(), {'results': []})
+        with self.assertLogs('django.request', 'WARNING'):
+            response = self.client.get(reverse('typeahead'), {'field': 'notes', 'q': 'a'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ImageVariantTests(TempArtifactCacheMixin, TestCase):
+    def make_item(self, size):
+        output = BytesIO()
+        Image.new('RGB', size, 'navy').save(output, 'JPEG')
+        return Item.objects.create(
+            name='Hose', price=Decimal('10.00'), image=ContentFile(output.getvalue(), name='hose.jpg')
+        )
+
+    def test_large_image_gets_a_variant(self):
+        item = self.make_item((1600, 1200))
+        name = image_variant(item.image, 'print')
+        self.assertTrue(name.startswith(f'{VARIANT_DIR}/'))
+        with default_storage.open(name) as fh:
+            self.assertEqual(Image.open(fh).size, (1000, 750))
+
+        # Deleted from the storage: created again rather than served from memory
+        default_storage.delete(name)
+        self.assertEqual(image_variant(item.image, 'print'), name)
+        self.assertTrue(default_storage.exists(name))
+
+    def test_small_image_is_used_as_it_is(self):
+        item = self.make_item((200, 100))
+        self.assertEqual(image_variant(item.image, 'print'), item.image.name)
+
+    def test_failure_falls_back_to_the_original_until_it_works(self):
+        item = self.make_item((1600, 1200))
+        with mock.patch('invoices.image_utils._render_variant', side_effect=OSError('truncated')), \
+                self.assertLogs('invoices.image_utils', 'WARNING'):
+            self.assertEqual(image_variant(item.image, 'screen'), item.image.name)
+        self.assertTrue(image_variant(item.image, 'screen').startswith(f'{VARIANT_DIR}/'))
+
+
+class EmailOutboxTests(TempArtifactCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('mailer')
+        self.client.force_login(self.user)
+
+    def make_invoice(self, client_name='Harbour Marine', overdue=False):
+        today = timezone.localdate()
+        return make_invoice(
+            self.user, client_name=client_name,
+            due_date=today - timedelta(days=5) if overdue else today + timedelta(days=30),
+        )
+
+    def run_worker(self):
+        call_command('run_email_worker', '--once', stdout=StringIO())
+
+    def test_request_only_queues_the_email(self):
+        invoice = self.make_invoice()
+        response = self.client.post(
+            reverse('invoice_email', args=[invoice.pk]), {'recipient_email': 'ap@harbour.example'}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutboundEmail.objects.get(invoice=invoice)
+        self.assertEqual(email.status, OutboundEmail.QUEUED)
+
+        self.run_worker()
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboundEmail.SENT)
+        self.assertIsNotNone(email.date_sent)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['ap@harbour.example'])
+
+    @override_settings(EMAIL_BACKEND='invoices.tests.CountingBackend')
+    def test_batch_shares_one_connection(self):
+        for i in range(5):
+            OutboundEmail.objects.create(
+                user=self.user, invoice=self.make_invoice(f'Client {i}'), recipient=f'c{i}@example.com'
+            )
+        CountingBackend.opened = 0
+        self.assertEqual(deliver_batch(claim_batch(10)), 5)
+        self.assertEqual(CountingBackend.opened, 1)
+        self.assertEqual(len(mail.outbox), 5)
+
+    @override_settings(EMAIL_BACKEND='invoices.tests.FailingBackend')
+    def test_failures_back_off_then_give_up(self):
+        email = OutboundEmail.objects.create(user=self.user, invoice=self.make_invoice(), recipient='a@example.com')
+        delays = []
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            before = timezone.now()
+            self.assertEqual(deliver_batch(claim_batch()), 0)
+            email.refresh_from_db()
+            self.assertEqual(email.attempts, attempt)
+            self.assertIn('SMTP unavailable', email.error)
+            if attempt < MAX_ATTEMPTS:
+                self.assertEqual(email.status, OutboundEmail.QUEUED)
+                # Not due again until the backoff has passed
+                self.assertEqual(claim_batch(), [])
+                delays.append(email.next_attempt - before)
+                OutboundEmail.objects.filter(pk=email.pk).update(next_attempt=timezone.now())
+        self.assertEqual(email.status, OutboundEmail.FAILED)
+        self.assertEqual(delays, sorted(delays))
+        self.assertGreater(delays[-1], delays[0])
+
+    def test_slow_batch_is_not_requeued(self):
+        for i in range(3):
+            OutboundEmail.objects.create(
+                user=self.user, invoice=self.make_invoice(f'Client {i}'), recipient=f'c{i}@example.com'
+            )
+        emails = claim_batch()
+        # Claimed long ago: the batch has been rendering PDFs for a while
+        started = timezone.now() - STALE_AFTER - timedelta(minutes=1)
+        OutboundEmail.objects.update(date_started=started)
+        for email in emails:
+            email.date_started = started
+
+        requeued = []
+
+        def build(*args, **kwargs):
+            # Another worker starting up meanwhile
+            requeued.append(requeue_stale_emails())
+            return build_invoice_email(*args, **kwargs)
+
+        with mock.patch('invoices.email_outbox.build_invoice_email', side_effect=build):
+            self.assertEqual(deliver_batch(emails), 3)
+        self.assertEqual(requeued, [0, 0, 0])
+        self.assertEqual(claim_batch(), [])
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(set(OutboundEmail.objects.values_list('status', 'attempts')), {(OutboundEmail.SENT, 1)})
+
+    def test_stale_emails_are_requeued_until_their_attempts_run_out(self):
+        started = timezone.now() - STALE_AFTER - timedelta(minutes=1)
+        emails = [
+            OutboundEmail.objects.create(
+                user=self.user, invoice=self.make_invoice(f'Client {i}'), recipient=f'c{i}@example.com',
+                status=OutboundEmail.SENDING, attempts=attempts, date_started=date_started,
+            )
+            for i, (attempts, date_started) in enumerate([
+                (1, started), (MAX_ATTEMPTS, started), (1, timezone.now()),
+            ])
+        ]
+        self.assertEqual(requeue_stale_emails(), 1)
+        statuses = dict(OutboundEmail.objects.values_list('pk', 'status'))
+        self.assertEqual(
+            [statuses[email.pk] for email in emails],
+            [OutboundEmail.QUEUED, OutboundEmail.FAILED, OutboundEmail.SENDING],
+        )
+        self.assertEqual([email.pk for email in claim_batch()], [emails[0].pk])
+
+    def test_bulk_email_overdue_uses_last_recipient(self):
+        emailed = self.make_invoice('Harbour Marine')
+        OutboundEmail.objects.create(user=self.user, invoice=emailed, recipient='ap@harbour.example')
+        overdue = self.make_invoice('Harbour Marine', overdue=True)
+        never_emailed = self.make_invoice('New Client Ltd', overdue=True)
+        self.make_invoice('Harbour Marine')
+
+        response = self.client.post(reverse('email_invoices_bulk'), {'scope': 'overdue'})
+        self.assertEqual(response.status_code, 302)
+        queued = OutboundEmail.objects.exclude(invoice=emailed)
+        self.assertEqual([(e.invoice_id, e.recipient) for e in queued], [(overdue.pk, 'ap@harbour.example')])
+        self.assertFalse(OutboundEmail.objects.filter(invoice=never_emailed).exists())
+
+        self.run_worker()
+        self.assertEqual(OutboundEmail.objects.filter(status=OutboundEmail.SENT).count(), 2)
+
+
+class InvoiceEmailAttachmentTests(TempArtifactCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.invoice = make_invoice(make_user('attacher'), invoice_number='INV-2026-0042')
+
+    def test_attaches_the_cached_pdf(self):
+        _, preview = get_document_export(self.invoice, 'pdf')
+        self.assertTrue(preview.startswith(b'%PDF'))
+        with mock.patch.object(export_utils, 'render_pdf_bytes', wraps=export_utils.render_pdf_bytes) as render:
+            email = build_invoice_email(self.invoice, 'ap@harbour.example')
+        # Already rendered for the preview, so emailing costs no render
+        render.assert_not_called()
+        self.assertEqual(email.attachments, [('Invoice_INV-2026-0042.pdf', preview, 'application/pdf')])
+        self.assertEqual(email.subject, f"Invoice INV-2026-0042 from {utils.COMPANY_DETAILS['company_name']}")
+        self.assertIn(utils.COMPANY_DETAILS['company_name'], email.body)
+
+    def test_renders_once_when_not_previewed(self):
+        with mock.patch.object(export_utils, 'render_pdf_bytes', wraps=export_utils.render_pdf_bytes) as render:
+            first = build_invoice_email(self.invoice, 'ap@harbour.example')
+            second = build_invoice_email(self.invoice, 'ap@harbour.example')
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(first.attachments, second.attachments)
+
+
+class OverdueSchedulerTests(TempArtifactCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('scheduler')
+        self.today = timezone.localdate()
+
+    def make_invoice(self, days_overdue, client_name='Harbour Marine', status='Pending'):
+        return make_invoice(
+            self.user, client_name=client_name, due_date=self.today - timedelta(days=days_overdue), status=status
+        )
+
+    def run_scheduler(self, *args):
+        out = StringIO()
+        call_command('run_overdue_scheduler', *args, stdout=out)
+        return out.getvalue()
+
+    def stats(self):
+        return sorted(
+            UserInvoiceStats.objects.filter(count__gt=0)
+            .values_list('status', 'month', 'count', 'total_amount')
+        )
+
+    def test_marks_past_due_invoices_overdue(self):
+        late = [self.make_invoice(days) for days in (1, 10, 40)]
+        due_today = self.make_invoice(0)
+        paid = self.make_invoice(10, status='Paid')
+
+        self.assertIn('Marked 3 invoice(s) Overdue', self.run_scheduler('--skip-reminders'))
+        statuses = dict(Invoice.objects.values_list('pk', 'status'))
+        self.assertEqual({statuses[invoice.pk] for invoice in late}, {'Overdue'})
+        self.assertEqual(statuses[due_today.pk], 'Pending')
+        self.assertEqual(statuses[paid.pk], 'Paid')
+
+        # The UPDATE skips the signals; the rollup must still match a rebuild
+        incremental = self.stats()
+        rebuild_stats(user=self.user)
+        self.assertEqual(incremental, self.stats())
+
+        self.assertIn('Marked 0 invoice(s) Overdue', self.run_scheduler('--skip-reminders'))
+
+    def test_one_reminder_per_rule(self):
+        ReminderRule.objects.create(user=self.user, days_overdue=7)
+        ReminderRule.objects.create(user=self.user, days_overdue=30, message='Final notice')
+        emailed = self.make_invoice(-30)
+        OutboundEmail.objects.create(user=self.user, invoice=emailed, recipient='ap@harbour.example')
+        week = self.make_invoice(10)
+        month = self.make_invoice(45)
+        fresh = self.make_invoice(3)
+        self.make_invoice(10, client_name='New Client Ltd')
+
+        output = self.run_scheduler()
+        self.assertIn('Queued 2 payment reminder(s)', output)
+        self.assertIn('Skipped 1 overdue invoice(s)', output)
+        reminders = OutboundEmail.objects.filter(reminder_days__isnull=False)
+        # Long past both rules, the invoice only gets the later one
+        self.assertEqual(
+            sorted(reminders.values_list('invoice_id', 'reminder_days', 'recipient', 'message')),
+            [(week.pk, 7, 'ap@harbour.example', ''), (month.pk, 30, 'ap@harbour.example', 'Final notice')],
+        )
+
+        self.assertIn('Queued 0 payment reminder(s)', self.run_scheduler())
+
+        # Three weeks on, one invoice reaches the 30 day rule and another the 7 day rule
+        later = (self.today + timedelta(days=21)).isoformat()
+        output = self.run_scheduler('--date', later)
+        self.assertIn('Queued 2 payment reminder(s)', output)
+        self.assertIn('Skipped 1 overdue invoice(s)', output)
+        self.assertEqual(sorted(reminders.filter(invoice=week).values_list('reminder_days', flat=True)), [7, 30])
+        self.assertEqual(list(reminders.filter(invoice=fresh).values_list('reminder_days', flat=True)), [7])
+
+        self.assertEqual(deliver_batch(claim_batch()), 5)
+        reminder = next(message for message in mail.outbox if 'Final notice' in message.body)
+        self.assertTrue(reminder.subject.startswith('Payment reminder: Invoice'))
+
+    def test_reminders_reuse_the_rendered_pdfs(self):
+        ReminderRule.objects.create(user=self.user, days_overdue=7)
+        invoices = [self.make_invoice(10) for _ in range(3)]
+        OutboundEmail.objects.create(user=self.user, invoice=invoices[0], recipient='ap@harbour.example')
+        self.assertEqual(deliver_batch(claim_batch()), 1)
+        # Rendered from the stored rows, as the email worker loads them
+        invoices = list(Invoice.objects.filter(pk__in=[invoice.pk for invoice in invoices]))
+        pdfs = {invoice.pk: get_document_export(invoice, 'pdf')[1] for invoice in invoices}
+        docx_fingerprint, _ = get_document_export(invoices[0], 'docx')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertIn('Queued 3 payment reminder(s)', self.run_scheduler())
+        with mock.patch.object(export_utils, 'render_pdf_bytes', wraps=export_utils.render_pdf_bytes) as render:
+            self.assertEqual(deliver_batch(claim_batch()), 3)
+        # Marking the invoices Overdue kept their PDFs, which do not show the status
+        render.assert_not_called()
+        for message in mail.outbox[1:]:
+            pk = next(pk for pk in pdfs if f'Invoice {pk} ' in message.subject)
+            self.assertEqual(message.attachments[0][1], pdfs[pk])
+        # The DOCX shows it, so it is rendered again
+        overdue = Invoice.objects.get(pk=invoices[0].pk)
+        self.assertEqual(overdue.status, 'Overdue')
+        self.assertNotEqual(export_fingerprint(overdue, 'docx'), docx_fingerprint)
+        self.assertFalse(any(name.endswith('.docx') for name in os.listdir(settings.ARTIFACT_CACHE_DIR)))
+
+
+class PDFEngineTests(TempArtifactCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.invoice = make_invoice(make_user('renderer'), invoice_number='INV-2026-0007')
+
+    def test_engine_setting_selects_the_renderer(self):
+        fingerprints = set()
+        for engine in ('xhtml2pdf', 'reportlab'):
+            with self.settings(PDF_ENGINE=engine):
+                fingerprint, pdf_bytes = get_document_export(self.invoice, 'pdf')
+            self.assertTrue(pdf_bytes.startswith(b'%PDF'))
+            fingerprints.add(fingerprint)
+        # Switching engines must not serve the other engine's cached PDF
+        self.assertEqual(len(fingerprints), 2)
+
+    def test_unknown_engine_falls_back_to_xhtml2pdf(self):
+        with self.settings(PDF_ENGINE='xhtml2pdf'):
+            expected = export_fingerprint(self.invoice, 'pdf')
+        with self.settings(PDF_ENGINE='no-such-engine'), self.assertLogs('invoices.pdf_engines', 'WARNING'):
+            self.assertEqual(export_fingerprint(self.invoice, 'pdf'), expected)
+
+    def test_reportlab_repeats_the_item_heading_on_every_page(self):
+        items = [
+            Item(name=f'Marine grade shackle {i}', price=Decimal('1500.00'), quantity=2, unit='PCS',
+                 lead_time='2-3 WEEKS' if i % 2 else None)
+            for i in range(120)
+        ]
+        pages = PdfReader(BytesIO(render_document_pdf(self.invoice, items, []))).pages
+        self.assertGreater(len(pages), 2)
+        for page in pages:
+            self.assertIn('DESCRIPTION', page.extract_text())
+        text = ''.join(page.extract_text() for page in pages)
+        self.assertIn('INVOICE INV-2026-0007', text)
+        self.assertIn('2 PCS', text)
+        self.assertIn('1-7 DAYS', text)
+        self.assertIn('Marine grade shackle 119', text)
+
+    def test_reportlab_leaves_the_global_stream_encoding_alone(self):
+        from reportlab import rl_config
+        default = rl_config.useA85
+        with self.settings(PDF_ENGINE='reportlab'):
+            _, pdf_bytes = get_document_export(self.invoice, 'pdf')
+        # Binary streams in this engine's output only
+        self.assertNotIn(b'/ASCII85Decode', pdf_bytes)
+        self.assertEqual(rl_config.useA85, default)
+
+    @override_settings(PDF_ENGINE='reportlab')
+    def test_download_is_streamed_from_the_cache(self):
+        self.client.force_login(self.invoice.user)
+        url = reverse('invoice_pdf', args=[self.invoice.pk])
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertIn('inline; filename="Invoice_INV-2026-0007.pdf"', response['Content-Disposition'])
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+        response.close()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
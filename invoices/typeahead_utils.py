@@ -0,0 +1,208 @@
+"""Per-user autocomplete for client names and the item catalog.
+
+Each user gets two in-process prefix indexes: the client names of their
+invoices and quotations, and the names of their items with the price and
+unit last used. An index is a sorted list of normalised keys searched
+with bisect, so a lookup costs O(log n) plus the hits returned.
+
+Indexes are built on first use and kept in an LRU of TYPEAHEAD_CACHE_SIZE
+users. New documents are added to the index in place (record_documents());
+deleting a document drops the index (invalidate()). Either way a version
+number in the shared cache tells other processes that their copy is
+stale, and they rebuild it on their next lookup. Changes that skip both
+(e.g. edits in the admin) show up once a copy is TYPEAHEAD_TTL seconds
+old, when it is rebuilt regardless.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from bisect import bisect_left
+from collections import OrderedDict
+from decimal import Decimal
+from functools import partial
+import threading
+import time
+
+from .models import Invoice
+from quotations.models import Item, Quotation
+
+TYPEAHEAD_CACHE_SIZE = 64
+
+TYPEAHEAD_TTL = 300
+
+TYPEAHEAD_LIMIT = 10
+
+TYPEAHEAD_FIELDS = ('client', 'item')
+
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+
+def normalise(text):
+    """Lookup key: case-folded, with runs of whitespace collapsed"""
+    return ' '.join(str(text or '').split()).casefold()
+
+
+class PrefixIndex:
+    """Sorted keys with one value each; later add()s of a key replace its value"""
+
+    def __init__(self, pairs=()):
+        entries = {}
+        for text, value in pairs:
+            key = normalise(text)
+            if key:
+                entries[key] = value
+        self.keys = sorted(entries)
+        self.values = [entries[key] for key in self.keys]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, text, value):
+        key = normalise(text)
+        if not key:
+            return
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            self.values[i] = value
+        else:
+            self.keys.insert(i, key)
+            self.values.insert(i, value)
+
+    def lookup(self, prefix, limit=TYPEAHEAD_LIMIT):
+        """Values whose key starts with `prefix`, in key order"""
+        prefix = normalise(prefix)
+        if not prefix:
+            return []
+        results = []
+        i = bisect_left(self.keys, prefix)
+        while i < len(self.keys) and len(results) < limit and self.keys[i].startswith(prefix):
+            results.append(self.values[i])
+            i += 1
+        return results
+
+
+class UserIndex:
+    def __init__(self, version, clients, items):
+        self.version = version
+        self.built = time.monotonic()
+        self.client = clients
+        self.item = items
+
+
+def _version_key(user_id):
+    return f'typeahead_version:{user_id}'
+
+
+def _initial_version():
+    # Unlikely to match an index built before the cached version was evicted
+    return time.time_ns()
+
+
+def _client_value(name):
+    return {'name': name}
+
+
+def _item_value(name, price, unit):
+    return {'name': name, 'price': f'{Decimal(price):.2f}', 'unit': unit or ''}
+
+
+def _client_pairs(user_id):
+    for model in (Invoice, Quotation):
+        # Oldest first, so the latest spelling of a name wins
+        names = (
+            model.objects.filter(user_id=user_id)
+            .order_by('pk').values_list('client_name', flat=True)
+        )
+        for name in names.iterator(chunk_size=2000):
+            yield name, _client_value(name)
+
+
+def _item_pairs(user_id):
+    rows = []
+    for model in (Invoice, Quotation):
+        links = model.items.through.objects.filter(**{f'{model._meta.model_name}__user_id': user_id})
+        rows.extend(
+            Item.objects.filter(pk__in=links.values('item_id'))
+            .values_list('pk', 'name', 'price', 'unit')
+            .iterator(chunk_size=2000)
+        )
+    # Oldest first across both document types, so the last price and unit win
+    rows.sort()
+    for _, name, price, unit in rows:
+        yield name, _item_value(name, price, unit)
+
+
+def build_index(user_id, version):
+    return UserIndex(version, PrefixIndex(_client_pairs(user_id)), PrefixIndex(_item_pairs(user_id)))
+
+
+def get_index(user_id):
+    """The user's UserIndex, built if missing here or changed by another process"""
+    version = cache.get_or_set(_version_key(user_id), _initial_version, None)
+    with _lock:
+        index = _indexes.get(user_id)
+        if (index is not None and index.version == version
+                and time.monotonic() - index.built < TYPEAHEAD_TTL):
+            _indexes.move_to_end(user_id)
+            return index
+    index = build_index(user_id, version)
+    with _lock:
+        _indexes[user_id] = index
+        _indexes.move_to_end(user_id)
+        while len(_indexes) > TYPEAHEAD_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
+
+
+def suggest(user_id, field, prefix, limit=TYPEAHEAD_LIMIT):
+    """Up to `limit` suggestions for a 'client' or 'item' field"""
+    return getattr(get_index(user_id), field).lookup(prefix, limit)
+
+
+def _apply(user_id, client_names, items):
+    key = _version_key(user_id)
+    try:
+        version = cache.incr(key)
+    except ValueError:
+        version = None
+        cache.set(key, _initial_version(), None)
+    with _lock:
+        index = _indexes.get(user_id)
+        if index is None:
+            return
+        if version is None or index.version != version - 1:
+            # Missed an update from another process
+            del _indexes[user_id]
+            return
+        for name in client_names:
+            index.client.add(name, _client_value(name))
+        for item in items:
+            index.item.add(item.name, _item_value(item.name, item.price, item.unit))
+        index.version = version
+
+
+def record_documents(documents, document_items):
+    """Add new Invoices or Quotations and their items (one list per document) to the indexes on commit"""
+    by_user = {}
+    for document, items in zip(documents, document_items):
+        client_names, user_items = by_user.setdefault(document.user_id, ([], []))
+        client_names.append(document.client_name)
+        user_items.extend(items)
+    for user_id, (client_names, user_items) in by_user.items():
+        transaction.on_commit(partial(_apply, user_id, client_names, user_items))
+
+
+def invalidate(user_id):
+    """Make every process rebuild the user's indexes on their next lookup"""
+    try:
+        cache.incr(_version_key(user_id))
+    except ValueError:
+        # Not cached: the next lookup starts a new version, matching no copy
+        pass
+    with _lock:
+        _indexes.pop(user_id, None)
+
+
+def clear_typeahead_cache():
+    with _lock:
+        _indexes.clear()
@@ -3,6 +3,13 @@ from . import views
 
 urlpatterns = [
     path('', views.invoice_list, name='invoice_list'),
+    path('export/zip/', views.export_invoices_zip, name='export_invoices_zip'),
+    path('ledger/<str:fmt>/', views.export_invoice_ledger, name='invoice_ledger'),
+    path('search/', views.search, name='search'),
+    path('typeahead/', views.typeahead, name='typeahead'),
+    path('email/', views.email_invoices_bulk, name='email_invoices_bulk'),
+    path('import/', views.import_invoices, name='import_invoices'),
+    path('reminders/', views.reminder_rules, name='reminder_rules'),
     path('new/', views.invoice_detail, name='invoice_detail'),
     path('<int:pk>/', views.invoice_detail, name='invoice_detail'),
     path('<int:pk>/view/', views.view_invoice, name='view_invoice'),
@@ -13,5 +20,8 @@ urlpatterns = [
     path('<int:pk>/delete/', views.delete_invoice, name='delete_invoice'),
     path('<int:pk>/mark-paid/', views.mark_as_paid, name='mark_as_paid'),
     path('<int:pk>/email/', views.email_invoice, name='invoice_email'),
+    path('<int:pk>/export/<str:fmt>/', views.prepare_invoice_export, name='prepare_invoice_export'),
+    path('exports/<int:job_id>/', views.render_job_status, name='render_job_status'),
+    path('exports/<int:job_id>/download/', views.render_job_download, name='render_job_download'),
     path('check-number/', views.check_invoice_number, name='check_invoice_number'),
-]
\ No newline at end of file
+]
@@ -1,109 +1,144 @@
 from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.db.models import Q
+from datetime import datetime
+from decimal import Decimal
 from django.template.loader import get_template
-import os
-from django.conf import settings
-try:
-    from xhtml2pdf import pisa
-    from io import BytesIO
-    PDF_AVAILABLE = True
-except Exception:
-    PDF_AVAILABLE = False
-
-
-def _link_callback(uri, rel):
-    """Convert HTML URIs to absolute system paths for xhtml2pdf.
-    Supports STATIC_URL and MEDIA_URL so images/fonts load inside PDFs."""
-    print(f"\n\n[DEBUG] Processing URI: {uri}\n\n")
-    
-    # Handle absolute filesystem paths directly
-    if os.path.isabs(uri) and os.path.exists(uri):
-        print(f"[DEBUG] Absolute path exists: {uri}")
-        return uri
-
-    # Static files
-    static_url = settings.STATIC_URL
-    if uri.startswith(static_url):
-        # Prefer STATIC_ROOT if collected; otherwise first STATICFILES_DIRS entry
-        static_rel_path = uri.replace(static_url, '')
-        static_root = getattr(settings, 'STATIC_ROOT', '')
-        if static_root and os.path.isdir(static_root):
-            path = os.path.join(static_root, static_rel_path)
-        else:
-            static_dirs = getattr(settings, 'STATICFILES_DIRS', [])
-            base_dir = static_dirs[0] if static_dirs else os.path.join(settings.BASE_DIR, 'static')
-            path = os.path.join(base_dir, static_rel_path)
-        print(f"[DEBUG] Static path: {path} (Exists: {os.path.exists(path)})")
-        return path
-
-    # Media files
-    media_url = settings.MEDIA_URL
-    if uri.startswith(media_url):
-        media_rel_path = uri.replace(media_url, '')
-        media_path = os.path.join(settings.MEDIA_ROOT, media_rel_path)
-        print(f"[DEBUG] Media URL: {uri} -> Path: {media_path} (Exists: {os.path.exists(media_path)})")
-        # If the media path doesn't exist, try to find the file in the item_images directory
-        if not os.path.exists(media_path):
-            item_images_dir = os.path.join(settings.MEDIA_ROOT, 'item_images')
-            if os.path.exists(item_images_dir):
-                print(f"[DEBUG] Checking item_images directory: {item_images_dir}")
-                # Get the filename from the path
-                filename = os.path.basename(media_path)
-                alternative_path = os.path.join(item_images_dir, filename)
-                print(f"[DEBUG] Alternative path: {alternative_path} (Exists: {os.path.exists(alternative_path)})")
-                if os.path.exists(alternative_path):
-                    return alternative_path
-        return media_path
-    
-    # Handle relative URLs that might be media files
-    if uri.startswith('/media/'):
-        media_rel_path = uri.replace('/media/', '')
-        media_path = os.path.join(settings.MEDIA_ROOT, media_rel_path)
-        print(f"[DEBUG] Relative Media URL: {uri} -> Path: {media_path} (Exists: {os.path.exists(media_path)})")
-        # If the media path doesn't exist, try to find the file in the item_images directory
-        if not os.path.exists(media_path):
-            item_images_dir = os.path.join(settings.MEDIA_ROOT, 'item_images')
-            if os.path.exists(item_images_dir):
-                print(f"[DEBUG] Checking item_images directory: {item_images_dir}")
-                # Get the filename from the path
-                filename = os.path.basename(media_path)
-                alternative_path = os.path.join(item_images_dir, filename)
-                print(f"[DEBUG] Alternative path: {alternative_path} (Exists: {os.path.exists(alternative_path)})")
-                if os.path.exists(alternative_path):
-                    return alternative_path
-        return media_path
-
-    # Fallback: try joining BASE_DIR
-    fallback_path = os.path.join(settings.BASE_DIR, uri.lstrip('/'))
-    print(f"[DEBUG] Fallback path: {fallback_path} (Exists: {os.path.exists(fallback_path)})")
-    return fallback_path
+from .pdf_engines import get_pdf_engine
+from .search_utils import matching_document_ids
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def filter_documents(queryset, params):
+    """Apply the invoice/quotation list filters to a queryset.
+
+    `params` is a GET-like mapping with optional q (client name, or words
+    found by search_utils), status, start/end (YYYY-MM-DD, on date_created)
+    and min/max (on total). Invalid values are ignored, as in the list views.
+    """
+    q = params.get('q')
+    status = params.get('status')
+    start = params.get('start')
+    end = params.get('end')
+    min_amt = params.get('min')
+    max_amt = params.get('max')
+    if q:
+        queryset = queryset.filter(
+            Q(client_name__icontains=q) | Q(pk__in=matching_document_ids(queryset.model, q))
+        )
+    if status and any(field.name == 'status' for field in queryset.model._meta.fields):
+        queryset = queryset.filter(status=status)
+    if start:
+        try:
+            start_date = datetime.strptime(start, '%Y-%m-%d').date()
+            queryset = queryset.filter(date_created__date__gte=start_date)
+        except Exception:
+            pass
+    if end:
+        try:
+            end_date = datetime.strptime(end, '%Y-%m-%d').date()
+            queryset = queryset.filter(date_created__date__lte=end_date)
+        except Exception:
+            pass
+    if min_amt:
+        try:
+            queryset = queryset.filter(total__gte=Decimal(min_amt))
+        except Exception:
+            pass
+    if max_amt:
+        try:
+            queryset = queryset.filter(total__lte=Decimal(max_amt))
+        except Exception:
+            pass
+    return queryset
+
+
+def load_document(model, pk, user, allow_staff=True):
+    """Fetch an Invoice or Quotation with its owner and items prefetched.
+
+    Staff may load any document when allow_staff is set; everyone else only
+    their own. Raises Http404 when the document is not visible to the user.
+    """
+    queryset = model.objects.select_related('user').prefetch_related('items')
+    if not (allow_staff and user.is_staff):
+        queryset = queryset.filter(user=user)
+    return get_object_or_404(queryset, pk=pk)
+
+
+def document_items(document):
+    """Return (items, items_with_images) for an Invoice or Quotation.
+
+    Uses the prefetched items when load_document() was used, so templates
+    and DOCX builders can iterate them repeatedly without new queries.
+    """
+    items = list(document.items.all())
+    return items, [item for item in items if item.image]
+
+
+COMPANY_DETAILS = {
+    'company_name': 'Skids LOGISTICS LTD',
+    'company_address': 'NO. 17 Eastern Bypass, Buchi Atako Villa, Port Harcourt',
+    'company_phone': '07035495280',
+    'company_email': 'info@skidslogistics.com',
+    'company_website': 'www.skidslogistics.com',
+}
+
+
+def render_pdf_bytes(template_src, context_dict={}, engine=None):
+    """Render a document to PDF bytes with a PDF engine; returns (pdf_bytes, html).
+
+    `engine` is a name from pdf_engines.PDF_ENGINES, by default the
+    PDF_ENGINE setting. pdf_bytes is None when no engine is available or
+    rendering fails; html is then the rendered template for callers to fall
+    back to, and None otherwise.
+    """
+    engine = get_pdf_engine(engine)
+    if engine is not None:
+        try:
+            return engine.render(template_src, context_dict), None
+        except Exception:
+            logger.exception(f"Could not render {template_src} with {engine.name}")
+    return None, get_template(template_src).render(context_dict)
 
 
 def render_to_pdf(template_src, context_dict={}):
-    template = get_template(template_src)
-    html = template.render(context_dict)
-    if not PDF_AVAILABLE:
+    pdf_bytes, html = render_pdf_bytes(template_src, context_dict)
+    if pdf_bytes is None:
         return HttpResponse(html, content_type='text/html')
-    result = BytesIO()
-    # Use CreatePDF with link_callback to resolve static/media URIs
-    pdf = pisa.CreatePDF(src=BytesIO(html.encode('utf-8')), dest=result, encoding='utf-8', link_callback=_link_callback)
-    if not pdf.err:
-        response = HttpResponse(result.getvalue(), content_type='application/pdf')
-        return response
-    return HttpResponse(html, content_type='text/html')
+    return HttpResponse(pdf_bytes, content_type='application/pdf')
 
 
-def generate_invoice_pdf(invoice, request=None):
+def pdf_context(document, request=None):
+    """Template context for an invoice or quotation PDF"""
+    items, items_with_images = document_items(document)
     context = {
-        'invoice': invoice,
-        'company_name': 'Skids LOGISTICS LTD',
-        'company_address': 'NO. 17 Eastern Bypass, Buchi Atako Villa, Port Harcourt',
-        'company_phone': '07035495280',
-        'company_email': 'info@skidslogistics.com',
-        'company_website': 'www.skidslogistics.com',
+        document._meta.model_name: document,
+        'items': items,
+        'items_with_images': items_with_images,
+        **COMPANY_DETAILS,
     }
     
     # Add request to context if available
     if request:
         context['request'] = request
+    return context
+
+
+def _document_pdf_response(document, template_src, request=None):
+    """PDF response for an invoice/quotation; falls back to HTML if rendering fails"""
+    from .export_utils import document_export_response
     
-    return render_to_pdf('invoices/invoice_pdf.html', context)
\ No newline at end of file
+    response = document_export_response(request, document, 'pdf')
+    if response is None:
+        return render_to_pdf(template_src, pdf_context(document, request))
+    return response
+
+
+def generate_invoice_pdf(invoice, request=None):
+    return _document_pdf_response(invoice, 'invoices/invoice_pdf.html', request=request)
+
+
+def generate_quotation_pdf(quotation, request=None):
+    return _document_pdf_response(quotation, 'quotations/quotation_pdf.html', request=request)
@@ -1,61 +1,38 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from .models import Invoice
-from quotations.models import Item
-from django.http import JsonResponse, HttpResponse
+from .models import Invoice, ReminderRule, RenderJob
+from django.http import JsonResponse, HttpResponse, FileResponse, StreamingHttpResponse
+from django.views.decorators.http import require_POST
+from django.db import transaction
 import json
-import re
 from datetime import datetime, timedelta
 from decimal import Decimal
-from .utils import generate_invoice_pdf
-from .email_utils import send_invoice_email
-from django.db.models import Q
+from .utils import generate_invoice_pdf, load_document, filter_documents
+from .item_utils import parse_item_rows, add_items
+from .numbering_utils import reserve_document_number, peek_document_number, number_taken
+from .pagination_utils import paginate_list, list_count_cache_key, PAGE_SIZE_CHOICES
 
 @login_required
 def invoice_list(request):
     invoices = Invoice.objects.filter(user=request.user).order_by('-date_created')
-    # Filters
-    q = request.GET.get('q')
-    status = request.GET.get('status')
-    start = request.GET.get('start')
-    end = request.GET.get('end')
-    min_amt = request.GET.get('min')
-    max_amt = request.GET.get('max')
-    if q:
-        invoices = invoices.filter(Q(client_name__icontains=q))
-    if status:
-        invoices = invoices.filter(status=status)
-    if start:
-        try:
-            start_date = datetime.strptime(start, '%Y-%m-%d').date()
-            invoices = invoices.filter(date_created__date__gte=start_date)
-        except Exception:
-            pass
-    if end:
-        try:
-            end_date = datetime.strptime(end, '%Y-%m-%d').date()
-            invoices = invoices.filter(date_created__date__lte=end_date)
-        except Exception:
-            pass
-    if min_amt:
-        try:
-            invoices = invoices.filter(total__gte=Decimal(min_amt))
-        except Exception:
-            pass
-    if max_amt:
-        try:
-            invoices = invoices.filter(total__lte=Decimal(max_amt))
-        except Exception:
-            pass
+    invoices = filter_documents(invoices, request.GET)
+    
+    # Paginate; the total row count is cached per filter combination
+    count_cache_key = list_count_cache_key(Invoice, request.user.pk, {
+        name: request.GET.get(name, '') for name in ('q', 'status', 'start', 'end', 'min', 'max')
+    })
+    page, page_range = paginate_list(request, invoices.select_related('user'), count_cache_key)
     
     # Calculate summary statistics
-    total_invoices = invoices.count()
+    total_invoices = page.paginator.count
     paid_invoices = invoices.filter(status='Paid').count()
-    overdue_invoices = sum(1 for invoice in invoices if invoice.is_overdue())
+    overdue_invoices = invoices.overdue().count()
     
     context = {
-        'invoices': invoices,
+        'invoices': page,
+        'page_range': page_range,
+        'page_size_choices': PAGE_SIZE_CHOICES,
         'total_invoices': total_invoices,
         'paid_invoices': paid_invoices,
         'overdue_invoices': overdue_invoices
@@ -66,7 +43,7 @@ def invoice_list(request):
 @login_required
 def invoice_detail(request, pk=None):
     if pk:
-        invoice = get_object_or_404(Invoice, pk=pk, user=request.user)
+        invoice = load_document(Invoice, pk, request.user, allow_staff=False)
     else:
         invoice = None
     
@@ -98,13 +75,8 @@ def invoice_detail(request, pk=None):
         notes_val = data.get('notes', '') or ''
         client_name_val = data.get('client_name') or ''
         
-        # Check if invoice number already exists
-        invoice_number = data.get('invoice_number') or ''
-        if invoice_number:
-            existing_invoice = Invoice.objects.filter(invoice_number=invoice_number).first()
-            if existing_invoice:
-                messages.error(request, f'Invoice number "{invoice_number}" has already been used. Please choose a different number.')
-                return render(request, 'invoices/invoice_detail.html', {'invoice': invoice})
+        # Blank numbers are assigned from the user's sequence on save
+        invoice_number = (data.get('invoice_number') or '').strip()
         
         # Create new invoice with safe defaults
         invoice = Invoice(
@@ -121,45 +93,25 @@ def invoice_detail(request, pk=None):
             total=Decimal('0.00'),
             date_created=datetime.now()
         )
-        invoice.save()
-        
-        # Process items
-        item_names = request.POST.getlist('item_name[]')
-        item_prices = request.POST.getlist('item_price[]')
-        item_quantity_displays = request.POST.getlist('item_quantity_display[]')
-        item_units = request.POST.getlist('item_unit[]')
-        item_images = request.FILES.getlist('item_image[]')
-        for i in range(len(item_names)):
-            name = item_names[i]
-            price_str = item_prices[i] if i < len(item_prices) else ''
-            qty_display = item_quantity_displays[i] if i < len(item_quantity_displays) else ''
-            unit = item_units[i] if i < len(item_units) else 'EA'
-            if name and price_str and qty_display:
-                try:
-                    price_val = Decimal(price_str)
-                    # Extract numeric value from quantity display field, ignoring any unit text
-                    qty_match = re.match(r'^(\d+(?:\.\d+)?)', qty_display.strip())
-                    qty_val = float(qty_match.group(1)) if qty_match else 0
-                except Exception:
-                    continue
-                image_file = item_images[i] if i < len(item_images) else None
-                item = Item.objects.create(
-                    name=name,
-                    price=price_val,
-                    quantity=qty_val,
-                    unit=unit,
-                    image=image_file
-                )
-                invoice.items.add(item)
         
-        # Calculate totals
-        invoice.calculate_totals()
-        invoice.save()
+        # Parse every item row first so totals are known before the insert
+        items = parse_item_rows(request)
+        invoice.calculate_totals(items)
+        with transaction.atomic():
+            invoice.invoice_number = reserve_document_number(Invoice, request.user, invoice_number)
+            if invoice.invoice_number is None:
+                messages.error(request, f'Invoice number "{invoice_number}" has already been used. Please choose a different number.')
+                return render(request, 'invoices/invoice_detail.html', {'invoice': None, 'next_number': peek_document_number(Invoice, request.user)})
+            invoice.save()
+            add_items(invoice, items)
         
         messages.success(request, 'Invoice saved successfully!')
         return redirect('invoice_list')
     
-    return render(request, 'invoices/invoice_detail.html', {'invoice': invoice})
+    context = {'invoice': invoice}
+    if invoice is None:
+        context['next_number'] = peek_document_number(Invoice, request.user)
+    return render(request, 'invoices/invoice_detail.html', context)
 
 @login_required
 def delete_invoice(request, pk):
@@ -209,50 +161,67 @@ def update_invoice_status(request, pk):
 
 @login_required
 def export_invoice_pdf(request, pk):
-    if request.user.is_staff:
-        invoice = get_object_or_404(Invoice, pk=pk)
-    else:
-        invoice = get_object_or_404(Invoice, pk=pk, user=request.user)
+    invoice = load_document(Invoice, pk, request.user)
     return generate_invoice_pdf(invoice, request=request)
 
 @login_required
 def export_invoice_docx(request, pk):
-    if request.user.is_staff:
-        invoice = get_object_or_404(Invoice, pk=pk)
-    else:
-        invoice = get_object_or_404(Invoice, pk=pk, user=request.user)
+    invoice = load_document(Invoice, pk, request.user)
     from .docx_utils import generate_invoice_docx
-    return generate_invoice_docx(invoice)
+    return generate_invoice_docx(invoice, request=request)
 
 @login_required
 def email_invoice(request, pk):
-    invoice = get_object_or_404(Invoice, pk=pk, user=request.user)
+    from .email_outbox import enqueue_invoice_email, last_recipients
+    invoice = load_document(Invoice, pk, request.user, allow_staff=False)
     
     if request.method == 'POST':
         recipient_email = request.POST.get('recipient_email')
         message = request.POST.get('message')
         
         if recipient_email:
-            # Send email with invoice
-            success = send_invoice_email(invoice, recipient_email, message)
-            
-            if success:
-                messages.success(request, f'Invoice #{invoice.id} has been emailed to {recipient_email}')
-                return redirect('invoice_detail', pk=pk)
-            else:
-                messages.error(request, 'Failed to send email. Please try again.')
+            # Sent by the email worker; the request does not wait for SMTP
+            enqueue_invoice_email(request.user, invoice, recipient_email, message)
+            messages.success(request, f'Invoice #{invoice.id} has been queued for emailing to {recipient_email}')
+            return redirect('invoice_email', pk=pk)
         else:
             messages.error(request, 'Recipient email is required')
     
-    return render(request, 'invoices/email_invoice.html', {'invoice': invoice})
+    return render(request, 'invoices/email_invoice.html', {
+        'invoice': invoice,
+        'emails': invoice.emails.order_by('-date_created')[:10],
+        'last_recipient': last_recipients(request.user, [invoice.client_name]).get(invoice.client_name, ''),
+    })
+
+@login_required
+@require_POST
+def email_invoices_bulk(request):
+    """Queue emails for the selected invoices, or for every overdue invoice"""
+    from .email_outbox import enqueue_invoice_emails
+    invoices = Invoice.objects.filter(user=request.user)
+    if request.POST.get('scope') == 'overdue':
+        invoices = invoices.overdue()
+    else:
+        invoices = invoices.filter(pk__in=request.POST.getlist('invoice_ids'))
+    recipient = (request.POST.get('recipient_email') or '').strip() or None
+    emails, skipped = enqueue_invoice_emails(request.user, invoices, recipient, request.POST.get('message', ''))
+    if emails:
+        messages.success(request, f'Queued {len(emails)} invoice email(s).')
+    if skipped:
+        messages.warning(
+            request,
+            f'{len(skipped)} invoice(s) were not queued because their client has not been emailed before: '
+            + ', '.join(str(invoice.invoice_number or invoice.pk) for invoice in skipped[:10])
+            + ('...' if len(skipped) > 10 else ''),
+        )
+    if not emails and not skipped:
+        messages.info(request, 'No invoices to email.')
+    return redirect('invoice_list')
 
 @login_required
 def view_invoice(request, pk):
     """View an invoice in detail"""
-    if request.user.is_staff:
-        invoice = get_object_or_404(Invoice, pk=pk)
-    else:
-        invoice = get_object_or_404(Invoice, pk=pk, user=request.user)
+    invoice = load_document(Invoice, pk, request.user)
     
     context = {
         'invoice': invoice,
@@ -266,5 +235,152 @@ def check_invoice_number(request):
     if not number:
         return JsonResponse({'exists': False})
     
-    exists = Invoice.objects.filter(invoice_number=number).exists()
+    exists = number_taken(Invoice, request.user, number)
     return JsonResponse({'exists': exists})
+
+@login_required
+@require_POST
+def prepare_invoice_export(request, pk, fmt):
+    """Queue a PDF/DOCX export of an invoice for the render worker"""
+    from .render_queue import enqueue_render_job, job_payload
+    from .export_utils import EXPORT_FORMATS
+    if fmt not in EXPORT_FORMATS:
+        return JsonResponse({'error': f'Unsupported format: {fmt}'}, status=400)
+    invoice = load_document(Invoice, pk, request.user)
+    job = enqueue_render_job(request.user, invoice, fmt)
+    return JsonResponse(job_payload(job), status=202)
+
+@login_required
+def export_invoices_zip(request):
+    """Download the filtered invoice list as a ZIP of PDFs (or DOCX with ?format=docx)"""
+    from .bulk_export import stream_invoice_zip
+    from .export_utils import EXPORT_FORMATS
+    from .pagination_utils import LIST_ORDERING
+    fmt = request.GET.get('format', 'pdf')
+    if fmt not in EXPORT_FORMATS:
+        messages.error(request, f'Unsupported export format: {fmt}')
+        return redirect('invoice_list')
+    invoices = filter_documents(Invoice.objects.filter(user=request.user), request.GET)
+    invoice_ids = list(invoices.order_by(*LIST_ORDERING).values_list('pk', flat=True))
+    if not invoice_ids:
+        messages.info(request, 'No invoices match the current filters.')
+        return redirect('invoice_list')
+    response = StreamingHttpResponse(stream_invoice_zip(invoice_ids, fmt), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="invoices_{datetime.now():%Y%m%d}.zip"'
+    return response
+
+@login_required
+def export_invoice_ledger(request, fmt):
+    """The filtered invoice list as a CSV or XLSX spreadsheet"""
+    from .ledger_utils import LEDGER_FORMATS, ledger_response
+    if fmt not in LEDGER_FORMATS:
+        messages.error(request, f'Unsupported export format: {fmt}')
+        return redirect('invoice_list')
+    invoices = filter_documents(Invoice.objects.filter(user=request.user), request.GET)
+    return ledger_response(invoices, fmt)
+
+@login_required
+def import_invoices(request):
+    """Upload a CSV or XLSX sheet of invoices and their items"""
+    from . import import_utils
+    report = None
+    if request.method == 'POST':
+        upload = request.FILES.get('file')
+        fmt = import_utils.import_format(upload.name) if upload else None
+        if fmt is None:
+            messages.error(request, 'Please choose a .csv or .xlsx file to import.')
+        else:
+            try:
+                report = import_utils.import_invoices(request.user, upload.file, fmt)
+            except Exception as e:
+                messages.error(request, f'Could not read {upload.name}: {e}')
+            else:
+                if report.invoices:
+                    messages.success(request, f'Imported {report.invoices} invoice(s) with {report.items} item(s).')
+                if report.error_count:
+                    messages.warning(request, f'{report.error_count} row(s) could not be imported.')
+    return render(request, 'invoices/import_invoices.html', {
+        'report': report,
+        'columns': import_utils.REQUIRED_COLUMNS,
+    })
+
+@login_required
+def reminder_rules(request):
+    """Add, switch on/off and remove the user's payment reminder rules"""
+    if request.method == 'POST':
+        action = request.POST.get('action')
+        rules = ReminderRule.objects.filter(user=request.user)
+        if action == 'add':
+            try:
+                days = int(request.POST.get('days_overdue', ''))
+                if days < 0:
+                    raise ValueError
+            except ValueError:
+                messages.error(request, 'Days overdue must be a whole number of days.')
+            else:
+                rule, created = ReminderRule.objects.update_or_create(
+                    user=request.user, days_overdue=days,
+                    defaults={'message': request.POST.get('message', '').strip(), 'active': True},
+                )
+                messages.success(request, f'Reminder at {days} day(s) overdue {"added" if created else "updated"}.')
+        elif action == 'toggle':
+            rule = get_object_or_404(rules, pk=request.POST.get('rule_id'))
+            rule.active = not rule.active
+            rule.save(update_fields=['active'])
+        elif action == 'delete':
+            get_object_or_404(rules, pk=request.POST.get('rule_id')).delete()
+            messages.success(request, 'Reminder removed.')
+        return redirect('reminder_rules')
+    
+    return render(request, 'invoices/reminder_rules.html', {
+        'rules': ReminderRule.objects.filter(user=request.user),
+    })
+
+@login_required
+def search(request):
+    """Ranked hits across the user's invoices, quotations and items (JSON with ?format=json)"""
+    from .search_utils import search as search_documents
+    query = (request.GET.get('q') or '').strip()
+    hits = search_documents(request.user, query) if query else []
+    if request.GET.get('format') == 'json':
+        return JsonResponse({'query': query, 'results': hits})
+    return render(request, 'invoices/search.html', {'query': query, 'hits': hits})
+
+@login_required
+def typeahead(request):
+    """Suggestions for the client name (?field=client) or item name (?field=item) inputs"""
+    from .typeahead_utils import TYPEAHEAD_FIELDS, suggest
+    field = request.GET.get('field')
+    if field not in TYPEAHEAD_FIELDS:
+        return JsonResponse({'error': 'field must be client or item'}, status=400)
+    return JsonResponse({'results': suggest(request.user.pk, field, request.GET.get('q', ''))})
+
+@login_required
+def render_job_status(request, job_id):
+    """Poll the state of a queued export"""
+    from .render_queue import job_payload
+    job = get_object_or_404(RenderJob, pk=job_id, user=request.user)
+    return JsonResponse(job_payload(job))
+
+@login_required
+def render_job_download(request, job_id):
+    """Stream the artifact of a finished export"""
+    from .render_queue import job_document, job_payload, open_job_artifact, requeue_job
+    from .export_utils import CONTENT_TYPES, export_filename
+    job = get_object_or_404(RenderJob, pk=job_id, user=request.user)
+    if job.status != RenderJob.DONE:
+        return JsonResponse(job_payload(job), status=409)
+    document = job_document(job)
+    if document is None:
+        return JsonResponse({'error': 'Document no longer exists'}, status=404)
+    artifact = open_job_artifact(job, document)
+    if artifact is None:
+        # Deleted from the storage or superseded by a newer version
+        requeue_job(job)
+        return JsonResponse(job_payload(job), status=202)
+    return FileResponse(
+        artifact,
+        as_attachment=True,
+        filename=export_filename(document, job.format),
+        content_type=CONTENT_TYPES[job.format],
+    )
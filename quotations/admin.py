@@ -1,4 +1,4 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.urls import reverse
 from django.utils.html import format_html
 from .models import Quotation, Item
@@ -25,6 +25,13 @@ class QuotationAdmin(admin.ModelAdmin):
     readonly_fields = ['subtotal', 'vat_amount', 'total', 'export_buttons']
     exclude = ['items']
     inlines = [ItemInline]
+    actions = ['convert_to_invoices']
+    
+    @admin.action(description="Convert selected quotations to invoices")
+    def convert_to_invoices(self, request, queryset):
+        from invoices.conversion_utils import convert_quotations
+        invoices = convert_quotations(queryset)
+        self.message_user(request, f"Converted {len(invoices)} quotation(s) to invoices.", messages.SUCCESS)
     
     def export_buttons(self, obj):
         pdf_url = reverse('quotation_pdf', args=[obj.id])
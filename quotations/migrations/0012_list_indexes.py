@@ -0,0 +1,50 @@
+# Generated by Django 5.1.7 on 2026-10-18 02:29
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def add_client_name_trigram_index(apps, schema_editor):
+    """PostgreSQL only: trigram index so client_name__icontains can avoid a sequential scan.
+
+    icontains compiles to UPPER(client_name) LIKE UPPER(%s), so the index is on UPPER(client_name).
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS quotation_client_name_trgm_idx '
+        'ON quotations_quotation USING gin (UPPER(client_name) gin_trgm_ops)'
+    )
+
+
+def remove_client_name_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS quotation_client_name_trgm_idx')
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quotations', '0011_item_unit'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='item',
+            name='unit',
+            field=models.CharField(blank=True, choices=[('', ''), ('EA', 'Each'), ('PCS', 'Pieces'), ('KG', 'Kilograms'), ('LTR', 'Liters'), ('M', 'Meters'), ('BOX', 'Box'), ('SET', 'Set'), ('UNIT', 'Unit')], default='', max_length=10, verbose_name='Unit'),
+        ),
+        migrations.AddIndex(
+            model_name='quotation',
+            index=models.Index(fields=['user', '-date_created', '-id'], name='quotation_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quotation',
+            index=models.Index(fields=['quotation_number'], name='quotation_number_idx'),
+        ),
+        migrations.RunPython(add_client_name_trigram_index, remove_client_name_trigram_index),
+    ]
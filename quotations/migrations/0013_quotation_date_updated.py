@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 02:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quotations', '0012_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quotation',
+            name='date_updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-18 02:39
+
+import quotations.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quotations', '0013_quotation_date_updated'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='item',
+            name='image',
+            field=models.ImageField(blank=True, db_index=True, null=True, storage=quotations.storage.item_image_storage, upload_to='item_images/'),
+        ),
+    ]
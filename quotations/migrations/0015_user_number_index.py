@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 02:43
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quotations', '0014_item_image_storage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='quotation',
+            name='quotation_number_idx',
+        ),
+        migrations.AddIndex(
+            model_name='quotation',
+            index=models.Index(fields=['user', 'quotation_number'], name='quotation_user_number_idx'),
+        ),
+    ]
@@ -2,6 +2,8 @@ from django.db import models
 from django.conf import settings
 from django.utils import timezone
 
+from .storage import item_image_storage
+
 class Item(models.Model):
     UNIT_CHOICES = [
         ('', ''),
@@ -19,7 +21,8 @@ class Item(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     quantity = models.PositiveIntegerField(default=1)
     unit = models.CharField(max_length=10, choices=UNIT_CHOICES, default='', blank=True, verbose_name="Unit")
-    image = models.ImageField(upload_to='item_images/', null=True, blank=True)
+    # Stored by content hash and shared between items (see quotations.storage)
+    image = models.ImageField(upload_to='item_images/', storage=item_image_storage, null=True, blank=True, db_index=True)
     lead_time = models.CharField(max_length=50, blank=True, null=True, verbose_name="Lead Time")
     
     def __str__(self):
@@ -51,13 +54,34 @@ class Quotation(models.Model):
     vat_amount = models.DecimalField(max_digits=10, decimal_places=2)
     total = models.DecimalField(max_digits=10, decimal_places=2)
     date_created = models.DateTimeField(default=timezone.now)
+    date_updated = models.DateTimeField(auto_now=True)
     notes = models.TextField(blank=True, null=True, verbose_name="Additional Notes")
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-date_created', '-id'], name='quotation_user_created_idx'),
+            models.Index(fields=['user', 'quotation_number'], name='quotation_user_number_idx'),
+        ]
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The stored values, so the stats signals can tell what a save changed
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+    
+    def refresh_from_db(self, *args, **kwargs):
+        # Stale once the row is read again; the signals then query it
+        self.__dict__.pop('_loaded_values', None)
+        super().refresh_from_db(*args, **kwargs)
+    
     def __str__(self):
         return f"Quotation {(self.quotation_number or self.id).upper()} for {self.client_name}"
     
-    def calculate_totals(self):
-        self.subtotal = sum(item.total for item in self.items.all())
+    def calculate_totals(self, items=None):
+        # Pass the items when they are not saved yet (or already loaded)
+        items = self.items.all() if items is None else items
+        self.subtotal = sum(item.total for item in items)
         self.vat_amount = self.subtotal * (self.vat_percentage / 100)
         self.total = self.subtotal + self.vat_amount
         return self.total
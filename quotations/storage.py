@@ -0,0 +1,124 @@
+"""Content-addressed storage for item images.
+
+Uploads are stored as item_images/<aa>/<sha256><ext>, named after the
+SHA-256 of their contents, so uploading the same photo again (a repeat
+quotation, a converted invoice) reuses the existing file instead of
+writing a copy. A stored image is referenced by every Item whose image
+field holds its name; release_item_image() deletes the file once the last
+of them is gone.
+
+An upload reusing a file is only committed with its Item after save()
+returns, so save() and the deletions hold a per-file lock (in the shared
+cache) and save() marks the file as used. A file used in the last
+REUSE_GRACE is never deleted right away; `dedupe_item_images
+--prune-orphans` removes it later if it is still unreferenced.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.module_loading import import_string
+from contextlib import contextmanager
+from datetime import timedelta
+from functools import lru_cache
+import hashlib
+import os
+import re
+import time
+
+ITEM_IMAGE_DIR = 'item_images'
+
+REUSE_GRACE = timedelta(hours=1)
+LOCK_TIMEOUT = 30
+
+HASHED_NAME_RE = re.compile(rf'^{ITEM_IMAGE_DIR}/[0-9a-f]{{2}}/[0-9a-f]{{64}}(\.\w+)?$')
+
+
+def content_hash(content):
+    """SHA-256 of a File, leaving it rewound"""
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+def hashed_name(digest, name):
+    extension = os.path.splitext(name)[1].lower()
+    return f'{ITEM_IMAGE_DIR}/{digest[:2]}/{digest}{extension}'
+
+
+@contextmanager
+def image_lock(name):
+    """Serialize saving, reusing and deleting one stored image across processes"""
+    key = f'item_image_lock:{name}'
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    # add() only sets a missing key, atomically on every shared backend
+    while not cache.add(key, 1, LOCK_TIMEOUT):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'Could not lock {name}')
+        time.sleep(0.05)
+    try:
+        yield
+    finally:
+        cache.delete(key)
+
+
+def _used_key(name):
+    return f'item_image_used:{name}'
+
+
+def recently_used(name):
+    """Whether an upload stored or reused the image within REUSE_GRACE"""
+    return cache.get(_used_key(name)) is not None
+
+
+class ContentAddressedStorageMixin:
+    """Store files under the hash of their contents; existing blobs are reused"""
+
+    def save(self, name, content, max_length=None):
+        from django.core.files import File
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = hashed_name(content_hash(content), name or getattr(content, 'name', '') or '')
+        with image_lock(name):
+            # The Item referring to it may not be committed yet; keep it from deletion
+            cache.set(_used_key(name), 1, REUSE_GRACE.total_seconds())
+            if self.exists(name):
+                return name
+            return super().save(name, content, max_length=max_length)
+
+
+@lru_cache(maxsize=None)
+def _storage_class(backend_path):
+    backend = import_string(backend_path)
+    return type(f'ContentAddressed{backend.__name__}', (ContentAddressedStorageMixin, backend), {})
+
+
+def item_image_storage():
+    """The default storage backend (filesystem, S3, ...) made content-addressed"""
+    config = settings.STORAGES['default']
+    return _storage_class(config['BACKEND'])(**config.get('OPTIONS', {}))
+
+
+def image_references(name):
+    from .models import Item
+    return Item.objects.filter(image=name).count()
+
+
+def delete_unreferenced_image(storage, name):
+    """Delete a stored image if no Item refers to it and no upload just used it; returns whether it did"""
+    with image_lock(name):
+        if recently_used(name) or image_references(name):
+            return False
+        storage.delete(name)
+        return True
+
+
+def release_item_image(storage, name):
+    """Delete a stored image once no Item refers to it (after the transaction commits)"""
+    if not name:
+        return
+    transaction.on_commit(lambda: delete_unreferenced_image(storage, name))
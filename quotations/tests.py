@@ -1,3 +1,253 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from decimal import Decimal
+from io import StringIO
+import os
+import shutil
+import tempfile
+
+from invoices.models import Invoice
+from invoices.tests import make_invoice, make_user
+from .models import Item, Quotation
+from .storage import HASHED_NAME_RE
+
+
+def make_quotation(user, **fields):
+    """A quotation to Harbour Marine for 100.00 plus 7.5% VAT, unless `fields` say otherwise"""
+    fields = {
+        'client_name': 'Harbour Marine', 'vat_percentage': Decimal('7.5'), 'subtotal': Decimal('100.00'),
+        'vat_amount': Decimal('7.50'), 'total': Decimal('107.50'), **fields,
+    }
+    return Quotation.objects.create(user=user, **fields)
+
+
+class QuotationSaveTests(TestCase):
+    def setUp(self):
+        self.user = make_user('saver')
+        self.client.force_login(self.user)
+
+    def post_quotation(self, number, lines, status_code=302):
+        data = {
+            'quotation_number': number,
+            'client_name': 'Harbour Marine',
+            'currency': 'NGN',
+            'vat_percentage': '7.5',
+            'item_name[]': [f'Part {i}' for i in range(lines)],
+            'item_price[]': ['10.00'] * lines,
+            'item_quantity_display[]': ['2 PCS'] * lines,
+            'item_unit[]': ['PCS'] * lines,
+            'item_lead_time[]': ['2 weeks'] * lines,
+        }
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('quotation_detail'), data)
+        self.assertEqual(response.status_code, status_code)
+        return len(queries)
+
+    def test_items_saved_with_totals(self):
+        self.post_quotation('QTN-1', 3)
+        quotation = Quotation.objects.get(quotation_number='QTN-1')
+        self.assertEqual(quotation.items.count(), 3)
+        self.assertEqual(quotation.subtotal, Decimal('60.00'))
+        self.assertEqual(quotation.total, Decimal('64.50'))
+        self.assertEqual(set(quotation.items.values_list('lead_time', flat=True)), {'2 weeks'})
+
+    def test_query_count_does_not_grow_with_lines(self):
+        small = self.post_quotation('QTN-10', 10)
+        large = self.post_quotation('QTN-200', 200)
+        self.assertEqual(Quotation.objects.get(quotation_number='QTN-200').items.count(), 200)
+        # Only the backend's bulk insert batch limit may add a statement or two
+        self.assertLessEqual(large, small + 2)
+
+    def test_blank_numbers_come_from_the_sequence(self):
+        year = timezone.localdate().year
+        # A number typed in by hand is skipped by the sequence
+        self.post_quotation(f'QTN-{year}-0002', 1)
+        self.post_quotation('', 1)
+        self.post_quotation('', 1)
+        numbers = set(Quotation.objects.filter(user=self.user).values_list('quotation_number', flat=True))
+        self.assertEqual(numbers, {f'QTN-{year}-0001', f'QTN-{year}-0002', f'QTN-{year}-0003'})
+
+    def test_duplicate_number_is_rejected(self):
+        self.post_quotation('QTN-X', 1)
+        self.post_quotation('QTN-X', 1, status_code=200)
+        self.assertEqual(Quotation.objects.filter(quotation_number='QTN-X').count(), 1)
+
+
+class QuotationQueryCountTests(TestCase):
+    """Pages and exports load a quotation and its items in a fixed number of queries"""
+
+    def setUp(self):
+        # Keep rendered exports out of the project's artifact cache
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        override = override_settings(ARTIFACT_CACHE_DIR=cache_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = make_user('counter')
+        self.client.force_login(self.user)
+        self.quotation = make_quotation(self.user)
+
+    def add_items(self, count):
+        start = self.quotation.items.count()
+        self.quotation.items.add(*[
+            Item.objects.create(name=f'Line {i}', price=Decimal('10.00'), quantity=2, unit='PCS', lead_time='1 WEEK')
+            for i in range(start, start + count)
+        ])
+
+    def test_query_counts_do_not_grow_with_items(self):
+        for count in (1, 20):
+            self.add_items(count)
+            for name in ('quotation_detail', 'view_quotation', 'quotation_pdf', 'quotation_docx'):
+                with self.subTest(items=self.quotation.items.count(), view=name):
+                    # session, user, then the quotation with its owner and its items
+                    with self.assertNumQueries(4):
+                        response = self.client.get(reverse(name, args=[self.quotation.pk]))
+                    self.assertEqual(response.status_code, 200)
+
+    def test_list_query_count_does_not_grow_with_rows(self):
+        self.client.get(reverse('quotation_list'))
+        for _ in range(2):
+            for _ in range(10):
+                make_quotation(self.user)
+            self.client.get(reverse('quotation_list'))
+            # session, user, list version, cached count, page rows
+            with self.assertNumQueries(5):
+                self.client.get(reverse('quotation_list'))
+
+
+class TempMediaMixin:
+    """Keep uploaded item images out of the project's media directory"""
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+
+class ItemImageStorageTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.storage = Item._meta.get_field('image').storage
+
+    def make_item(self, content=b'photo bytes'):
+        return Item.objects.create(
+            name='Hose', price=Decimal('10.00'), quantity=1, image=SimpleUploadedFile('hose.jpg', content)
+        )
+
+    def forget_use(self, name):
+        # As if REUSE_GRACE had passed since the upload
+        cache.delete(f'item_image_used:{name}')
+
+    def test_identical_uploads_share_one_file(self):
+        first, second = self.make_item(), self.make_item()
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, HASHED_NAME_RE)
+        _, files = self.storage.listdir(os.path.dirname(first.image.name))
+        self.assertEqual(files, [os.path.basename(first.image.name)])
+
+    def test_file_goes_with_the_last_reference(self):
+        first, second = self.make_item(), self.make_item()
+        name = first.image.name
+        self.forget_use(name)
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(self.storage.exists(name))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(self.storage.exists(name))
+
+    def test_a_file_reused_before_the_release_commits_is_kept(self):
+        item = self.make_item()
+        name = item.image.name
+        self.forget_use(name)
+        with self.captureOnCommitCallbacks(execute=True):
+            item.delete()
+            # Another request uploads the same photo; its Item is not committed yet
+            self.assertEqual(self.storage.save('again.jpg', ContentFile(b'photo bytes')), name)
+        self.assertTrue(self.storage.exists(name))
+
+        # Still unreferenced once the grace period is over: the sweep removes it
+        out = StringIO()
+        call_command('dedupe_item_images', '--prune-orphans', stdout=out)
+        self.assertIn('0 orphan(s) removed', out.getvalue())
+        self.forget_use(name)
+        call_command('dedupe_item_images', '--prune-orphans', stdout=out)
+        self.assertIn('1 orphan(s) removed', out.getvalue())
+        self.assertFalse(self.storage.exists(name))
+
+
+class BulkConversionTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('converter')
+        self.client.force_login(self.user)
+
+    def make_quotation(self, number, user=None, **fields):
+        quotation = make_quotation(user or self.user, quotation_number=number, **fields)
+        quotation.items.add(
+            Item.objects.create(
+                name='Mooring rope', price=Decimal('250.00'), quantity=4, unit='M', lead_time='2 WEEKS',
+                image=SimpleUploadedFile('rope.jpg', b'rope photo'),
+            ),
+            Item.objects.create(name='Shackle', price=Decimal('12.50'), quantity=10),
+        )
+        quotation.calculate_totals()
+        quotation.save()
+        # As stored, with the totals rounded to two places
+        return Quotation.objects.get(pk=quotation.pk)
+
+    def convert(self, *quotations):
+        return self.client.post(reverse('quotation_bulk_convert'), {
+            'quotation_ids': [str(quotation.pk) for quotation in quotations],
+        })
+
+    def test_copies_every_item_field(self):
+        quotation = self.make_quotation('QTN-7', currency='USD', notes='Deliver to jetty 3')
+        self.assertRedirects(self.convert(quotation), reverse('invoice_list'), fetch_redirect_response=False)
+
+        invoice = Invoice.objects.get(user=self.user)
+        self.assertEqual(invoice.invoice_number, 'INV-QTN-7')
+        self.assertEqual(
+            (invoice.client_name, invoice.currency, invoice.notes, invoice.total),
+            ('Harbour Marine', 'USD', 'Deliver to jetty 3', quotation.total),
+        )
+        fields = ('name', 'price', 'quantity', 'unit', 'lead_time', 'image')
+        self.assertEqual(
+            sorted(invoice.items.values_list(*fields)), sorted(quotation.items.values_list(*fields))
+        )
+        # New items, sharing the stored image file rather than copying it
+        self.assertFalse(set(invoice.items.values_list('pk', flat=True)) & set(quotation.items.values_list('pk', flat=True)))
+        _, files = Item._meta.get_field('image').storage.listdir(
+            os.path.dirname(invoice.items.exclude(image='').get().image.name)
+        )
+        self.assertEqual(len(files), 1)
+
+    def test_numbers_fall_back_to_the_sequence(self):
+        taken = self.make_quotation('QTN-1')
+        make_invoice(self.user, invoice_number='INV-QTN-1', client_name='Earlier')
+        unnumbered = self.make_quotation(None)
+        first_copy, second_copy = self.make_quotation('QTN-2'), self.make_quotation('QTN-2')
+        someone_elses = self.make_quotation('QTN-3', user=make_user('other'))
+
+        self.convert(taken, unnumbered, first_copy, second_copy, someone_elses)
+        year = timezone.localdate().year
+        numbers = (
+            Invoice.objects.filter(user=self.user).exclude(client_name='Earlier')
+            .values_list('invoice_number', flat=True)
+        )
+        # Taken and repeated numbers come from the sequence; a blank one from the id
+        self.assertEqual(sorted(numbers), sorted([
+            f'INV-{year}-0001', f'INV-{unnumbered.pk}', 'INV-QTN-2', f'INV-{year}-0002',
+        ]))
+        self.assertFalse(Invoice.objects.filter(user=someone_elses.user).exists())
 
-# Create your tests here.
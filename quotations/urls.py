@@ -3,6 +3,7 @@ from . import views
 
 urlpatterns = [
     path('', views.quotation_list, name='quotation_list'),
+    path('ledger/<str:fmt>/', views.export_quotation_ledger, name='quotation_ledger'),
     path('new/', views.quotation_detail, name='quotation_detail'),
     path('<int:pk>/', views.quotation_detail, name='quotation_detail'),
     path('<int:pk>/view/', views.view_quotation, name='view_quotation'),
@@ -11,5 +12,7 @@ urlpatterns = [
     path('<int:pk>/docx/', views.quotation_docx, name='quotation_docx'),
     path('<int:pk>/delete/', views.delete_quotation, name='delete_quotation'),
     path('<int:pk>/convert/', views.convert_to_invoice, name='quotation_convert'),
+    path('convert/', views.convert_quotations_bulk, name='quotation_bulk_convert'),
+    path('<int:pk>/export/<str:fmt>/', views.prepare_quotation_export, name='prepare_quotation_export'),
     path('check-number/', views.check_quotation_number, name='check_quotation_number'),
-]
\ No newline at end of file
+]
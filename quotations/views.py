@@ -1,57 +1,53 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from .models import Quotation, Item
+from .models import Quotation
 from django.http import JsonResponse
+from django.views.decorators.http import require_POST
+from django.db import transaction
 import json
-import re
 from decimal import Decimal
 from django.http import HttpResponse
 from django.template.loader import get_template
-from invoices.utils import render_to_pdf
-from django.db.models import Q
+from invoices.utils import load_document, generate_quotation_pdf, filter_documents
+from invoices.item_utils import parse_item_rows, add_items
+from invoices.numbering_utils import reserve_document_number, peek_document_number, number_taken
+from invoices.pagination_utils import paginate_list, list_count_cache_key, PAGE_SIZE_CHOICES
 from datetime import datetime
 
 
 @login_required
 def quotation_list(request):
     quotations = Quotation.objects.filter(user=request.user).order_by('-date_created')
-    # Filters
-    q = request.GET.get('q')
-    start = request.GET.get('start')
-    end = request.GET.get('end')
-    min_amt = request.GET.get('min')
-    max_amt = request.GET.get('max')
-    if q:
-        quotations = quotations.filter(Q(client_name__icontains=q))
-    if start:
-        try:
-            start_date = datetime.strptime(start, '%Y-%m-%d').date()
-            quotations = quotations.filter(date_created__date__gte=start_date)
-        except Exception:
-            pass
-    if end:
-        try:
-            end_date = datetime.strptime(end, '%Y-%m-%d').date()
-            quotations = quotations.filter(date_created__date__lte=end_date)
-        except Exception:
-            pass
-    if min_amt:
-        try:
-            quotations = quotations.filter(total__gte=Decimal(min_amt))
-        except Exception:
-            pass
-    if max_amt:
-        try:
-            quotations = quotations.filter(total__lte=Decimal(max_amt))
-        except Exception:
-            pass
-    return render(request, 'quotations/quotation_list.html', {'quotations': quotations})
+    quotations = filter_documents(quotations, request.GET)
+    
+    # Paginate; the total row count is cached per filter combination
+    count_cache_key = list_count_cache_key(Quotation, request.user.pk, {
+        name: request.GET.get(name, '') for name in ('q', 'start', 'end', 'min', 'max')
+    })
+    page, page_range = paginate_list(request, quotations.select_related('user'), count_cache_key)
+    
+    context = {
+        'quotations': page,
+        'page_range': page_range,
+        'page_size_choices': PAGE_SIZE_CHOICES,
+    }
+    return render(request, 'quotations/quotation_list.html', context)
+
+@login_required
+def export_quotation_ledger(request, fmt):
+    """The filtered quotation list as a CSV or XLSX spreadsheet"""
+    from invoices.ledger_utils import LEDGER_FORMATS, ledger_response
+    if fmt not in LEDGER_FORMATS:
+        messages.error(request, f'Unsupported export format: {fmt}')
+        return redirect('quotation_list')
+    quotations = filter_documents(Quotation.objects.filter(user=request.user), request.GET)
+    return ledger_response(quotations, fmt)
 
 @login_required
 def quotation_detail(request, pk=None):
     if pk:
-        quotation = get_object_or_404(Quotation, pk=pk, user=request.user)
+        quotation = load_document(Quotation, pk, request.user, allow_staff=False)
     else:
         quotation = None
     
@@ -69,13 +65,8 @@ def quotation_detail(request, pk=None):
         except Exception:
             vat_pct_val = Decimal('7.5')
         
-        # Check if quotation number already exists
-        quotation_number = data.get('quotation_number') or ''
-        if quotation_number:
-            existing_quotation = Quotation.objects.filter(quotation_number=quotation_number).first()
-            if existing_quotation:
-                messages.error(request, f'Quotation number "{quotation_number}" has already been used. Please choose a different number.')
-                return render(request, 'quotations/quotation_detail.html', {'quotation': quotation})
+        # Blank numbers are assigned from the user's sequence on save
+        quotation_number = (data.get('quotation_number') or '').strip()
         
         # Create new quotation with safe defaults
         quotation = Quotation(
@@ -92,80 +83,38 @@ def quotation_detail(request, pk=None):
             notes=(data.get('notes') or ''),
             date_created=datetime.now()
         )
-        quotation.save()
         
-        # Process items
-        item_names = request.POST.getlist('item_name[]')
-        item_prices = request.POST.getlist('item_price[]')
-        item_quantity_displays = request.POST.getlist('item_quantity_display[]')
-        item_units = request.POST.getlist('item_unit[]')
-        item_lead_times = request.POST.getlist('item_lead_time[]')
-        item_images = request.FILES.getlist('item_image[]')
-        for i in range(len(item_names)):
-            name = item_names[i]
-            price_str = item_prices[i] if i < len(item_prices) else ''
-            qty_display = item_quantity_displays[i] if i < len(item_quantity_displays) else ''
-            unit = item_units[i] if i < len(item_units) else 'EA'
-            lead_time_str = item_lead_times[i] if i < len(item_lead_times) else ''
-            if name and price_str and qty_display:
-                try:
-                    price_val = Decimal(price_str)
-                    # Extract numeric value from quantity display field, ignoring any unit text
-                    qty_match = re.match(r'^(\d+(?:\.\d+)?)', qty_display.strip())
-                    if qty_match:
-                        qty_val = float(qty_match.group(1))
-                    else:
-                        qty_val = 0
-                except Exception:
-                    continue
-                image_file = item_images[i] if i < len(item_images) else None
-                item = Item.objects.create(
-                    name=name,
-                    price=price_val,
-                    quantity=qty_val,
-                    unit=unit if unit else "",
-                    image=image_file,
-                    lead_time=lead_time_str
-                )
-                quotation.items.add(item)
-        
-        # Calculate totals
-        quotation.calculate_totals()
-        quotation.save()
+        # Parse every item row first so totals are known before the insert
+        items = parse_item_rows(request, with_lead_time=True)
+        quotation.calculate_totals(items)
+        with transaction.atomic():
+            quotation.quotation_number = reserve_document_number(Quotation, request.user, quotation_number)
+            if quotation.quotation_number is None:
+                messages.error(request, f'Quotation number "{quotation_number}" has already been used. Please choose a different number.')
+                return render(request, 'quotations/quotation_detail.html', {'quotation': None, 'next_number': peek_document_number(Quotation, request.user)})
+            quotation.save()
+            add_items(quotation, items)
         
         messages.success(request, 'Quotation saved successfully!')
         return redirect('quotation_list')
     
-    return render(request, 'quotations/quotation_detail.html', {'quotation': quotation})
+    context = {'quotation': quotation}
+    if quotation is None:
+        context['next_number'] = peek_document_number(Quotation, request.user)
+    return render(request, 'quotations/quotation_detail.html', context)
 
 
 @login_required
 def quotation_pdf(request, pk):
-    if request.user.is_staff:
-        quotation = get_object_or_404(Quotation, pk=pk)
-    else:
-        quotation = get_object_or_404(Quotation, pk=pk, user=request.user)
-
-    context = {
-        'quotation': quotation,
-        'company_name': 'Skids LOGISTICS LTD',
-        'company_address': 'NO. 17 Eastern Bypass, Buchi Atako Villa, Port Harcourt',
-        'company_phone': '07035495280',
-        'company_email': 'info@skidslogistics.com',
-        'company_website': 'www.skidslogistics.com',
-        'request': request,
-    }
+    quotation = load_document(Quotation, pk, request.user)
 
-    return render_to_pdf('quotations/quotation_pdf.html', context)
+    return generate_quotation_pdf(quotation, request=request)
 
 
 
 @login_required
 def quotation_docx(request, pk):
-    if request.user.is_staff:
-        quotation = get_object_or_404(Quotation, pk=pk)
-    else:
-        quotation = get_object_or_404(Quotation, pk=pk, user=request.user)
+    quotation = load_document(Quotation, pk, request.user)
     from invoices.docx_utils import generate_quotation_docx
     return generate_quotation_docx(quotation, request=request)
 
@@ -185,43 +134,29 @@ def delete_quotation(request, pk):
 
 @login_required
 def convert_to_invoice(request, pk):
-    quotation = get_object_or_404(Quotation, pk=pk, user=request.user)
+    quotation = load_document(Quotation, pk, request.user, allow_staff=False)
     
-    # Import Invoice model here to avoid circular imports
-    from invoices.models import Invoice
-    
-    # Create a new invoice with the same data as the quotation
-    invoice = Invoice(
-        user=request.user,
-        invoice_number=f"INV-{quotation.quotation_number or quotation.id}".upper(),
-        client_name=quotation.client_name,
-        vat_percentage=quotation.vat_percentage,
-        subtotal=quotation.subtotal,
-        vat_amount=quotation.vat_amount,
-        total=quotation.total,
-        due_date=quotation.date_created.date(),
-        status='Pending',
-        notes=quotation.notes
-    )
-    invoice.save()
-    
-    # Copy items from quotation to invoice
-    for item in quotation.items.all():
-        # Create a new item with the same data
-        new_item = Item.objects.create(
-            name=item.name,
-            price=item.price,
-            quantity=item.quantity
-        )
-        invoice.items.add(new_item)
-    
-    # Calculate totals and save
-    invoice.calculate_totals()
-    invoice.save()
+    # Copies every item field (unit, image, lead time) and the currency
+    from invoices.conversion_utils import convert_quotations
+    invoice = convert_quotations([quotation])[0]
     
     messages.success(request, f'Quotation #{(quotation.quotation_number or quotation.id).upper()} successfully converted to Invoice #{invoice.invoice_number}')
     return redirect('invoice_detail', pk=invoice.id)
 
+@login_required
+@require_POST
+def convert_quotations_bulk(request):
+    """Convert the quotations ticked on the quotation list to invoices"""
+    from invoices.conversion_utils import convert_quotations
+    ids = [pk for pk in request.POST.getlist('quotation_ids') if pk.isdigit()]
+    quotations = Quotation.objects.filter(user=request.user, pk__in=ids)
+    if not ids or not quotations.exists():
+        messages.error(request, 'Select at least one quotation to convert.')
+        return redirect('quotation_list')
+    invoices = convert_quotations(quotations)
+    messages.success(request, f'Converted {len(invoices)} quotation(s) to invoices.')
+    return redirect('invoice_list')
+
 @login_required
 def check_quotation_number(request):
     """Check if a quotation number already exists"""
@@ -229,18 +164,27 @@ def check_quotation_number(request):
     if not number:
         return JsonResponse({'exists': False})
     
-    exists = Quotation.objects.filter(quotation_number=number).exists()
+    exists = number_taken(Quotation, request.user, number)
     return JsonResponse({'exists': exists})
 
 @login_required
 def view_quotation(request, pk):
     """View a quotation in detail"""
-    if request.user.is_staff:
-        quotation = get_object_or_404(Quotation, pk=pk)
-    else:
-        quotation = get_object_or_404(Quotation, pk=pk, user=request.user)
+    quotation = load_document(Quotation, pk, request.user)
     
     context = {
         'quotation': quotation,
     }
     return render(request, 'quotations/quotation_view.html', context)
+
+@login_required
+@require_POST
+def prepare_quotation_export(request, pk, fmt):
+    """Queue a PDF/DOCX export of a quotation for the render worker"""
+    from invoices.render_queue import enqueue_render_job, job_payload
+    from invoices.export_utils import EXPORT_FORMATS
+    if fmt not in EXPORT_FORMATS:
+        return JsonResponse({'error': f'Unsupported format: {fmt}'}, status=400)
+    quotation = load_document(Quotation, pk, request.user)
+    job = enqueue_render_job(request.user, quotation, fmt)
+    return JsonResponse(job_payload(job), status=202)
@@ -0,0 +1,83 @@
+/**
+ * Typeahead - suggests past client names and items on the invoice and quotation forms.
+ * Picking a suggested item fills in its last price and unit when those are still empty.
+ */
+
+(function() {
+    const script = document.currentScript;
+    const url = script.dataset.url;
+    const fields = {
+        'client_name': 'client',
+        'item_name[]': 'item',
+    };
+    const lists = {};
+    const suggestions = {client: {}, item: {}};
+    const timers = new WeakMap();
+
+    function datalist(field) {
+        if (!lists[field]) {
+            lists[field] = document.createElement('datalist');
+            lists[field].id = `typeahead-${field}`;
+            document.body.appendChild(lists[field]);
+        }
+        return lists[field];
+    }
+
+    function fetchSuggestions(input, field) {
+        const query = input.value.trim();
+        if (!query) {
+            return;
+        }
+        fetch(`${url}?field=${field}&q=${encodeURIComponent(query)}`, {credentials: 'same-origin'})
+            .then(response => response.ok ? response.json() : {results: []})
+            .then(data => {
+                const list = datalist(field);
+                list.innerHTML = '';
+                data.results.forEach(result => {
+                    suggestions[field][result.name] = result;
+                    const option = document.createElement('option');
+                    option.value = result.name;
+                    if (result.price) {
+                        option.label = `${result.price}${result.unit ? ' / ' + result.unit : ''}`;
+                    }
+                    list.appendChild(option);
+                });
+            })
+            .catch(() => {});
+    }
+
+    function fillItem(input) {
+        const result = suggestions.item[input.value];
+        const row = input.closest('tr');
+        if (!result || !row) {
+            return;
+        }
+        const price = row.querySelector('.item-price');
+        if (price && !price.value) {
+            price.value = result.price;
+            price.dispatchEvent(new Event('input', {bubbles: true}));
+        }
+        // The unit is typed after the quantity, e.g. "1 PCS"
+        const quantity = row.querySelector('.item-quantity-display');
+        if (quantity && result.unit && result.unit !== 'EA' && /^\d+(\.\d+)?$/.test(quantity.value.trim())) {
+            quantity.value = `${quantity.value.trim()} ${result.unit}`;
+            quantity.dispatchEvent(new Event('input', {bubbles: true}));
+        }
+    }
+
+    document.addEventListener('input', function(event) {
+        const input = event.target;
+        const field = fields[input.name];
+        if (!field) {
+            return;
+        }
+        input.setAttribute('list', datalist(field).id);
+        input.setAttribute('autocomplete', 'off');
+        if (field === 'item' && suggestions.item[input.value]) {
+            fillItem(input);
+            return;
+        }
+        clearTimeout(timers.get(input));
+        timers.set(input, setTimeout(() => fetchSuggestions(input, field), 150));
+    });
+})();
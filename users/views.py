@@ -264,35 +264,91 @@ def dashboard(request):
     response['Expires'] = '0'
     return response
 
+REVENUE_MONTH_CHOICES = (6, 12, 24)
+
+def get_revenue_window(request):
+    """Number of months to chart, taken from ?months= and limited to REVENUE_MONTH_CHOICES"""
+    try:
+        months = int(request.GET.get('months', REVENUE_MONTH_CHOICES[0]))
+    except (TypeError, ValueError):
+        return REVENUE_MONTH_CHOICES[0]
+    return months if months in REVENUE_MONTH_CHOICES else REVENUE_MONTH_CHOICES[0]
+
+def _invoice_monthly_totals(invoices_qs, since):
+    """Invoice totals per calendar month from `since`, read from the invoices with one GROUP BY"""
+    from django.db.models import Sum
+    from django.db.models.functions import TruncMonth
+    
+    rows = (
+        invoices_qs.filter(date_created__gte=since)
+        .annotate(month=TruncMonth('date_created'))
+        .values('month')
+        .annotate(amount=Sum('total'))
+        .order_by('month')
+    )
+    totals = {}
+    for row in rows:
+        month = timezone.localtime(row['month']) if timezone.is_aware(row['month']) else row['month']
+        totals[(month.year, month.month)] = row['amount'] or Decimal('0.00')
+    return totals
+
+def get_monthly_revenue(source, months=6):
+    """Invoice totals per calendar month for the last `months` months, oldest first.
+    
+    `source` is either the user's UserInvoiceStats rollup, read as is, or
+    an Invoice queryset, aggregated in a single GROUP BY query. Months
+    without invoices are reported with an amount of 0.
+    """
+    from invoices.models import UserInvoiceStats
+    
+    now = timezone.localtime(timezone.now())
+    # Step back whole calendar months from the first day of the current month
+    month_index = now.year * 12 + (now.month - 1) - (months - 1)
+    window_start = now.replace(
+        year=month_index // 12, month=month_index % 12 + 1, day=1,
+        hour=0, minute=0, second=0, microsecond=0,
+    )
+    
+    if source.model is UserInvoiceStats:
+        totals = source.monthly_totals(window_start.date())
+    else:
+        totals = _invoice_monthly_totals(source, window_start)
+    
+    label_format = '%b' if months <= 12 else '%b %y'
+    monthly_revenue = []
+    for offset in range(months):
+        index = month_index + offset
+        month_date = window_start.replace(year=index // 12, month=index % 12 + 1)
+        amount = totals.get((month_date.year, month_date.month), Decimal('0.00'))
+        monthly_revenue.append({'month': month_date.strftime(label_format), 'amount': float(amount)})
+    return monthly_revenue
+
 def get_dashboard_context(request):
-    # Get counts for dashboard statistics
-    from invoices.models import Invoice
+    # Get counts for dashboard statistics from the precomputed rollup
+    from invoices.models import Invoice, UserInvoiceStats
     from quotations.models import Quotation
     
+    stats = UserInvoiceStats.objects.filter(user=request.user)
+    
     # Invoice counts
     invoices_qs = Invoice.objects.filter(user=request.user)
-    invoice_count = invoices_qs.count()
-    paid_count = invoices_qs.filter(status='Paid').count()
-    pending_count = invoices_qs.filter(status='Pending').count()
-    overdue_count = sum(1 for invoice in invoices_qs if invoice.is_overdue())
+    status_counts = stats.invoice_status_counts()
+    invoice_count = sum(status_counts.values())
+    paid_count = status_counts.get('Paid', 0)
+    pending_count = status_counts.get('Pending', 0)
+    # Overdue depends on today's date, so it cannot be rolled up ahead of time
+    overdue_count = invoices_qs.overdue().count()
     
     # Quotation count
-    quotation_count = Quotation.objects.filter(user=request.user).count()
+    quotation_count = stats.quotation_count()
     
     # Recent items
     recent_invoices = invoices_qs.order_by('-date_created')[:5]
     recent_quotations = Quotation.objects.filter(user=request.user).order_by('-date_created')[:5]
     
-    # Monthly revenue for last 6 months
-    monthly_revenue = []
-    now = timezone.now()
-    for i in range(5, -1, -1):
-        month_date = (now - timedelta(days=30*i))
-        year = month_date.year
-        month = month_date.month
-        month_label = month_date.strftime('%b')
-        month_total = sum((inv.total for inv in invoices_qs.filter(date_created__year=year, date_created__month=month)), Decimal('0.00'))
-        monthly_revenue.append({'month': month_label, 'amount': float(month_total)})
+    # Monthly revenue for the selected window of calendar months
+    revenue_months = get_revenue_window(request)
+    monthly_revenue = get_monthly_revenue(stats, revenue_months)
     
     # Status data for chart
     invoice_status = [
@@ -311,6 +367,8 @@ def get_dashboard_context(request):
         'recent_invoices': recent_invoices,
         'recent_quotations': recent_quotations,
         'monthly_revenue': json.dumps(monthly_revenue),
+        'revenue_months': revenue_months,
+        'revenue_month_choices': REVENUE_MONTH_CHOICES,
         'invoice_status': json.dumps(invoice_status),
     }
     
@@ -330,7 +388,7 @@ def admin_dashboard(request):
 def get_admin_dashboard_context(request):
     from django.core.paginator import Paginator
     from quotations.models import Quotation
-    from invoices.models import Invoice
+    from invoices.models import Invoice, UserInvoiceStats
 
     users = CustomUser.objects.all().order_by('-date_joined')
     total_users = users.count()
@@ -347,12 +405,13 @@ def get_admin_dashboard_context(request):
     invoice_list = Invoice.objects.all().order_by('-date_created')
     invoice_paginator = Paginator(invoice_list, 10)
     
-    # Real-time status counts
+    # Status counts from the precomputed rollup; overdue is date dependent
+    invoice_status_counts = UserInvoiceStats.objects.invoice_status_counts()
     status_counts = {
-        'total': invoice_list.count(),
-        'paid': invoice_list.filter(status='Paid').count(),
-        'pending': invoice_list.filter(status='Pending').count(),
-        'overdue': len([inv for inv in invoice_list if inv.is_overdue()])
+        'total': sum(invoice_status_counts.values()),
+        'paid': invoice_status_counts.get('Paid', 0),
+        'pending': invoice_status_counts.get('Pending', 0),
+        'overdue': invoice_list.overdue().count()
     }
     invoice_page = request.GET.get('invoice_page')
     invoices = invoice_paginator.get_page(invoice_page)